@@ -16,27 +16,41 @@ from dotenv import load_dotenv
 
 import time
 import json
+import tempfile
 
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 
-from flask import Flask, request, Response, jsonify
+from flask import Flask, request, Response, jsonify, stream_with_context, send_file
 from flask_cors import CORS, cross_origin
 from bson import json_util
 
-from download_foodhalls_as_csv import get_csv
+from download_foodhalls_as_csv import stream_csv
+from delta_export import DeltaExport, decode_watermark, ensure_delta_indexes
+from export_snapshots import SnapshotManager
+from columnar_export import COLUMNAR_FORMATS, write_columnar
 
 from webcrawler.ResearchHall import ResearchHall
 from webcrawler.ResearchVenue import ResearchVenue
+from webcrawler.jobs import JobQueue, JOB_DONE, JOB_FAILED, default_worker_count
+from webcrawler.job_handlers import research_hall_job, research_venue_job
+from webcrawler.process_pool import ProcessPool
+from webcrawler import llm_usage, metrics, profiling, tracing
+from webcrawler.runs import PipelineRuns
+from webcrawler.alerts import AlertSeenStore, normalize_hall_name, normalize_venue_name
+from webcrawler.feeds import AlertFeedReader, GOOGLE_ALERT_FEEDS
 
 load_dotenv(".env.local")
 load_dotenv()
 
 mongo_uri = os.getenv("MONGO_CONNECTION")
 mongo_client = MongoClient(mongo_uri, server_api=ServerApi('1'))
-mongodb = mongo_client.brokerai
+# MONGO_DATABASE points the API at another database, e.g. one seeded by benchmarks.load_test
+mongodb = mongo_client[os.getenv("MONGO_DATABASE", "brokerai")]
 foodhall_collection = mongodb["foodhalls_csv"]
 venue_collection = mongodb["venues_csv"]
+llm_usage_collection = mongodb["llm_usage"]
+llm_usage.set_ledger(llm_usage_collection)
 
 try:
     mongo_client.admin.command('ping')
@@ -44,7 +58,19 @@ try:
 except Exception as e:
     print(e)
 
+try:
+    ensure_delta_indexes(foodhall_collection)
+    ensure_delta_indexes(venue_collection)
+except Exception as e:
+    print(e)
+
 app = Flask(__name__)
+# lets a fronting nginx/apache send snapshot files itself
+app.use_x_sendfile = os.getenv("USE_X_SENDFILE", "false").lower() == "true"
+
+snapshot_manager = SnapshotManager(mongodb, [foodhall_collection.name, venue_collection.name])
+if os.getenv("EXPORT_SNAPSHOTS", "true").lower() == "true":
+    snapshot_manager.start()
 
 def get_chrome_options():
     options = Options()
@@ -72,16 +98,86 @@ def pog():
 @app.get("/download_csv/<collection_name>")
 @cross_origin()
 def download_csv(collection_name):
-    # with open("outputs/Adjacency.csv") as fp:
-    #     csv = fp.read()
-    csv = get_csv(collection_name= collection_name)[0]
+    # serve the pre-built gzipped snapshot when there is one; send_file handles
+    # ETag/If-None-Match and Range requests and hands the file to the server's sendfile
+    snapshot = snapshot_manager.get(collection_name)
+    if snapshot is not None and 'gzip' in request.accept_encodings:
+        response = send_file(
+            snapshot.path,
+            mimetype="text/csv",
+            as_attachment=True,
+            download_name=collection_name + '.csv',
+            etag=snapshot.etag,
+            conditional=True)
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+        return response
+
+    # stream rows straight from a batched cursor instead of building the whole CSV in memory
+    csv = stream_csv(mongodb[collection_name])
 
     return Response(
-        csv,
+        stream_with_context(csv),
         mimetype="text/csv",
         headers={"Content-disposition":
                  "attachment; filename=" + collection_name + '.csv'})
 
+@app.get("/download_csv/<collection_name>/delta")
+@cross_origin()
+def download_csv_delta(collection_name):
+    """Returns only the documents changed since the `since` watermark, plus deletions.
+    REQUEST args:
+        since: watermark token from a previous export (omit for a full export)
+        format: csv | jsonl
+    The next watermark is returned in the X-Export-Watermark header.
+    """
+    since = request.args.get('since', default=None, type=str)
+    export_format = request.args.get('format', default='csv', type=str)
+    if export_format not in ('csv', 'jsonl'):
+        return jsonify({"error": f"unsupported format: {export_format}"}), 400
+
+    try:
+        since = decode_watermark(since) if since else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    delta = DeltaExport(mongodb[collection_name], since=since)
+    if export_format == 'jsonl':
+        body, mimetype = delta.stream_jsonl(), "application/x-ndjson"
+    else:
+        body, mimetype = delta.stream_csv(), "text/csv"
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-disposition":
+                 "attachment; filename=" + collection_name + '_delta.' + export_format,
+                 "X-Export-Watermark": delta.watermark,
+                 "Access-Control-Expose-Headers": "X-Export-Watermark"})
+
+@app.get("/download_columnar/<collection_name>")
+@cross_origin()
+def download_columnar(collection_name):
+    """Returns the collection as typed columns, nested fields kept as struct/list columns.
+    REQUEST args:
+        format: parquet | arrow
+    """
+    export_format = request.args.get('format', default='parquet', type=str)
+    if export_format not in COLUMNAR_FORMATS:
+        return jsonify({"error": f"unsupported format: {export_format}"}), 400
+
+    # parquet writes its footer last, so build into an anonymous temp file and send that
+    fp = tempfile.TemporaryFile()
+    write_columnar(mongodb[collection_name], fp, export_format)
+    fp.seek(0)
+
+    mimetype, extension = COLUMNAR_FORMATS[export_format]
+    return send_file(
+        fp,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=collection_name + extension)
+
 @app.get('/test_gpt')
 @cross_origin()
 def test_gpt(): 
@@ -149,72 +245,200 @@ def get_foodhalls():
 
     return res
 
+# research runs in supervised child processes so a hung chromedriver or a leak can't take the API down
+crawl_pool = None
+if os.getenv("CRAWL_PROCESS_POOL", "true").lower() == "true":
+    # where the children and this process, which runs discovery, can't share the LLM
+    # rate limit buckets they split the limits between them (see webcrawler/llm_scheduler.py)
+    crawl_workers = default_worker_count()
+    os.environ.setdefault("LLM_QUOTA_PROCESSES", str(crawl_workers + 1))
+    crawl_pool = ProcessPool(crawl_workers)
+
+job_queue = JobQueue(mongodb["crawl_jobs"], process_pool=crawl_pool)
+job_queue.register("venue", research_venue_job)
+job_queue.register("hall", research_hall_job)
+job_queue.start()
+
+def crawl_payload(search_key, source):
+    """returns the job payload of a crawl request; ?profile=1 profiles the job (see webcrawler/profiling.py)"""
+    payload = {"search_key": search_key, "source": source}
+    if request.args.get('profile') == '1':
+        payload["profile"] = True
+    return payload
+
+def queued_response(job_id, coalesced):
+    res = {"status": "queued", "job_id": job_id, "coalesced": coalesced}
+    # a request that attached to a crawl already in flight gets that crawl, profiled or not
+    if request.args.get('profile') == '1' and not coalesced:
+        res["profile"] = f"/crawler/jobs/{job_id}/profile"
+    return res
+
 @app.get("/crawler/venues/new/<search_key>")
 @cross_origin()
 def search_venue(search_key, source = None):
-    def task(search_key: str, mongo_collection): 
-        hall = ResearchVenue(venue_name=search_key, mongo_collection=mongo_collection, source = source)
-        print(hall)
-        print("Done!")
+    # a second request for the same venue attaches to the crawl already in flight
+    job_id, coalesced = job_queue.submit("venue", crawl_payload(search_key, source),
+                                         dedupe_key=normalize_venue_name(search_key))
 
-    threading.Thread(target=task, args=(search_key,venue_collection)).start()
-    
-    return "{ 'status': 'success' }"
+    res = jsonify(queued_response(job_id, coalesced))
+    res.status_code = 202
+    return res
 
 @app.get("/crawler/new/<search_key>")
 @cross_origin()
 def start_new_crawl(search_key, source = None):
-    def task(search_key: str): 
-        hall = ResearchHall(foodhall_collection, search_key.title(), source = source)
-        hall.run_in_parallel()
-        print(hall)
-        print("Done!")
-
-    threading.Thread(target=task, args=(search_key,)).start()
-    
-    return "{ 'status': 'success' }"
+    # a second request for the same hall attaches to the crawl already in flight
+    job_id, coalesced = job_queue.submit("hall", crawl_payload(search_key, source),
+                                         dedupe_key=normalize_hall_name(search_key))
 
+    res = jsonify(queued_response(job_id, coalesced))
+    res.status_code = 202
+    return res
 
-def get_relevant_halls(): # fix this 
-    """returns list of relevant halls"""
-    options = get_chrome_options()
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus scrape endpoint: crawl timings plus current queue and pool gauges"""
+    try:
+        stats = job_queue.stats()
+        for status, count in stats["jobs"].items():
+            metrics.set_gauge(f"crawl_jobs_{status}", count)
+        metrics.set_gauge("crawl_workers", stats["workers"])
+        metrics.set_gauge("crawl_workers_active", stats["active"])
+    except Exception as e:
+        print(f"Error reading crawl job stats: {e}")
+    payload, content_type = metrics.render()
+    return Response(payload, mimetype=content_type)
+
+@app.get("/crawler/jobs")
+@cross_origin()
+def get_crawl_jobs_stats():
+    """Returns queue depth per status and worker usage"""
+    return jsonify(job_queue.stats())
 
-    # Initialize browser instances
-    browser = create_browser()
-    new_food_hall_article_links = CrawlerTools.scrape_google_alert(browser=browser)
-    browser.quit()
+@app.get("/crawler/llm_usage")
+@cross_origin()
+def get_llm_usage():
+    """Returns LLM tokens and cost grouped by field, call_site, model, entity, job_id or task"""
+    group_by = request.args.get('group_by', default='field', type=str)
+    if group_by not in ("field", "call_site", "model", "entity", "job_id", "task"):
+        return jsonify({"error": f"can't group by {group_by}"}), 400
+    job_id = request.args.get('job_id', default=None, type=str)
+    days = request.args.get('days', default=30, type=int)
+    return jsonify(llm_usage.usage_report(llm_usage_collection, group_by, job_id=job_id, days=days))
+
+@app.get("/crawler/jobs/<job_id>")
+@cross_origin()
+def get_crawl_job(job_id):
+    """Returns status of a crawl job"""
+    job = job_queue.get(job_id, include_result=False)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(json.loads(json_util.dumps(job)))
+
+@app.get("/crawler/jobs/<job_id>/result")
+@cross_origin()
+def get_crawl_job_result(job_id):
+    """Returns the researched document once a crawl job is done, 202 while it is still running.
+    REQUEST args:
+        wait: seconds to wait for the job to finish before answering (max 60)
+    """
+    wait = min(request.args.get('wait', default=0, type=float), 60)
+    job = job_queue.wait(job_id, wait) if wait > 0 else job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    if job["status"] == JOB_FAILED:
+        return jsonify({"status": job["status"], "error": job.get("error")}), 500
+    if job["status"] != JOB_DONE:
+        return jsonify({"status": job["status"]}), 202
+    return jsonify({"status": job["status"], "result": json.loads(json_util.dumps(job.get("result")))})
+
+@app.get("/crawler/jobs/<job_id>/profile")
+@cross_origin()
+def get_crawl_job_profile(job_id):
+    """Returns the profile summary of a job submitted with ?profile=1, with links to its flame graph and trace files"""
+    summary_path = profiling.profile_path(job_id, "summary.json")
+    if summary_path is None:
+        return jsonify({"error": "no profile for this job (yet)"}), 404
+    with open(summary_path) as fp:
+        summary = json.load(fp)
+    summary["artifacts"] = {artifact: f"/crawler/jobs/{job_id}/profile/{artifact}"
+                            for artifact in ("stacks.collapsed", "trace.json")}
+    return jsonify(summary)
+
+@app.get("/crawler/jobs/<job_id>/profile/<artifact>")
+@cross_origin()
+def get_crawl_job_profile_artifact(job_id, artifact):
+    """Downloads stacks.collapsed (flame graph, e.g. speedscope.app) or trace.json (ui.perfetto.dev)"""
+    path = profiling.profile_path(job_id, artifact)
+    if path is None:
+        return jsonify({"error": "artifact not found"}), 404
+    return send_file(os.path.abspath(path), as_attachment=True)
+
+@app.get("/crawler/jobs/<job_id>/trace")
+@cross_origin()
+def get_crawl_job_trace(job_id):
+    """Returns a job's spans and the critical path of its latency (CRAWL_TRACE_EXPORT=file, see webcrawler/tracing.py)"""
+    spans = tracing.load_spans(job_id)
+    if not spans:
+        return jsonify({"error": "no trace for this job"}), 404
+    path = tracing.critical_path(spans)
+    return jsonify({"spans": spans, "critical_path": [{key: record[key] for key in ("span_id", "name", "start", "self")}
+                                                      for record in path]})
+
+alert_store = AlertSeenStore(mongodb, foodhall_collection)
+alert_feed_reader = AlertFeedReader(mongodb["alert_feeds"])
+
+def get_relevant_halls():
+    """returns list of relevant halls not seen in earlier runs"""
+    if GOOGLE_ALERT_FEEDS:
+        # conditional GETs against the alert feeds, no browser needed
+        new_food_hall_article_links = alert_feed_reader.read_links()
+    else:
+        browser = create_browser()
+        try:
+            new_food_hall_article_links = CrawlerTools.scrape_google_alert(browser=browser)
+        finally:
+            browser.quit()
+
+    res = CrawlerTools.determine_food_halls_in_parallel(new_food_hall_article_links, seen_store=alert_store)
+    if GOOGLE_ALERT_FEEDS:
+        # a feed is marked read only once all of its articles were classified or given up on,
+        # so failed ones are read again up to ALERT_ARTICLE_MAX_ATTEMPTS times
+        alert_feed_reader.commit(unprocessed=alert_store.filter_new_urls(new_food_hall_article_links))
 
-    res = CrawlerTools.determine_food_halls_in_parallel(new_food_hall_article_links)
-    
     return {
         "relevant_halls": res
     }
 
+# a hall counts as known once its crawl is submitted; ones the daily budget skipped carry over to the next run
+new_halls_runs = PipelineRuns(mongodb["crawl_runs"], job_queue, lambda: get_relevant_halls()['relevant_halls'],
+                              on_dispatch=lambda item: alert_store.mark_halls(
+                                  [{"food_hall_name": item["name"], "source": item["source"]}]))
+# runs whose process died; live runs of other API processes keep their lease
+new_halls_runs.fail_interrupted()
+if os.getenv("NEW_HALLS_RUN_HOUR"):
+    new_halls_runs.schedule_daily(int(os.getenv("NEW_HALLS_RUN_HOUR")))
+
 @app.get("/crawler/new_halls_today")
 @cross_origin()
 def get_new_halls_today():
-    """Reads from Google alerts and adds food halls to database"""
-
-    # collect list of food hall names to research
-    new_hall_list = get_relevant_halls()['relevant_halls']  
-    
-    # number of food halls researched in an iteration 
-    batch_size = 1
-
-    # reserach iteration 
-    wait_time = 60 * 10
+    """Reads from Google alerts and adds food halls to database.
+    Starts a background run and returns its id; progress is at /crawler/runs/<run_id>
+    """
+    run_id = new_halls_runs.start_run()
 
-    with app.app_context():
-        count = 0
-        for hall in new_hall_list:
-            start_new_crawl(hall['food_hall_name'], source=hall['source'])
-            count += 1
-            if(count == batch_size):
-                time.sleep(wait_time)
-                count = 0
+    res = jsonify({"status": "started", "run_id": run_id})
+    res.status_code = 202
+    return res
 
-    # Check database for valid research 
-    return jsonify({"status": "success"})
+@app.get("/crawler/runs/<run_id>")
+@cross_origin()
+def get_crawl_run(run_id):
+    """Returns progress of a new_halls_today run"""
+    run = new_halls_runs.get(run_id)
+    if run is None:
+        return jsonify({"error": "run not found"}), 404
+    return jsonify(json.loads(json_util.dumps(run)))
 
 @app.route("/done")
 def finish_page():
@@ -226,4 +450,4 @@ def finish_page():
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0")
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
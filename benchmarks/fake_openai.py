@@ -0,0 +1,146 @@
+"""A local stand-in for the Azure OpenAI chat completions API.
+
+usage:
+    python -m benchmarks.fake_openai --port 8090 --latency 0.8 --jitter 0.2
+
+Answers POST .../chat/completions (the Azure deployment path the openai
+client uses) with canned responses from fixtures/llm_responses.json: the
+first rule whose regex matches the last user message wins, "{excerpt}" in a
+response is replaced with the start of that message, and link selection
+prompts get the first offered link back. Each answer waits latency seconds
+(+- jitter, seeded so runs repeat) and reports word-count based token usage,
+so cost accounting and the token metrics still see numbers. With --rpm set
+it answers calls over that many per minute with a 429 and a Retry-After
+header, as an exhausted Azure quota does. Point AZURE_OPENAI_ENDPOINT at its
+url.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+DEFAULT_RESPONSE = '{"data": null}'
+
+def count_tokens(text: str) -> int:
+    """roughly what the tokenizer would say: 4 tokens per 3 words"""
+    return len(text.split()) * 4 // 3
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if not self.path.split("?")[0].endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        wait = self.server.admit()
+        if wait:
+            body = json.dumps({"error": {"code": "429", "message": "Rate limit exceeded"}}).encode("utf-8")
+            self.send_response(429)
+            self.send_header("Retry-After", str(wait))
+        else:
+            body = json.dumps(self.server.complete(request, self.path)).encode("utf-8")
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeOpenAI(ThreadingHTTPServer):
+    """Canned chat completions on 127.0.0.1:port (0 picks a free port), served from a daemon thread."""
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, jitter: float = 0.0, seed: int = 42,
+                 responses: str = os.path.join(FIXTURES, "llm_responses.json"), rpm: int = 0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.rpm = rpm
+        self.rate_limited = 0
+        self._admitted = deque()
+        with open(responses) as fp:
+            self.rules = [(re.compile(rule["match"]), rule["response"]) for rule in json.load(fp)]
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def answer(self, prompt: str) -> str:
+        if "links to choose from" in prompt:
+            links = re.findall(r'"link": "([^"]+)"', prompt)
+            return json.dumps({"link": links[0]}) if links else DEFAULT_RESPONSE
+        for pattern, response in self.rules:
+            if pattern.search(prompt):
+                return response.replace("{excerpt}", " ".join(prompt.split()[:60]))
+        return DEFAULT_RESPONSE
+
+    def admit(self) -> int:
+        """returns 0 if a call fits in the last minute's rpm, else the whole seconds until one would"""
+        if not self.rpm:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            while self._admitted and now - self._admitted[0] >= 60:
+                self._admitted.popleft()
+            if len(self._admitted) < self.rpm:
+                self._admitted.append(now)
+                return 0
+            self.rate_limited += 1
+            return max(1, int(60 - (now - self._admitted[0]) + 0.999))
+
+    def complete(self, request: dict, path: str) -> dict:
+        messages = request.get("messages", [])
+        prompt = next((message["content"] for message in reversed(messages) if message["role"] == "user"), "")
+        content = self.answer(prompt)
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        if delay:
+            time.sleep(delay)
+
+        prompt_tokens = sum(count_tokens(message.get("content") or "") for message in messages)
+        completion_tokens = count_tokens(content)
+        # .../deployments/<model>/chat/completions
+        model = path.split("/deployments/", 1)[-1].split("/", 1)[0] if "/deployments/" in path else request.get("model")
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve canned chat completions in place of Azure OpenAI.")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+- seconds of random latency")
+    parser.add_argument("--responses", default=os.path.join(FIXTURES, "llm_responses.json"))
+    parser.add_argument("--rpm", type=int, default=0, help="calls per minute answered before 429s, 0 for no limit")
+    args = parser.parse_args()
+    server = FakeOpenAI(args.port, args.latency, args.jitter, responses=args.responses, rpm=args.rpm)
+    print(f"Serving completions on {server.url} (AZURE_OPENAI_ENDPOINT={server.url})")
+    server.serve_forever()
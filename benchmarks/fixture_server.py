@@ -0,0 +1,98 @@
+"""Serves the benchmark fixture corpus over local HTTP.
+
+usage:
+    python -m benchmarks.fixture_server --port 8089
+
+/pages/... are the saved venue, food hall and news pages under
+benchmarks/fixtures/pages. /search?q=... renders a Google-like results page
+(the `#search .g a` markup make_google_search reads) from
+fixtures/search_index.json: the first entry all of whose keywords appear in
+the query decides the results. Point GOOGLE_SEARCH_URL at <url>/search.
+"""
+import argparse
+import html
+import json
+import os
+import threading
+import urllib.parse
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+class _Handler(SimpleHTTPRequestHandler):
+    server_version = "BrokerAIFixtures/1.0"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=FIXTURES, **kwargs)
+
+    def do_GET(self):
+        parsed = urllib.parse.urlparse(self.path)
+        if parsed.path != "/search":
+            return super().do_GET()
+        query = urllib.parse.parse_qs(parsed.query).get("q", [""])[0]
+        body = self.server.render_search(query).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class FixtureServer(ThreadingHTTPServer):
+    """The fixture site on 127.0.0.1:port (0 picks a free port), served from a daemon thread."""
+    daemon_threads = True
+
+    def __init__(self, port: int = 0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        with open(os.path.join(FIXTURES, "search_index.json")) as fp:
+            self.search_index = json.load(fp)
+        with open(os.path.join(FIXTURES, "serp.html")) as fp:
+            self.serp = fp.read()
+        with open(os.path.join(FIXTURES, "serp_result.html")) as fp:
+            self.serp_result = fp.read()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def search_url(self) -> str:
+        return f"{self.url}/search"
+
+    def search_results(self, query: str) -> list[str]:
+        """returns the fixture paths that a search for query finds"""
+        words = set(query.lower().split())
+        for entry in self.search_index:
+            if set(entry["keywords"].split()) <= words:
+                return entry["results"]
+        return []
+
+    def render_search(self, query: str) -> str:
+        results = []
+        for path in self.search_results(query):
+            with open(os.path.join(FIXTURES, path.lstrip("/")), errors="replace") as fp:
+                page = fp.read(4096)
+            title = page.split("<title>", 1)[-1].split("</title>", 1)[0] if "<title>" in page else path
+            results.append(self.serp_result.format(url=html.escape(self.url + path), title=title,
+                                                   snippet=html.escape(query)))
+        return self.serp.format(query=html.escape(query), results="\n".join(results))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fixture-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the benchmark fixture pages and search results.")
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+    server = FixtureServer(args.port)
+    print(f"Serving fixtures on {server.url} (GOOGLE_SEARCH_URL={server.search_url})")
+    server.serve_forever()
@@ -0,0 +1,362 @@
+"""Load test for the read and export endpoints the dashboard uses.
+
+usage:
+    python -m benchmarks.load_test seed --mongo mongodb://localhost:27017 --halls 20000 --venues 5000
+    python -m benchmarks.load_test run --mongo mongodb://localhost:27017 --out load.json
+    python -m benchmarks.load_test run --mongo mongodb://localhost:27017 --baseline load.json --concurrency 16
+    python -m benchmarks.load_test run --url http://staging:5000 --pid 4242 --mix "/api/foodhalls/count@3,/api/foodhalls/?limit=10@1"
+
+seed fills --database (brokerai_load by default, never the real one unless
+asked) with synthetic food halls and venues shaped like what updateDB
+writes: research fields, their _research metadata and sources.
+
+run starts app.py against that database (MONGO_DATABASE, PORT, no process
+pool, no export snapshots unless --snapshots) or drives --url instead. Each
+endpoint of the mix is first loaded on its own for --duration seconds, then
+the whole mix together, with --concurrency keep-alive clients. Endpoints are
+`path@weight` pairs; {offset} in a path becomes a random offset below
+--max-offset. Per endpoint it reports p50 / p95 / p99 latency, requests and
+MB per second, errors, and the server's peak resident memory and growth over
+the phase (the process group of the app it started, or --pid with --url).
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+from webcrawler.freshness import research_metadata
+from webcrawler.process_pool import group_rss_mb
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE = "brokerai_load"
+FOODHALL_COLLECTION = "foodhalls_csv"
+VENUE_COLLECTION = "venues_csv"
+
+DEFAULT_MIX = {
+    "/api/foodhalls/?limit=10&offset={offset}": 6,
+    "/api/foodhalls/?limit=100&offset={offset}": 1,
+    "/api/foodhalls/count": 3,
+    f"/download_csv/{FOODHALL_COLLECTION}": 1,
+    f"/download_csv/{VENUE_COLLECTION}": 1,
+}
+
+CITIES = [("Portland", "OR"), ("Tacoma", "WA"), ("Seattle", "WA"), ("Denver", "CO"), ("Austin", "TX"),
+          ("Chicago", "IL"), ("Atlanta", "GA"), ("Boston", "MA"), ("Nashville", "TN"), ("Phoenix", "AZ")]
+CUISINES = ["Mexican", "Italian", "Japanese", "Vietnamese", "Korean", "Thai", "Indian", "Seafood", "BBQ", "Bakery"]
+COMPANIES = ["Common Table Hospitality", "Tideline Partners", "Urban Market Group", "Cascade Live Entertainment",
+             "Foodworks Management", "Harbor & Main"]
+
+def synthetic_hall(i: int, rng: random.Random, now: datetime) -> dict:
+    city, state = rng.choice(CITIES)
+    source = {"source": f"https://example.com/halls/{i}", "label": "Location"}
+    data = {
+        "city": city,
+        "state": state,
+        "square_footage": rng.randrange(8000, 120000, 500),
+        "food": rng.randint(4, 40),
+        "bars": rng.randint(0, 5),
+        "retail": rng.randint(0, 10),
+        "types_of_food_stalls": rng.sample(CUISINES, rng.randint(2, 6)),
+        "population_density": f"{rng.randint(500, 30000)}/sq.miles",
+        "median_income": str(rng.randrange(35000, 140000, 1000)),
+        "age_distribution": {"0-17": f"{rng.randint(10, 25)}%", "18-34": f"{rng.randint(15, 40)}%",
+                             "35-64": f"{rng.randint(25, 45)}%"},
+        "composition": rng.sample(["office", "retail", "residential", "cultural", "industrial"], 3),
+        "public_transport": rng.sample(["bus", "train", "streetcar", "bike", "ferry"], 2),
+        "parking_spots": rng.choice([None, rng.randint(50, 1500)]),
+        "parking_fees": f"${rng.randint(1, 8)}/hr",
+        "peak_time_availability": "6:30pm",
+        "foot_traffic": f"{rng.randint(100, 5000)}/hr",
+        "annual_visitor_count": rng.randrange(100000, 5000000, 1000),
+        "lease_rates": f"${rng.randint(30, 120)}/sq.ft",
+        "occupancy_rate": f"{rng.randint(60, 100)}%",
+        "year_established": rng.randint(1890, 2024),
+        "renovation_history": rng.choice([None, "Restored warehouse, converted to a food hall"]),
+        "owner": rng.choice(COMPANIES),
+        "contact": f"leasing{i}@example.com",
+        "management_company": rng.choice(COMPANIES),
+    }
+    researched_at = now - timedelta(days=rng.randint(0, 120))
+    return {
+        "name": f"synthetic food hall {i}",
+        "article_source": f"https://news.example.com/articles/{i}",
+        "createdAt": researched_at - timedelta(days=rng.randint(0, 365)),
+        "updatedAt": researched_at,
+        **data,
+        "_research": {key.split(".", 1)[1]: meta
+                      for key, meta in research_metadata(list(data), data, source, now=researched_at).items()},
+        "sources": [{"source": f"https://example.com/halls/{i}/{field}", "label": field.replace("_", " ").title()}
+                    for field in ("location", "square_footage", "owner", "lease_rates")],
+    }
+
+def synthetic_venue(i: int, rng: random.Random, now: datetime) -> dict:
+    city, _ = rng.choice(CITIES)
+    source = {"source": f"https://example.com/venues/{i}", "label": "Capacity"}
+    data = {
+        "city": city,
+        "capacity": rng.randrange(200, 20000, 50),
+        "owned": rng.choice(["Independently owned", "Live Nation", "AEG Presents", "City owned"]),
+        "management": rng.choice(COMPANIES),
+        "number_of_stories": rng.randint(1, 4),
+        "square_footage": rng.randrange(5000, 200000, 500),
+        "number_of_bars": rng.randint(0, 8),
+        "food_offered": rng.random() < 0.6,
+        "vip_packages_access": rng.choice([None, "Balcony lounge and boxes", "Meet & greet packages"]),
+    }
+    researched_at = now - timedelta(days=rng.randint(0, 120))
+    return {
+        "name": f"synthetic venue {i}",
+        "updatedAt": researched_at,
+        **data,
+        **{f"{year} concerts": rng.randint(20, 300) for year in range(2019, 2024)},
+        "_research": {key.split(".", 1)[1]: meta
+                      for key, meta in research_metadata(list(data), data, source, now=researched_at).items()},
+        "sources": [{"source": f"https://example.com/venues/{i}/{field}", "label": field.replace("_", " ").title()}
+                    for field in ("city", "capacity", "management")],
+    }
+
+def seed(database, halls: int, venues: int, seed_value: int = 42, batch_size: int = 1000):
+    """replaces the hall and venue collections of database with synthetic documents"""
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    for collection_name, count, make in ((FOODHALL_COLLECTION, halls, synthetic_hall),
+                                         (VENUE_COLLECTION, venues, synthetic_venue)):
+        collection = database[collection_name]
+        collection.drop()
+        for start in range(0, count, batch_size):
+            collection.insert_many([make(i, rng, now) for i in range(start, min(count, start + batch_size))])
+        print(f"Seeded {count} documents into {database.name}.{collection_name}")
+
+def rss_mb(pid: int, group: bool):
+    """returns the resident memory in MB of pid, or of its whole process group (app.py and its chrome children)"""
+    if group:
+        return group_rss_mb(pid)
+    try:
+        with open(f"/proc/{pid}/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+    except (OSError, IndexError, ValueError):
+        return None
+
+def percentile(values: list[float], pct: float) -> float:
+    """nearest-rank percentile of values, which must be sorted"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(pct / 100 * len(values)) - 1))]
+
+class _Client:
+    """One keep-alive connection making requests for a load phase."""
+    def __init__(self, url: str, timeout: float):
+        parsed = urllib.parse.urlparse(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, path: str) -> tuple[int, int]:
+        """returns (status, body bytes) of GET path"""
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request("GET", path, headers={"Accept-Encoding": "gzip"})
+                response = self.connection.getresponse()
+                size = 0
+                while True:
+                    chunk = response.read(65536)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                if response.will_close:
+                    self.close()
+                return response.status, size
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+def run_phase(url: str, mix: dict, duration: float, concurrency: int, max_offset: int, seed_value: int,
+              server_pid: int = None, server_group: bool = False, timeout: float = 120) -> dict:
+    """loads the server with the mix for duration seconds and returns stats per endpoint"""
+    samples = {endpoint: [] for endpoint in mix}
+    errors = {endpoint: 0 for endpoint in mix}
+    sizes = {endpoint: 0 for endpoint in mix}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    endpoints, weights = list(mix), list(mix.values())
+
+    def worker(index: int):
+        rng = random.Random(seed_value + index)
+        client = _Client(url, timeout)
+        while time.monotonic() < deadline:
+            endpoint = rng.choices(endpoints, weights)[0]
+            path = endpoint.replace("{offset}", str(rng.randrange(max_offset))) if max_offset else endpoint
+            started = time.perf_counter()
+            try:
+                status, size = client.request(path)
+                failed = status >= 400
+            except Exception:
+                status, size, failed = None, 0, True
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples[endpoint].append(elapsed)
+                errors[endpoint] += failed
+                sizes[endpoint] += size
+        client.close()
+
+    rss = []
+    stop = threading.Event()
+
+    def sample_memory():
+        while not stop.is_set():
+            value = rss_mb(server_pid, server_group)
+            if value is not None:
+                rss.append(value)
+            stop.wait(0.2)
+
+    sampler = threading.Thread(target=sample_memory, daemon=True) if server_pid else None
+    if sampler:
+        sampler.start()
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    if sampler:
+        stop.set()
+        sampler.join()
+
+    stats = {}
+    for endpoint, latencies in samples.items():
+        latencies.sort()
+        stats[endpoint] = {
+            "requests": len(latencies),
+            "errors": errors[endpoint],
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+            "rps": round(len(latencies) / elapsed, 1),
+            "mb_per_s": round(sizes[endpoint] / elapsed / 1e6, 2),
+            "server_peak_rss_mb": max(rss) if rss else None,
+            "server_rss_growth_mb": rss[-1] - rss[0] if rss else None,
+        }
+    return stats
+
+def start_app(mongo: str, database: str, port: int, snapshots: bool) -> subprocess.Popen:
+    """starts app.py against database on port and waits until it answers"""
+    env = dict(os.environ, MONGO_CONNECTION=mongo, MONGO_DATABASE=database, PORT=str(port),
+               CRAWL_PROCESS_POOL="false", EXPORT_SNAPSHOTS=str(snapshots).lower())
+    process = subprocess.Popen([sys.executable, "app.py"], cwd=ROOT, env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app.py exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=2).read()
+            return process
+        except OSError:
+            time.sleep(0.5)
+    stop_app(process)
+    raise RuntimeError("app.py did not start within 60s")
+
+def stop_app(process: subprocess.Popen):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(10)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+def parse_mix(spec: str) -> dict:
+    """returns {path: weight} from "path@weight,path,..." (weight 1 when left out)"""
+    mix = {}
+    for part in filter(None, spec.split(",")):
+        path, _, weight = part.partition("@")
+        mix[path] = float(weight or 1)
+    return mix
+
+def print_table(title: str, stats: dict, baseline: dict = None):
+    print(f"\n{title}")
+    print(f"{'endpoint':<46} {'reqs':>6} {'err':>4} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'req/s':>7} "
+          f"{'MB/s':>6} {'peakMB':>7} {'growMB':>7}")
+    for endpoint, row in stats.items():
+        print(f"{endpoint[:46]:<46} {row['requests']:>6} {row['errors']:>4} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+              f"{row['p99_ms']:>8} {row['rps']:>7} {row['mb_per_s']:>6} {str(row['server_peak_rss_mb']):>7} "
+              f"{str(row['server_rss_growth_mb']):>7}")
+        previous = (baseline or {}).get(endpoint)
+        if previous:
+            changes = [f"{key} {(row[key] - previous[key]) / previous[key]:+.0%}"
+                       for key in ("p50_ms", "p95_ms", "p99_ms", "rps") if previous.get(key)]
+            print(f"{'':<46} vs baseline: {', '.join(changes)}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Seed a load-test database and load test the dashboard API.")
+    parser.add_argument("command", choices=("seed", "run"))
+    parser.add_argument("--mongo", default="mongodb://localhost:27017", help="mongo uri for seeding and the app")
+    parser.add_argument("--database", default=DATABASE)
+    parser.add_argument("--halls", type=int, default=20000)
+    parser.add_argument("--venues", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", default=None, help="load an already running app instead of starting one")
+    parser.add_argument("--pid", type=int, default=None, help="with --url, the app's pid for memory readings")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--snapshots", action="store_true", help="let the app build gzipped export snapshots")
+    parser.add_argument("--mix", default=None, help="comma separated path@weight pairs (default: the dashboard mix)")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per phase")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-offset", type=int, default=1000)
+    parser.add_argument("--out", default="load_results.json")
+    parser.add_argument("--baseline", default=None, help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        seed(MongoClient(args.mongo)[args.database], args.halls, args.venues, args.seed)
+        sys.exit(0)
+
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    process = None
+    url, pid = args.url, args.pid
+    if url is None:
+        process = start_app(args.mongo, args.database, args.port, args.snapshots)
+        url, pid = f"http://127.0.0.1:{args.port}", process.pid
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)["phases"]
+
+    results = {"created": datetime.now().isoformat(timespec="seconds"),
+               "config": {key: value for key, value in vars(args).items() if key not in ("out", "baseline")},
+               "phases": {}}
+    try:
+        phases = [(endpoint, {endpoint: mix[endpoint]}) for endpoint in mix] + [("mix", mix)]
+        for name, phase_mix in phases:
+            stats = run_phase(url, phase_mix, args.duration, args.concurrency, args.max_offset, args.seed,
+                              pid, server_group=process is not None)
+            results["phases"][name] = stats
+            print_table(f"{'alone' if name != 'mix' else 'mixed'}: {name}", stats, (baseline or {}).get(name))
+    finally:
+        if process is not None:
+            stop_app(process)
+
+    with open(args.out, "w") as fp:
+        json.dump(results, fp, indent=2)
+    print(f"\nWrote {args.out}")
@@ -0,0 +1,259 @@
+"""End to end crawl benchmarks that need no Google, Azure OpenAI or Atlas.
+
+usage:
+    python -m benchmarks.offline_suite --out bench.json
+    python -m benchmarks.offline_suite --out bench.json --baseline main.json --threshold 0.15
+    python -m benchmarks.offline_suite --only research_hall,get_csv --repeat 5 --llm-latency 0.8
+
+Pages and search results come from benchmarks/fixture_server.py, completions
+from benchmarks/fake_openai.py and mongo from mongomock (or --mongo
+mongodb://localhost:27017 for a local mongod). By default pages are loaded by
+webcrawler.html_browser.HtmlBrowser; --browser chrome drives real Chrome
+against the fixture server instead, as in production. The fixed page ready
+waits are set to --ready-wait (0 by default, the fixtures are static).
+
+Every benchmark runs --repeat times after one warm-up run. Results (seconds per
+run, median, LLM calls, pages loaded, tokens) are written as JSON, and with
+--baseline the medians are compared to an earlier results file: anything
+slower by more than --threshold (and --min-delta seconds) is reported as a
+regression and the exit status is 1.
+
+ResearchVenue runs without get_yearly_number_of_shows, which scrapes
+concertarchives.org with an undetected, non-headless Chrome.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.fake_openai import FakeOpenAI
+from benchmarks.fixture_server import FixtureServer
+
+VENUE = "Riverside Music Hall"
+FOOD_HALL = "Harbor Market Food Hall"
+VENUE_PAGES = ["index.html", "about.html", "food-and-drink.html", "vip.html", "contact.html"]
+OTHER_PAGES = ["harbor-market-food-hall/index.html", "harbor-market-food-hall/leasing.html",
+               "news/riverside-opening.html", "news/harbor-market-opening.html"]
+COUNTERS = ("llm_calls", "pages_loaded", "searches", "llm_json_failed", "llm_retries")
+
+def start_environment(args) -> tuple[FixtureServer, FakeOpenAI]:
+    """starts the fixture site and fake LLM and points the crawler's settings at them.
+    Must run before webcrawler is imported, since those settings are read at import."""
+    fixtures = FixtureServer(args.fixture_port).start()
+    llm = FakeOpenAI(args.llm_port, latency=args.llm_latency, jitter=args.llm_jitter).start()
+    os.environ["GOOGLE_SEARCH_URL"] = fixtures.search_url
+    os.environ["AZURE_OPENAI_ENDPOINT"] = llm.url
+    os.environ["AZURE_OPENAI_API_KEY"] = "offline-benchmark"
+    os.environ["CRAWL_PAGE_READY_WAIT"] = str(args.ready_wait)
+    os.environ["CRAWL_LINKS_READY_WAIT"] = str(args.ready_wait)
+    return fixtures, llm
+
+class Benchmarks:
+    """The benchmarked crawl entry points. setup_<name> runs untimed before every run of <name>."""
+    def __init__(self, fixtures: FixtureServer, database, browser_factory, csv_documents: int):
+        self.fixtures = fixtures
+        self.database = database
+        self.browser_factory = browser_factory
+        self.csv_documents = csv_documents
+        self.browser = None
+
+    def page(self, path: str) -> str:
+        return f"{self.fixtures.url}/pages/{path}"
+
+    def _fresh_browser(self):
+        if self.browser is None:
+            self.browser = self.browser_factory()
+
+    def close(self):
+        if self.browser is not None:
+            self.browser.quit()
+
+    setup_scrape_page_text = _fresh_browser
+
+    def scrape_page_text(self):
+        from webcrawler.CrawlerTools import scrape_page_text
+        for path in [f"riverside-music-hall/{page}" for page in VENUE_PAGES] + OTHER_PAGES:
+            scrape_page_text(self.page(path), self.browser)
+
+    setup_traverse_pages_intelligently = _fresh_browser
+
+    def traverse_pages_intelligently(self):
+        from webcrawler.CrawlerTools import traverse_pages_intelligently
+        traverse_pages_intelligently(self.page("riverside-music-hall/index.html"), self.browser, max_page_visits=3,
+                                     venue=VENUE, search_items=["number of bars"])
+
+    setup_traverse_all_pages = _fresh_browser
+
+    def traverse_all_pages(self):
+        from webcrawler.CrawlerTools import traverse_all_pages
+        traverse_all_pages(self.page("riverside-music-hall/index.html"), self.browser, max_page_visits=3)
+
+    def setup_research_hall(self):
+        self.database["bench_foodhalls"].drop()
+
+    def research_hall(self):
+        from webcrawler.ResearchHall import ResearchHall
+        ResearchHall(self.database["bench_foodhalls"], FOOD_HALL).run_in_parallel(force=True)
+
+    def setup_research_venue(self):
+        self.database["bench_venues"].drop()
+
+    def research_venue(self):
+        from webcrawler.ResearchVenue import ResearchVenue
+        ResearchVenue(VENUE, self.database["bench_venues"], skip_tasks={"get_yearly_number_of_shows"})
+
+    def setup_get_csv(self):
+        collection = self.database["bench_export"]
+        if collection.count_documents({}) == self.csv_documents:
+            return
+        collection.drop()
+        collection.insert_many([{
+            "name": f"Venue {i}",
+            "city": ["Portland", "Tacoma", "Seattle", "Boise"][i % 4],
+            "capacity": 500 + i % 2000,
+            "number_of_bars": i % 5,
+            "food_offered": i % 3 == 0,
+            "sources": [{"source": f"https://example.com/{i}", "label": "Capacity"}],
+            "research": {"capacity": {"researchedAt": datetime(2024, 1, 1 + i % 28), "found": True}},
+        } for i in range(self.csv_documents)])
+
+    def get_csv(self):
+        from download_foodhalls_as_csv import get_csv
+        get_csv("bench_export")
+
+NAMES = ["scrape_page_text", "traverse_pages_intelligently", "traverse_all_pages", "research_hall",
+         "research_venue", "get_csv"]
+
+def run_benchmark(benchmarks: Benchmarks, name: str, repeat: int) -> dict:
+    from webcrawler import llm_usage, metrics
+
+    setup = getattr(benchmarks, f"setup_{name}", None)
+    func = getattr(benchmarks, name)
+    seconds, counters, tokens = [], {counter: [] for counter in COUNTERS}, []
+    for run in range(repeat + 1):
+        if setup is not None:
+            setup()
+        before = metrics.snapshot()
+        started = time.perf_counter()
+        with llm_usage.track() as tracker:
+            func()
+        elapsed = time.perf_counter() - started
+        if run == 0:
+            continue  # warm-up: imports, first connections
+        after = metrics.snapshot()
+        seconds.append(elapsed)
+        tokens.append(tracker.total_tokens)
+        for counter in COUNTERS:
+            counters[counter].append(after.get(counter, 0) - before.get(counter, 0))
+    return {
+        "seconds": [round(value, 4) for value in seconds],
+        "median": round(statistics.median(seconds), 4),
+        "mean": round(statistics.mean(seconds), 4),
+        "min": round(min(seconds), 4),
+        "max": round(max(seconds), 4),
+        **{counter: statistics.median(values) for counter, values in counters.items()},
+        "tokens": statistics.median(tokens),
+    }
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta: float) -> list[dict]:
+    """returns one row per benchmark in both result files, with regression set where it got slower"""
+    rows = []
+    for name, current in results["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if previous is None:
+            continue
+        change = (current["median"] - previous["median"]) / previous["median"] if previous["median"] else 0.0
+        rows.append({
+            "name": name,
+            "baseline": previous["median"],
+            "current": current["median"],
+            "change": change,
+            "regression": change > threshold and current["median"] - previous["median"] > min_delta,
+            # a speedup that comes from doing less work is worth a second look
+            "work_changed": any(current.get(counter) != previous.get(counter) for counter in COUNTERS + ("tokens",)),
+        })
+    return rows
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the offline crawl benchmarks and compare them to a baseline.")
+    parser.add_argument("--out", default="benchmark_results.json", help="where to write this run's results")
+    parser.add_argument("--baseline", default=None, help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown counted as a regression")
+    parser.add_argument("--min-delta", type=float, default=0.02, help="ignore slowdowns smaller than this many seconds")
+    parser.add_argument("--only", default=None, help=f"comma separated subset of {','.join(NAMES)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--browser", choices=("html", "chrome"), default="html")
+    parser.add_argument("--mongo", default=None, help="local mongod uri instead of mongomock")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per fake completion")
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--ready-wait", type=float, default=0.0, help="page ready wait in seconds")
+    parser.add_argument("--csv-documents", type=int, default=5000, help="documents exported by get_csv")
+    parser.add_argument("--fixture-port", type=int, default=0)
+    parser.add_argument("--llm-port", type=int, default=0)
+    args = parser.parse_args()
+
+    fixtures, llm = start_environment(args)
+
+    import download_foodhalls_as_csv
+    from webcrawler.BrowserConfig import create_browser, set_browser_factory
+    from webcrawler.html_browser import HtmlBrowser
+
+    if args.mongo:
+        from pymongo import MongoClient
+        mongo_client = MongoClient(args.mongo)
+    else:
+        import mongomock
+        mongo_client = mongomock.MongoClient()
+    # get_csv reads through the export module's shared client
+    download_foodhalls_as_csv._mongo_client = mongo_client
+    if args.browser == "html":
+        set_browser_factory(HtmlBrowser)
+
+    benchmarks = Benchmarks(fixtures, mongo_client.brokerai, create_browser, args.csv_documents)
+    names = args.only.split(",") if args.only else NAMES
+    results = {
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("out", "baseline")},
+        "benchmarks": {},
+    }
+    try:
+        for name in names:
+            result = run_benchmark(benchmarks, name, args.repeat)
+            results["benchmarks"][name] = result
+            print(f"{name:<30} median {result['median']:>8.3f}s  min {result['min']:>8.3f}s  "
+                  f"{result['llm_calls']:>4} llm calls  {result['pages_loaded']:>4} pages  {result['tokens']:>7} tokens")
+    finally:
+        benchmarks.close()
+        fixtures.close()
+        llm.close()
+
+    with open(args.out, "w") as fp:
+        json.dump(results, fp, indent=2)
+    print(f"Wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        rows = compare(results, baseline, args.threshold, args.min_delta)
+        print(f"\ncompared to {args.baseline} ({baseline.get('commit')})")
+        print(f"{'benchmark':<30} {'baseline':>9} {'current':>9} {'change':>8}")
+        for row in rows:
+            flags = " REGRESSION" if row["regression"] else ""
+            flags += " (work changed)" if row["work_changed"] else ""
+            print(f"{row['name']:<30} {row['baseline']:>8.3f}s {row['current']:>8.3f}s {row['change']:>+7.1%}{flags}")
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
@@ -0,0 +1,86 @@
+"""Per-page IPC overhead: pickling page snapshots through a pipe vs passing SharedPageStore handles.
+
+usage:
+    python -m benchmarks.page_store_ipc --pages 200 --sizes 50,500,2000
+
+For each page size (KB of text) the producer sends --pages snapshots to a
+consumer process, which touches the text (len of the bytes) and acks. The
+"decoded" column additionally turns the shared bytes back into a str, which
+is what a consumer that needs the text itself (e.g. for a prompt) pays.
+"""
+import argparse
+import multiprocessing
+import random
+import string
+import time
+
+from webcrawler.page_store import PageSnapshot, SharedPageStore
+
+def make_page(size_kb: int, links: int = 200) -> PageSnapshot:
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(2, 10))) for _ in range(2000)]
+    text = []
+    length = 0
+    while length < size_kb * 1024:
+        word = random.choice(words)
+        text.append(word)
+        length += len(word) + 1
+    return PageSnapshot("https://example.com/", " ".join(text),
+                        [f"https://example.com/page/{i}" for i in range(links)])
+
+def pickle_consumer(conn):
+    while True:
+        page = conn.recv()
+        if page is None:
+            break
+        conn.send(len(page.text) + len(page.links))
+
+def handle_consumer(conn, decode: bool):
+    store = SharedPageStore()
+    while True:
+        handle = conn.recv()
+        if handle is None:
+            break
+        view = store.attach(handle)
+        size = len(view.text) if decode else len(view.text_bytes)
+        size += len(view.links_bytes)
+        store.release(handle)
+        conn.send(size)
+
+def run(mode: str, pages: list[PageSnapshot]) -> float:
+    """returns mean microseconds per page for a round trip through a consumer process"""
+    parent, child = multiprocessing.Pipe()
+    if mode == "pickle":
+        consumer = multiprocessing.Process(target=pickle_consumer, args=(child,))
+    else:
+        consumer = multiprocessing.Process(target=handle_consumer, args=(child, mode == "decoded"))
+    consumer.start()
+    store = SharedPageStore()
+
+    started = time.perf_counter()
+    for page in pages:
+        if mode == "pickle":
+            parent.send(page)
+        else:
+            handle = store.put(page)
+            parent.send(handle)
+        parent.recv()
+        if mode != "pickle":
+            store.release(handle)
+    elapsed = time.perf_counter() - started
+
+    parent.send(None)
+    consumer.join()
+    store.close()
+    return elapsed / len(pages) * 1e6
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare per-page IPC overhead of pickling vs shared memory handles.")
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--sizes", default="50,500,2000", help="comma separated page text sizes in KB")
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'pickle us':>10} {'handle us':>10} {'decoded us':>11}")
+    for size_kb in (int(size) for size in args.sizes.split(",")):
+        pages = [make_page(size_kb)] * args.pages
+        results = {mode: run(mode, pages) for mode in ("pickle", "handle", "decoded")}
+        print(f"{size_kb:>6}KB {results['pickle']:>10.0f} {results['handle']:>10.0f} {results['decoded']:>11.0f}")
@@ -0,0 +1,280 @@
+"""Research the validation venues under several pipeline configurations and score each one.
+
+usage:
+    python -m benchmarks.scoreboard --init                       # baseline run becomes the ground truth, review it by hand
+    python -m benchmarks.scoreboard --out scoreboard.json
+    python -m benchmarks.scoreboard --configs baseline,page_cache --limit 3
+    python -m benchmarks.scoreboard --config "fast:CRAWL_PAGE_CACHE=true,VENUE_TRAVERSAL_PAGES=1"
+    python -m benchmarks.scoreboard --offline                    # fixture site + fake LLM, checks the harness itself
+
+A configuration is a set of environment overrides on top of BASELINE (page
+cache, traversal depth, model, ...). The crawler reads those settings at
+import, so every configuration runs in its own worker process, which researches
+the venues one after another into a fresh scoreboard_<config> collection
+(--database, brokerai_scoreboard by default) and reports per venue: wall time,
+pages loaded, searches, page cache hits, LLM calls, tokens, cost and the
+stored field values. Those are compared field by field with the ground truth
+file (numbers within --tolerance, text when one contains the other, null
+truth values are not scored) and printed as one row per configuration, with
+the fastest configuration whose accuracy stays within --max-accuracy-drop of
+the baseline.
+
+CRAWL_REPLAY_MODE=replay is passed on to the workers like any other setting,
+but only configurations that load the same pages and send the same prompts as
+the recording can replay; a different model or traversal depth misses.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BASELINE = {
+    "CRAWL_PAGE_CACHE": "false",
+    "VENUE_TRAVERSAL_PAGES": "3",
+    "GPT_MODEL": "gpt-4o",
+}
+CONFIGURATIONS = {
+    "baseline": {},
+    "page_cache": {"CRAWL_PAGE_CACHE": "true"},
+    "traversal_1": {"VENUE_TRAVERSAL_PAGES": "1"},
+    "traversal_5": {"VENUE_TRAVERSAL_PAGES": "5"},
+    "gpt-35-turbo": {"GPT_MODEL": "gpt-35-turbo"},
+    "page_cache_gpt-35-turbo": {"CRAWL_PAGE_CACHE": "true", "GPT_MODEL": "gpt-35-turbo"},
+}
+FIELDS = ["city", "capacity", "owned", "management", "number_of_stories", "square_footage", "number_of_bars",
+          "food_offered", "vip_packages_access", "yearly_number_of_shows"]
+COUNTERS = ("pages_loaded", "searches", "page_cache_hits", "llm_calls", "llm_json_failed", "llm_retries")
+TRUTH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "validation_truth.json")
+
+def parse_config(spec: str) -> tuple[str, dict]:
+    """parses name:KEY=VALUE,KEY=VALUE"""
+    name, _, settings = spec.partition(":")
+    overrides = {}
+    for setting in filter(None, settings.split(",")):
+        key, _, value = setting.partition("=")
+        overrides[key.strip()] = value.strip()
+    return name.strip(), overrides
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r"-?\d[\d,]*(\.\d+)?", str(value))
+    return float(match.group(0).replace(",", "")) if match else None
+
+def _words(value) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", str(value).lower()))
+
+def agrees(found, truth, tolerance: float) -> bool:
+    """returns whether a researched value matches its ground truth value"""
+    if found is None:
+        return False
+    if isinstance(truth, bool) or str(truth).lower() in ("true", "false", "yes", "no"):
+        def flag(value):
+            return value if isinstance(value, bool) else str(value).strip().lower() in ("true", "yes")
+        return flag(found) == flag(truth)
+    if isinstance(truth, (int, float)):
+        number = _number(found)
+        return number is not None and abs(number - truth) <= tolerance * max(abs(truth), 1)
+    found, truth = _words(found), _words(truth)
+    return bool(found) and (found == truth or truth in found or found in truth)
+
+def score(venues: dict, truth: dict, tolerance: float) -> dict:
+    """returns the field agreement of researched venues {name: {field: value}} with the ground truth"""
+    scored, agreed, per_field = 0, 0, {}
+    for name, expected in truth.items():
+        found = venues.get(name, {})
+        for field, value in expected.items():
+            if value is None:
+                continue
+            match = agrees(found.get(field), value, tolerance)
+            scored += 1
+            agreed += match
+            field_scored, field_agreed = per_field.get(field, (0, 0))
+            per_field[field] = (field_scored + 1, field_agreed + match)
+    return {
+        "scored": scored,
+        "agreed": agreed,
+        "accuracy": agreed / scored if scored else None,
+        "fields": {field: counts[1] / counts[0] for field, counts in sorted(per_field.items())},
+    }
+
+def run_worker(args):
+    """researches the venues under the current environment and writes the measurements to args.result"""
+    from webcrawler import llm_usage, metrics
+    from webcrawler.ResearchVenue import ResearchVenue
+
+    if args.browser == "html":
+        from webcrawler.BrowserConfig import set_browser_factory
+        from webcrawler.html_browser import HtmlBrowser
+        set_browser_factory(HtmlBrowser)
+    if args.mongo:
+        from pymongo import MongoClient
+        mongo_client = MongoClient(args.mongo)
+    else:
+        import mongomock
+        mongo_client = mongomock.MongoClient()
+    collection = mongo_client[args.database][f"scoreboard_{args.worker}"]
+    collection.drop()
+
+    skip_tasks = {"get_yearly_number_of_shows"} if args.skip_shows else None
+    venues = []
+    for name in args.venues:
+        before = metrics.snapshot()
+        started = time.perf_counter()
+        error = None
+        with llm_usage.track() as tracker:
+            try:
+                ResearchVenue(name, collection, skip_tasks=skip_tasks)
+            except Exception as e:
+                error = str(e)
+        after = metrics.snapshot()
+        document = collection.find_one({"name": name}) or {}
+        venues.append({
+            "name": name,
+            "seconds": round(time.perf_counter() - started, 3),
+            **{counter: after.get(counter, 0) - before.get(counter, 0) for counter in COUNTERS},
+            "tokens": tracker.total_tokens,
+            "cost": round(tracker.cost, 5),
+            "error": error,
+            "fields": {field: document.get(field) for field in FIELDS},
+        })
+        print(f"[{args.worker}] {name}: {venues[-1]['seconds']:.1f}s", flush=True)
+    with open(args.result, "w") as fp:
+        json.dump(venues, fp, default=str)
+
+def run_configuration(name: str, overrides: dict, args) -> list[dict]:
+    """runs one configuration in a worker process and returns its per venue measurements"""
+    with tempfile.TemporaryDirectory() as directory:
+        result = os.path.join(directory, "result.json")
+        command = [sys.executable, "-m", "benchmarks.scoreboard", "--worker", name, "--result", result,
+                   "--database", args.database, "--browser", args.browser, "--venues", *args.venues]
+        if args.mongo:
+            command += ["--mongo", args.mongo]
+        if args.skip_shows:
+            command.append("--skip-shows")
+        env = {**os.environ, **BASELINE, **overrides}
+        subprocess.run(command, env=env, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        with open(result) as fp:
+            return json.load(fp)
+
+def summarize(venues: list[dict], truth: dict, tolerance: float) -> dict:
+    found = {venue["name"]: venue["fields"] for venue in venues}
+    seconds = [venue["seconds"] for venue in venues]
+    return {
+        "venues": len(venues),
+        "errors": sum(1 for venue in venues if venue["error"]),
+        "seconds": round(sum(seconds), 2),
+        "median_venue_seconds": round(statistics.median(seconds), 2) if seconds else None,
+        **{counter: sum(venue[counter] for venue in venues) for counter in COUNTERS},
+        "tokens": sum(venue["tokens"] for venue in venues),
+        "cost": round(sum(venue["cost"] for venue in venues), 4),
+        **score(found, {name: truth[name] for name in found if name in truth}, tolerance),
+    }
+
+def pick(results: dict, max_drop: float):
+    """returns the fastest configuration whose accuracy is within max_drop of the baseline's"""
+    baseline = results.get("baseline", next(iter(results.values())))
+    if baseline["accuracy"] is None:
+        return None
+    keeping = [name for name, summary in results.items()
+               if summary["accuracy"] is not None and summary["accuracy"] >= baseline["accuracy"] - max_drop]
+    return min(keeping, key=lambda name: results[name]["seconds"], default=None)
+
+def print_table(results: dict):
+    baseline = results.get("baseline", next(iter(results.values())))
+    print(f"\n{'configuration':<26} {'venues':>6} {'wall s':>8} {'vs base':>8} {'s/venue':>8} {'pages':>6} "
+          f"{'cached':>6} {'llm':>5} {'tokens':>8} {'cost $':>7} {'accuracy':>9}")
+    for name, summary in results.items():
+        change = (summary["seconds"] - baseline["seconds"]) / baseline["seconds"] if baseline["seconds"] else 0.0
+        accuracy = f"{summary['accuracy']:.1%}" if summary["accuracy"] is not None else "n/a"
+        errors = f"  {summary['errors']} failed" if summary["errors"] else ""
+        print(f"{name:<26} {summary['venues']:>6} {summary['seconds']:>8.1f} {change:>+8.0%} "
+              f"{summary['median_venue_seconds']:>8.1f} {summary['pages_loaded']:>6} {summary['page_cache_hits']:>6} "
+              f"{summary['llm_calls']:>5} {summary['tokens']:>8} {summary['cost']:>7.3f} {accuracy:>9}{errors}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score pipeline configurations on the validation venues.")
+    parser.add_argument("--configs", default=None, help=f"comma separated subset of {','.join(CONFIGURATIONS)}")
+    parser.add_argument("--config", action="append", default=[], help="extra configuration, name:KEY=VALUE,KEY=VALUE")
+    parser.add_argument("--venues", nargs="+", default=None, help="venue names (default validation_venues)")
+    parser.add_argument("--limit", type=int, default=None, help="only the first N venues")
+    parser.add_argument("--truth", default=TRUTH, help="ground truth file {venue: {field: value}}")
+    parser.add_argument("--init", action="store_true", help="write the first configuration's results as the ground truth")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative error at which a number still agrees")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.02)
+    parser.add_argument("--out", default=None, help="where to write the results as JSON")
+    parser.add_argument("--mongo", default=os.getenv("MONGO_CONNECTION"), help="mongo uri (mongomock without one)")
+    parser.add_argument("--database", default="brokerai_scoreboard")
+    parser.add_argument("--browser", choices=("chrome", "html"), default="chrome")
+    parser.add_argument("--skip-shows", action="store_true", help="skip get_yearly_number_of_shows (non-headless chrome)")
+    parser.add_argument("--offline", action="store_true", help="research the fixture venue against a fake LLM")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--result", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        sys.exit(0)
+
+    servers = []
+    if args.offline:
+        from benchmarks import offline_suite
+        fixtures, llm = offline_suite.start_environment(argparse.Namespace(
+            fixture_port=0, llm_port=0, llm_latency=0.0, llm_jitter=0.0, ready_wait=0.0))
+        servers = [fixtures, llm]
+        args.browser, args.skip_shows, args.mongo = "html", True, None
+        args.venues = args.venues or [offline_suite.VENUE]
+    if not args.venues:
+        from webcrawler.venues import validation_venues
+        args.venues = validation_venues
+    args.venues = args.venues[:args.limit]
+
+    configurations = {name: CONFIGURATIONS[name] for name in args.configs.split(",")} if args.configs \
+        else dict(CONFIGURATIONS)
+    configurations.update(parse_config(spec) for spec in args.config)
+
+    truth = {}
+    if os.path.exists(args.truth) and not args.init:
+        with open(args.truth) as fp:
+            truth = json.load(fp)
+    elif not args.init:
+        print(f"No ground truth at {args.truth}, accuracy is n/a (create one with --init)")
+
+    runs, results = {}, {}
+    try:
+        for name, overrides in configurations.items():
+            runs[name] = run_configuration(name, overrides, args)
+            if args.init and not truth:
+                truth = {venue["name"]: venue["fields"] for venue in runs[name]}
+                with open(args.truth, "w") as fp:
+                    json.dump(truth, fp, indent=2, default=str)
+                print(f"Wrote {args.truth} from {name}, check its values by hand before scoring against it")
+            results[name] = summarize(runs[name], truth, args.tolerance)
+    finally:
+        for server in servers:
+            server.close()
+
+    print_table(results)
+    best = pick(results, args.max_accuracy_drop)
+    if best:
+        print(f"\nfastest configuration within {args.max_accuracy_drop:.0%} of baseline accuracy: {best} "
+              f"{ {**BASELINE, **configurations[best]} }")
+
+    if args.out:
+        with open(args.out, "w") as fp:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "venues": args.venues,
+                "configurations": {name: {**BASELINE, **overrides} for name, overrides in configurations.items()},
+                "results": results,
+                "runs": runs,
+            }, fp, indent=2, default=str)
+        print(f"Wrote {args.out}")
@@ -0,0 +1,158 @@
+"""Typed columnar (Parquet / Arrow IPC) exports of the foodhall and venue collections.
+
+Nested research fields such as `age_distribution` become struct columns and
+lists such as `types_of_food_stalls` become list columns, instead of being
+stringified into CSV cells. Fields whose type differs between documents
+(e.g. a number in one hall and "10,000 sq ft" in another) fall back to a
+JSON string column.
+
+usage: python columnar_export.py foodhalls_csv --format parquet --output foodhalls.parquet
+"""
+import argparse
+from datetime import datetime
+
+from bson import ObjectId, json_util
+
+from download_foodhalls_as_csv import EXPORT_BATCH_SIZE, get_collection
+
+COLUMNAR_FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+    "arrow": ("application/vnd.apache.arrow.file", ".arrow"),
+}
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401 - registers pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("columnar exports need pyarrow: pip install pyarrow") from e
+    return pyarrow
+
+def infer_type(pa, value):
+    """returns the arrow type for a single mongo value"""
+    if value is None:
+        return pa.null()
+    if isinstance(value, bool):
+        return pa.bool_()
+    if isinstance(value, int):
+        return pa.int64()
+    if isinstance(value, float):
+        return pa.float64()
+    if isinstance(value, str):
+        return pa.string()
+    if isinstance(value, datetime):
+        return pa.timestamp("ms")
+    if isinstance(value, dict):
+        return pa.struct([(str(key), infer_type(pa, item)) for key, item in value.items()])
+    if isinstance(value, list):
+        value_type = pa.null()
+        for item in value:
+            value_type = merge_types(pa, value_type, infer_type(pa, item))
+        return pa.list_(value_type)
+    # ObjectId and anything else bson hands back
+    return pa.string()
+
+def merge_types(pa, a, b):
+    """returns a type that can hold values of both a and b, widening to string on conflict"""
+    if a == b:
+        return a
+    if pa.types.is_null(a):
+        return b
+    if pa.types.is_null(b):
+        return a
+    if {str(a), str(b)} == {"int64", "double"}:
+        return pa.float64()
+    if pa.types.is_struct(a) and pa.types.is_struct(b):
+        fields = {field.name: field.type for field in a}
+        for field in b:
+            fields[field.name] = merge_types(pa, fields[field.name], field.type) if field.name in fields else field.type
+        return pa.struct(list(fields.items()))
+    if pa.types.is_list(a) and pa.types.is_list(b):
+        return pa.list_(merge_types(pa, a.value_type, b.value_type))
+    return pa.string()
+
+def _finalize_type(pa, arrow_type):
+    # parquet can't store empty structs, and all-null columns are more useful as strings
+    if pa.types.is_null(arrow_type):
+        return pa.string()
+    if pa.types.is_struct(arrow_type):
+        if arrow_type.num_fields == 0:
+            return pa.string()
+        return pa.struct([(field.name, _finalize_type(pa, field.type)) for field in arrow_type])
+    if pa.types.is_list(arrow_type):
+        return pa.list_(_finalize_type(pa, arrow_type.value_type))
+    return arrow_type
+
+def infer_schema(col, batch_size: int = EXPORT_BATCH_SIZE):
+    """returns the arrow schema covering every document in the collection"""
+    pa = _pyarrow()
+    fields = {"_id": pa.string()}
+    for doc in col.find({}, batch_size=batch_size):
+        for key, value in doc.items():
+            if key == "_id":
+                continue
+            value_type = infer_type(pa, value)
+            fields[key] = merge_types(pa, fields[key], value_type) if key in fields else value_type
+    return pa.schema([(name, _finalize_type(pa, arrow_type)) for name, arrow_type in fields.items()])
+
+def convert_value(pa, value, arrow_type):
+    """coerces a mongo value into the python shape arrow expects for arrow_type"""
+    if value is None:
+        return None
+    if pa.types.is_string(arrow_type):
+        if isinstance(value, str):
+            return value
+        if isinstance(value, ObjectId):
+            return str(value)
+        return json_util.dumps(value)
+    if pa.types.is_struct(arrow_type):
+        return {field.name: convert_value(pa, value.get(field.name), field.type) for field in arrow_type}
+    if pa.types.is_list(arrow_type):
+        return [convert_value(pa, item, arrow_type.value_type) for item in value]
+    if pa.types.is_floating(arrow_type):
+        return float(value)
+    return value
+
+def iter_record_batches(col, schema, batch_size: int = EXPORT_BATCH_SIZE):
+    """yields arrow record batches built straight from a batched cursor"""
+    pa = _pyarrow()
+    rows = []
+    for doc in col.find({}, batch_size=batch_size):
+        rows.append({field.name: convert_value(pa, doc.get(field.name), field.type) for field in schema})
+        if len(rows) == batch_size:
+            yield pa.RecordBatch.from_pylist(rows, schema=schema)
+            rows = []
+    if rows:
+        yield pa.RecordBatch.from_pylist(rows, schema=schema)
+
+def write_columnar(col, sink, export_format: str = "parquet", batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """writes the collection to sink (path or binary file object) as parquet or arrow IPC, returns row count"""
+    if export_format not in COLUMNAR_FORMATS:
+        raise ValueError(f"unsupported columnar format: {export_format}")
+
+    pa = _pyarrow()
+    schema = infer_schema(col, batch_size)
+    if export_format == "parquet":
+        writer = pa.parquet.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+
+    rows = 0
+    try:
+        for batch in iter_record_batches(col, schema, batch_size):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        writer.close()
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a collection as Parquet or Arrow IPC.")
+    parser.add_argument("collection_name")
+    parser.add_argument("--format", choices=sorted(COLUMNAR_FORMATS), default="parquet")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    output = args.output or args.collection_name + COLUMNAR_FORMATS[args.format][1]
+    rows = write_columnar(get_collection(args.collection_name), output, args.format)
+    print(f"Wrote {rows} rows to {output}")
@@ -0,0 +1,144 @@
+import base64
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from bson import json_util
+
+from download_foodhalls_as_csv import EXPORT_BATCH_SIZE, format_csv_cell, get_csv_columns
+
+# changes newer than this are left for the next export, so a write that is
+# still in flight when the export starts can't land behind the watermark
+DELTA_SAFETY_LAG = timedelta(seconds=5)
+
+TOMBSTONE_SUFFIX = "_tombstones"
+
+def get_tombstone_collection(col):
+    """returns the collection recording deletions from col"""
+    return col.database[col.name + TOMBSTONE_SUFFIX]
+
+def ensure_delta_indexes(col):
+    """indexes updatedAt/deletedAt so a delta export only touches changed documents"""
+    col.create_index("updatedAt")
+    get_tombstone_collection(col).create_index("deletedAt")
+
+def delete_with_tombstone(col, query: dict) -> int:
+    """deletes matching documents and records a tombstone for each so delta exports see the deletion"""
+    tombstones = get_tombstone_collection(col)
+    deleted = 0
+    for doc in col.find(query, {"_id": 1, "name": 1}):
+        tombstones.update_one(
+            {"docId": doc["_id"]},
+            {"$set": {"docId": doc["_id"], "name": doc.get("name")},
+             '$currentDate': {'deletedAt': True}},
+            upsert=True,
+        )
+        deleted += col.delete_one({"_id": doc["_id"]}).deleted_count
+    return deleted
+
+def encode_watermark(since: datetime) -> str:
+    """returns an opaque token for the given watermark"""
+    payload = json.dumps({"v": 1, "since": since.isoformat()})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_watermark(token: str) -> datetime:
+    """parses a token from encode_watermark, or a plain ISO timestamp"""
+    try:
+        return datetime.fromisoformat(token)
+    except ValueError:
+        pass
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(payload["since"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"invalid watermark: {token}") from e
+
+class DeltaExport:
+    """Changes to a collection between a watermark and now.
+
+    Upserts are the documents whose updatedAt (set by updateDB through
+    $currentDate) falls in the window, deletions come from the tombstone
+    collection. `watermark` is the token to pass as `since` next time.
+    """
+    def __init__(self, col, since: datetime = None, now: datetime = None):
+        self.col = col
+        self.since = since
+        self.until = (now or datetime.utcnow()) - DELTA_SAFETY_LAG
+        self.watermark = encode_watermark(self.until)
+
+    def _window(self, field: str) -> dict:
+        window = {"$lte": self.until}
+        if self.since is not None:
+            window["$gt"] = self.since
+        return {field: window}
+
+    def upserts(self, batch_size: int = EXPORT_BATCH_SIZE):
+        """yields changed documents in updatedAt order"""
+        cursor = self.col.find(self._window("updatedAt"), batch_size=batch_size)
+        return cursor.sort("updatedAt", 1)
+
+    def deletions(self, batch_size: int = EXPORT_BATCH_SIZE):
+        """yields tombstones recorded in the window"""
+        tombstones = get_tombstone_collection(self.col)
+        cursor = tombstones.find(self._window("deletedAt"), batch_size=batch_size)
+        return cursor.sort("deletedAt", 1)
+
+    def columns(self) -> list[str]:
+        """returns the union of fields across the changed documents only"""
+        return get_csv_columns(self.col, self._window("updatedAt"))
+
+    def stream_csv(self, batch_size: int = EXPORT_BATCH_SIZE):
+        """yields the delta as CSV text with a leading `_op` column (upsert/delete)"""
+        columns = self.columns()
+        if "_id" not in columns:
+            columns = ["_id"] + columns
+        if "name" not in columns:
+            columns.insert(1, "name")
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(["_op"] + columns)
+
+        rows = 0
+        for doc in self.upserts(batch_size):
+            writer.writerow(["upsert"] + [format_csv_cell(doc.get(column)) for column in columns])
+            rows += 1
+            if rows % batch_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+
+        for tombstone in self.deletions(batch_size):
+            deleted = {"_id": tombstone["docId"], "name": tombstone.get("name")}
+            writer.writerow(["delete"] + [format_csv_cell(deleted.get(column)) for column in columns])
+            rows += 1
+            if rows % batch_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+
+        yield buffer.getvalue()
+
+    def stream_jsonl(self, batch_size: int = EXPORT_BATCH_SIZE):
+        """yields the delta as JSON lines: {"op": "upsert", "doc": ...} or {"op": "delete", ...}"""
+        lines = []
+        for doc in self.upserts(batch_size):
+            lines.append(json_util.dumps({"op": "upsert", "doc": doc}))
+            if len(lines) == batch_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+
+        for tombstone in self.deletions(batch_size):
+            lines.append(json_util.dumps({
+                "op": "delete",
+                "_id": tombstone["docId"],
+                "name": tombstone.get("name"),
+                "deletedAt": tombstone["deletedAt"],
+            }))
+            if len(lines) == batch_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+
+        if lines:
+            yield "\n".join(lines) + "\n"
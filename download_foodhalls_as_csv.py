@@ -1,55 +1,105 @@
-import pandas 
+import csv
+import io
 
-from pymongo import MongoClient 
+import pandas
+
+from pymongo import MongoClient
 
 from dotenv import load_dotenv
 from pymongo.server_api import ServerApi
-import os 
+import os
 
 load_dotenv(".env.local")
 load_dotenv()
-def get_csv(collection_name: str):
-    # look out for special characters 
-    mongo_uri = os.getenv("MONGO_CONNECTION")
-    mongo_client = MongoClient(mongo_uri, server_api=ServerApi('1'))
-    mongodb = mongo_client.brokerai
-    col = mongodb[collection_name]
-
-    try:
-        mongo_client.admin.command('ping')
-        print("Pinged your deployment. You successfully connected to MongoDB!")
-    except Exception as e:
-        print(e)
-
-    cursor = col.find()
-    print ("total docs in collection:", col.count_documents( {} ))
 
+# number of documents pulled from mongo per round trip / rows written per streamed chunk
+EXPORT_BATCH_SIZE = 500
 
-    mongo_docs = list(cursor)
+_mongo_client = None
 
-    # create an empty DataFrame obj for storing Series objects
-    docs = pandas.DataFrame(columns=[])
+def get_collection(collection_name: str):
+    """returns the mongo collection, reusing one client across exports"""
+    global _mongo_client
+    if _mongo_client is None:
+        mongo_uri = os.getenv("MONGO_CONNECTION")
+        _mongo_client = MongoClient(mongo_uri, server_api=ServerApi('1'))
+    return _mongo_client[os.getenv("MONGO_DATABASE", "brokerai")][collection_name]
 
-    # iterate over the list of MongoDB dict documents
-    for num, doc in enumerate( mongo_docs ):   
-        # convert ObjectId() to str
-        doc["_id"] = str(doc["_id"])
+def get_csv_columns(col, query: dict = None) -> list[str]:
+    """returns the union of top level fields across the documents matching query.
+
+    The union is computed by mongo so only the field names come over the wire,
+    not the documents themselves. `_id` and `name` lead, the rest are sorted so
+    the column order is stable between exports.
+    """
+    pipeline = [
+        {"$match": query or {}},
+        {"$project": {"keys": {"$map": {"input": {"$objectToArray": "$$ROOT"}, "in": "$$this.k"}}}},
+        {"$unwind": "$keys"},
+        {"$group": {"_id": "$keys"}},
+    ]
+    keys = {doc["_id"] for doc in col.aggregate(pipeline, allowDiskUse=True)}
+    leading = [key for key in ("_id", "name") if key in keys]
+    return leading + sorted(keys - set(leading))
+
+def format_csv_cell(value) -> str:
+    """formats a mongo value the same way pandas.to_csv renders it"""
+    if value is None:
+        return ""
+    return str(value)
+
+def stream_csv(col, columns: list[str] = None, batch_size: int = EXPORT_BATCH_SIZE):
+    """yields the collection as CSV text, one chunk per batch of documents.
+
+    Memory stays bounded by batch_size regardless of collection size, and the
+    header is yielded before the first document is read so the response can
+    start immediately.
+    """
+    if columns is None:
+        columns = get_csv_columns(col)
 
-        # get document _id from dict
-        doc_id = doc["_id"]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate(0)
 
-        # create a Series obj from the MongoDB dict
-        series_obj = pandas.Series( doc, name=doc_id )
+    rows = 0
+    for doc in col.find({}, batch_size=batch_size):
+        writer.writerow([format_csv_cell(doc.get(column)) for column in columns])
+        rows += 1
+        if rows % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def get_csv(collection_name: str):
+    """returns [CSV string, DataFrame] of the collection; stream_csv for large exports"""
+    # look out for special characters
+    col = get_collection(collection_name)
+
+    print ("total docs in collection:", col.count_documents( {} ))
+
+    # build the DataFrame in one go instead of appending a Series per document
+    mongo_docs = []
+    for doc in col.find(batch_size=EXPORT_BATCH_SIZE):
+        # convert ObjectId() to str
+        doc["_id"] = str(doc["_id"])
+        mongo_docs.append(doc)
 
-        # append the MongoDB Series obj to the DataFrame obj
-        docs = docs._append( series_obj )
+    docs = pandas.DataFrame(mongo_docs, index=[doc["_id"] for doc in mongo_docs])
 
     # export MongoDB documents to CSV
     csv_export = docs.to_csv(sep=",") # CSV delimited by commas
-    print ("\nCSV data:", csv_export)
 
     return [csv_export, docs]
 
 if __name__ == '__main__':
     # export MongoDB documents to a CSV file
-    get_csv()[1].to_csv("foodhalls.csv", ",") # CSV delimited by commas
\ No newline at end of file
+    with open("foodhalls.csv", "w", newline="") as fp:
+        for chunk in stream_csv(get_collection("foodhalls_csv")):
+            fp.write(chunk)
@@ -0,0 +1,122 @@
+import glob
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import namedtuple
+
+from download_foodhalls_as_csv import stream_csv
+from delta_export import get_tombstone_collection
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv("EXPORT_SNAPSHOT_DIR", "snapshots")
+
+# seconds between version checks; each check is two indexed lookups and a metadata count
+SNAPSHOT_POLL_INTERVAL = int(os.getenv("EXPORT_SNAPSHOT_INTERVAL", "30"))
+
+Snapshot = namedtuple("Snapshot", ["collection_name", "path", "etag", "size"])
+
+def _latest(col, field: str):
+    doc = col.find_one({field: {"$exists": True}}, {field: 1}, sort=[(field, -1)])
+    return doc[field] if doc else None
+
+def collection_version(col) -> str:
+    """returns a short digest that changes whenever the collection's data changes.
+
+    Built from the max updatedAt (every updateDB write bumps it), the newest
+    tombstone and the document count, which catches inserts and deletes that
+    bypass updateDB.
+    """
+    parts = (
+        _latest(col, "updatedAt"),
+        _latest(get_tombstone_collection(col), "deletedAt"),
+        col.estimated_document_count(),
+    )
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+class SnapshotManager:
+    """Keeps a gzipped CSV export of each collection on disk, rebuilt in the
+    background whenever the collection version changes.
+
+    Downloads are served from the current snapshot without touching mongo.
+    """
+    def __init__(self, db, collection_names: list[str], directory: str = SNAPSHOT_DIR,
+                 interval: int = SNAPSHOT_POLL_INTERVAL):
+        self.db = db
+        self.collection_names = list(collection_names)
+        self.directory = os.path.abspath(directory)
+        self.interval = interval
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, collection_name: str, version: str) -> str:
+        return os.path.join(self.directory, f"{collection_name}-{version}.csv.gz")
+
+    def get(self, collection_name: str):
+        """returns the current Snapshot for the collection, or None if there isn't one yet"""
+        with self._lock:
+            return self._snapshots.get(collection_name)
+
+    def refresh(self, collection_name: str) -> Snapshot:
+        """rebuilds the collection's snapshot if its version moved on"""
+        col = self.db[collection_name]
+        version = collection_version(col)
+        current = self.get(collection_name)
+        if current is not None and current.etag == version:
+            return current
+
+        path = self._path(collection_name, version)
+        if not os.path.exists(path):
+            # write next to the final path then rename, so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as fp:
+                    for chunk in stream_csv(col):
+                        fp.write(chunk.encode("utf-8"))
+                os.replace(tmp_path, path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+            logger.info(f"Wrote export snapshot {path}")
+
+        snapshot = Snapshot(collection_name, path, version, os.path.getsize(path))
+        with self._lock:
+            self._snapshots[collection_name] = snapshot
+        self._remove_stale(collection_name, path)
+        return snapshot
+
+    def _remove_stale(self, collection_name: str, keep: str):
+        # open file handles keep serving in-flight downloads after the unlink
+        for path in glob.glob(os.path.join(self.directory, f"{collection_name}-*.csv.gz")):
+            if path != keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def notify(self):
+        """asks the background thread to check versions now instead of waiting for the next poll"""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            for collection_name in self.collection_names:
+                try:
+                    self.refresh(collection_name)
+                except Exception as e:
+                    logger.error(f"Error refreshing export snapshot for {collection_name}: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self):
+        """starts the background refresh thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="export-snapshots", daemon=True)
+            self._thread.start()
+        return self
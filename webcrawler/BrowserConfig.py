@@ -1,12 +1,19 @@
 import logging
 from selenium import webdriver
+from selenium.common.exceptions import InvalidSessionIdException, NoSuchWindowException, WebDriverException
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service as ChromeService
 from webdriver_manager.chrome import ChromeDriverManager
 import undetected_chromedriver as uc
 import os
 import platform
+import queue
 import subprocess
+import threading
+from contextlib import contextmanager
+from urllib3.exceptions import MaxRetryError
+
+from webcrawler import metrics, replay
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -21,16 +28,123 @@ def get_chrome_options():
     options.page_load_strategy = 'normal'
     return options
 
+# when set, create_browser() returns _browser_factory() instead of starting Chrome
+_browser_factory = None
+
+def set_browser_factory(factory):
+    """makes create_browser() (and so every research class) use factory(), e.g. a benchmark's
+    fixture browser; None goes back to Chrome"""
+    global _browser_factory
+    _browser_factory = factory
+
 def create_browser():
+    if replay.replaying():
+        return replay.ReplayBrowser()
+    if _browser_factory is not None:
+        return replay.recorded(_browser_factory())
     options = get_chrome_options()
     try:
         logger.info("Starting Chrome browser...")
-        driver = webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()), options=options)
+        with metrics.BROWSER_CREATE_SECONDS.time():
+            driver = webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()), options=options)
         logger.info("Chrome browser started successfully.")
-        return driver
+        return replay.recorded(driver)
     except Exception as e:
         logger.error(f"Error starting Chrome browser: {e}")
         raise
+# messages of plain WebDriverExceptions that mean Chrome itself is gone, not just the page
+_DEAD_BROWSER_MESSAGES = ("chrome not reachable", "disconnected", "session deleted", "tab crashed",
+                          "target window already closed", "invalid session id")
+
+def is_browser_error(e: Exception) -> bool:
+    """returns whether e means the browser (not just the page it was loading) is unusable"""
+    if isinstance(e, (InvalidSessionIdException, NoSuchWindowException, MaxRetryError, ConnectionError)):
+        return True
+    return isinstance(e, WebDriverException) and any(message in str(e).lower() for message in _DEAD_BROWSER_MESSAGES)
+
+class BrowserPool:
+    """A fixed number of headless browsers shared by research threads.
+
+    Browsers are started on first use and reused afterwards, so a batch pays
+    for Chrome startup once per slot instead of once per venue.
+    """
+    def __init__(self, size: int, factory=create_browser):
+        self.size = size
+        self.factory = factory
+        self._idle = queue.Queue()
+        self._created = 0
+        self._all = []
+        self._lock = threading.Lock()
+
+    def _publish(self):
+        metrics.set_gauge("browser_pool_started", self._created)
+        metrics.set_gauge("browser_pool_in_use", self._created - self._idle.qsize())
+
+    def acquire(self, timeout: float = None):
+        """returns an idle browser, starting a new one while under size, otherwise waits for one"""
+        browser = self._take(timeout)
+        self._publish()
+        return browser
+
+    def _take(self, timeout: float = None):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            start_new = self._created < self.size
+            if start_new:
+                self._created += 1
+        if start_new:
+            try:
+                browser = self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            with self._lock:
+                self._all.append(browser)
+            return browser
+        return self._idle.get(timeout=timeout)
+
+    def release(self, browser, broken: bool = False):
+        """returns a browser to the pool; a broken one is quit and replaced on next acquire"""
+        if not broken:
+            self._idle.put(browser)
+            self._publish()
+            return
+        with self._lock:
+            self._created -= 1
+            self._all.remove(browser)
+        self._publish()
+        try:
+            browser.quit()
+        except Exception as e:
+            logger.error(f"Error quitting broken browser: {e}")
+
+    @contextmanager
+    def browser(self):
+        """with pool.browser() as browser: ... -- marks the browser broken if the block raises"""
+        browser = self.acquire()
+        try:
+            yield browser
+        except Exception:
+            self.release(browser, broken=True)
+            raise
+        else:
+            self.release(browser)
+
+    def close(self):
+        """quits every browser the pool started"""
+        with self._lock:
+            browsers, self._all = self._all, []
+            self._created = 0
+        for browser in browsers:
+            try:
+                browser.quit()
+            except Exception as e:
+                logger.error(f"Error quitting browser: {e}")
+
 def create_undetected_non_headless_browser():
    """Used for cloud flare <3"""
    options = Options()
@@ -15,12 +15,18 @@ load_dotenv()
 
 import time
 import json
+import threading
 
 import urllib.parse
+import urllib.request
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 
 from webcrawler.BrowserConfig import get_chrome_options, create_browser, create_undetected_non_headless_browser
-from webcrawler.gpt import gpt_request, aggregate_gpt_request, extract_json_code_block
+from webcrawler.gpt import gpt_request, aggregate_gpt_request, extract_json_code_block, parse_json
+from webcrawler.alerts import normalize_hall_name
+from webcrawler import llm_usage, metrics, page_store, replay, tracing
+from webcrawler.page_store import PageSnapshot
 import re
 
 import logging
@@ -30,6 +36,39 @@ logger = logging.getLogger(__name__)
 # Define default wait times for Selenium
 DEFAULT_WAIT_TIME = 30
 
+# seconds a loaded page gets to finish rendering before its text / links are read;
+# replayed pages are already rendered
+PAGE_READY_WAIT = float(os.getenv("CRAWL_PAGE_READY_WAIT", "0" if replay.replaying() else "5"))
+LINKS_READY_WAIT = float(os.getenv("CRAWL_LINKS_READY_WAIT", "0" if replay.replaying() else "12"))
+
+# where make_google_search sends queries, e.g. a local fixture server for benchmarks
+GOOGLE_SEARCH_URL = os.getenv("GOOGLE_SEARCH_URL", "https://www.google.com/search")
+
+# reuse search results, page sources and page links within a process, e.g. across a venue's tasks,
+# which all search for the venue and start from its homepage
+PAGE_CACHE = os.getenv("CRAWL_PAGE_CACHE", "false").lower() == "true"
+PAGE_CACHE_TTL = float(os.getenv("CRAWL_PAGE_CACHE_TTL", "3600"))
+PAGE_CACHE_SIZE = int(os.getenv("CRAWL_PAGE_CACHE_SIZE", "500"))
+_page_cache = {}
+_page_cache_lock = threading.Lock()
+
+def cached_page(kind: str, key, load):
+    """returns load(), reusing the result for (kind, key) when the page cache is on and it is fresh enough"""
+    if not PAGE_CACHE:
+        return load()
+    with _page_cache_lock:
+        hit = _page_cache.get((kind, key))
+    if hit is not None and time.monotonic() - hit[0] < PAGE_CACHE_TTL:
+        metrics.inc("page_cache_hits")
+        return list(hit[1]) if isinstance(hit[1], list) else hit[1]
+    value = load()
+    with _page_cache_lock:
+        _page_cache.pop((kind, key), None)
+        _page_cache[(kind, key)] = (time.monotonic(), list(value) if isinstance(value, list) else value)
+        while len(_page_cache) > PAGE_CACHE_SIZE:
+            _page_cache.pop(next(iter(_page_cache)))
+    return value
+
 def valid_url(url: str) -> bool:
     """returns whether this url is valid for search"""
     unnecessary_links = (
@@ -66,9 +105,127 @@ def get_google_alert_links(search_key: str, browser) -> list[str]:
 
     return links
 
+def scrape_google_alert(browser, search_key: str = 'new food hall') -> list[str]:
+    """returns today's google alert article links for new food halls, without duplicates"""
+    links = get_google_alert_links(search_key, browser)
+    return list(dict.fromkeys(links))
+
+def fetch_page_text(url: str, max_length=5000, timeout=15) -> str:
+    """Returns text from specified URL over plain HTTP, no browser. Good enough for news articles."""
+    request = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        page_source = response.read().decode(response.headers.get_content_charset() or "utf-8", errors="replace")
+    soup = BeautifulSoup(page_source, 'html.parser')
+    text = soup.get_text()
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    text = '\n'.join(chunk for chunk in chunks if chunk)
+    if len(text) > max_length:
+        text = text[:max_length] + '... [truncated]'
+    return text
+
+def classify_food_hall_articles(articles: list[dict], gpt_client=None) -> list[dict]:
+    """
+    Asks GPT which new food halls a batch of articles announces.
+
+    Args:
+        articles (list): [{"url": str, "text": str}, ...], sent in one request.
+        gpt_client: The GPT client instance.
+
+    Returns:
+        list: [{"food_hall_name": str, "source": url}, ...]. Raises ValueError if GPT's answer can't be parsed.
+    """
+    instruction = "You are a market researcher tracking newly opened or announced food halls."
+    article_blocks = "\n\n".join(
+        f"Article {i} ({article['url']}):\n{article['text']}" for i, article in enumerate(articles))
+    prompt = ("For each article below, list the names of specific food halls that are newly opened, opening soon or announced. "
+              "Ignore articles that do not name a specific food hall.\n\n" + article_blocks)
+    format_request = ('\n\nReturn the response as json - ONLY return JSON!: '
+                      '{"food_halls": [{"food_hall_name": str, "article": int}]}. Return {"food_halls": []} if there are none.')
+
+    response = gpt_request(instruction, prompt + format_request, gpt_client, call_site="classify_articles", json_mode=True)
+    parsed = parse_json(response, "classify_articles")
+    if not isinstance(parsed, dict):
+        raise ValueError(f"could not parse food hall classification: {response}")
+
+    halls = []
+    for entry in parsed.get("food_halls") or []:
+        name, article = entry.get("food_hall_name"), entry.get("article")
+        if name and isinstance(article, int) and 0 <= article < len(articles):
+            halls.append({"food_hall_name": name, "source": articles[article]["url"]})
+    return halls
+
+def determine_food_halls_in_parallel(article_links: list[str], seen_store=None, max_workers=8, batch_size=5, gpt_client=None) -> list[dict]:
+    """
+    Fetches alert articles concurrently and classifies them in batched GPT calls.
+
+    Args:
+        article_links (list): Article urls, e.g. from scrape_google_alert.
+        seen_store: An AlertSeenStore; articles it has already seen are skipped and halls it knows are dropped.
+            Classified articles are marked seen, failed ones count an attempt; halls are marked known only
+            once their crawl is submitted.
+        max_workers (int): Concurrent page fetches / GPT requests.
+        batch_size (int): Articles per GPT request.
+
+    Returns:
+        list: New halls as [{"food_hall_name": str, "source": url}, ...].
+    """
+    links = [link for link in dict.fromkeys(article_links) if valid_url(link)]
+    if seen_store is not None:
+        links = seen_store.filter_new_urls(links)
+    if not links:
+        return []
+
+    def fetch(url):
+        try:
+            return {"url": url, "text": fetch_page_text(url, max_length=3000)}
+        except Exception as e:
+            logger.warning(f"Could not fetch alert article {url}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        articles = [article for article in executor.map(fetch, links) if article and article["text"]]
+        batches = [articles[i:i + batch_size] for i in range(0, len(articles), batch_size)]
+
+        def classify(batch):
+            try:
+                return batch, classify_food_hall_articles(batch, gpt_client)
+            except Exception as e:
+                logger.error(f"Error classifying alert articles: {e}")
+                return batch, None
+
+        results = list(executor.map(llm_usage.in_context(classify), batches))
+
+    halls = {}
+    classified_urls = []
+    for batch, batch_halls in results:
+        # failed batches stay unseen so the next run retries them, up to ALERT_ARTICLE_MAX_ATTEMPTS times
+        if batch_halls is None:
+            continue
+        classified_urls.extend(article["url"] for article in batch)
+        for hall in batch_halls:
+            halls.setdefault(normalize_hall_name(hall["food_hall_name"]), hall)
+
+    new_halls = list(halls.values())
+    if seen_store is not None:
+        new_halls = [hall for hall in new_halls if not seen_store.is_known_hall(hall["food_hall_name"])]
+        seen_store.mark_urls(classified_urls)
+        classified = set(classified_urls)
+        seen_store.record_failures([link for link in links if link not in classified])
+
+    logger.info(f"Classified {len(classified_urls)} new article(s), found {len(new_halls)} new food hall(s)")
+    return new_halls
+
 def make_google_search(search_query: str, browser, num_links=3):
     """makes a google search and returns the top 'num_links' links"""
-    browser.get(f'https://www.google.com/search?q={search_query}')
+    with tracing.span("search", query=search_query):
+        return cached_page("search", (search_query, num_links),
+                           lambda: _make_google_search(search_query, browser, num_links))
+
+def _make_google_search(search_query: str, browser, num_links: int) -> list[str]:
+    metrics.inc("searches")
+    with metrics.NAVIGATION_SECONDS.labels("search").time():
+        browser.get(f'{GOOGLE_SEARCH_URL}?q={search_query}')
 
     # Collect URLs from search results
     links = []
@@ -85,31 +242,66 @@ def make_google_search(search_query: str, browser, num_links=3):
 
     return links
 
-def scrape_page_text(url: str, browser, max_length=5000) -> str:
-    """Returns text from specified URL, limited to max_length characters."""
-    text = ""
-    try:
+def load_page_source(url: str, browser) -> str:
+    """Loads url in the browser and returns its rendered HTML."""
+    with tracing.span("page", url=url):
+        return cached_page("source", url, lambda: _load_page_source(url, browser))
+
+def _load_page_source(url: str, browser) -> str:
+    metrics.inc("pages_loaded")
+    with metrics.NAVIGATION_SECONDS.labels("page").time():
         browser.get(url)
-        wait = WebDriverWait(browser, 5)
-        time.sleep(5)
-        page_source = browser.page_source
+    with metrics.READY_WAIT_SECONDS.time():
+        time.sleep(PAGE_READY_WAIT)
+    return browser.page_source
+
+def extract_page_text(page_source: str, max_length=5000) -> str:
+    """Returns the visible text of an HTML page, one phrase per line, limited to max_length characters (None for all)."""
+    with metrics.PARSE_SECONDS.time():
         soup = BeautifulSoup(page_source, 'html.parser')
         text = soup.get_text()
         lines = (line.strip() for line in text.splitlines())
         chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
         text = '\n'.join(chunk for chunk in chunks if chunk)
-        if len(text) > max_length:
-            text = text[:max_length] + '... [truncated]'
-    finally:
-        pass
+    if max_length is not None and len(text) > max_length:
+        text = text[:max_length] + '... [truncated]'
+    return text
+
+def scrape_page_text(url: str, browser, max_length=5000) -> str:
+    """Returns text from specified URL, limited to max_length characters."""
+    with tracing.span("scrape", url=url) as span:
+        text = extract_page_text(load_page_source(url, browser), max_length)
+        span.set(characters=len(text))
     return text
 
+def page_snapshot(url: str, page_source: str, max_length=5000) -> PageSnapshot:
+    """Returns the page's text (as extract_page_text) and its absolute links."""
+    text = extract_page_text(page_source, max_length)
+    soup = BeautifulSoup(page_source, 'html.parser')
+    links = (urllib.parse.urljoin(url, a['href']) for a in soup.find_all('a', href=True))
+    return PageSnapshot(url, text, list(dict.fromkeys(link for link in links if link.startswith("http") and valid_url(link))))
+
+def scrape_page_snapshot(url: str, browser, max_length=5000) -> PageSnapshot:
+    """Loads url once and returns its text and absolute links, e.g. for SharedPageStore.put"""
+    with tracing.span("scrape", url=url):
+        return page_snapshot(url, load_page_source(url, browser), max_length)
+
+def extract_page_job(job: dict) -> PageSnapshot:
+    """ProcessPool handler: returns the snapshot of a page whose source was passed as
+    job["page"], a SharedPageStore handle of PageSnapshot(url, page source, [])"""
+    store = page_store.default_store()
+    page = store.attach(job["page"])
+    try:
+        return page_snapshot(page.url, page.text, job.get("max_length", 5000))
+    finally:
+        store.release(job["page"])
+
 def summarize_text(text: str, gpt_client, max_tokens=1000) -> str:
     """Summarizes the provided text to reduce token usage."""
     instruction = "Please provide a concise summary of the following text."
     prompt = f"{instruction}\n\n{text}"
     format_request = "Return the summary as a single paragraph."
-    summary = gpt_request(instruction, prompt + format_request, gpt_client)
+    summary = gpt_request(instruction, prompt + format_request, gpt_client, call_site="summarize")
     return summary
 
 
@@ -118,14 +310,10 @@ def scrape_page_text_headless(url: str, browser) -> str:
     """Returns text from specified URL, pass browser in"""
     text = ""
     try:
-        browser.get(url)
-        page_source = browser.page_source
-        soup = BeautifulSoup(page_source, 'html.parser')
-        text = soup.get_text()
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip()
-                  for line in lines for phrase in line.split("  "))
-        text = '\n'.join(chunk for chunk in chunks if chunk)
+        metrics.inc("pages_loaded")
+        with metrics.NAVIGATION_SECONDS.labels("page").time():
+            browser.get(url)
+        text = extract_page_text(browser.page_source, max_length=None)
 
     finally:
         pass
@@ -138,7 +326,7 @@ def get_all_tags_links_on_page(url: str, browser) -> list[str]:
     try:
         browser.get(url)
         wait = WebDriverWait(browser, 5)
-        time.sleep(12)
+        time.sleep(LINKS_READY_WAIT)
         links = browser.find_elements(By.CSS_SELECTOR, 'a')
         for link in links:
             res.append(
@@ -150,11 +338,18 @@ def get_all_tags_links_on_page(url: str, browser) -> list[str]:
 
 def get_all_links_on_page(url, browser) -> list[str]:
     """returns all links on page of website -> great for smart navigation"""
+    with tracing.span("links", url=url):
+        return cached_page("links", url, lambda: _get_all_links_on_page(url, browser))
+
+def _get_all_links_on_page(url, browser) -> list[str]:
     res = []
     try:
-        browser.get(url)
+        metrics.inc("pages_loaded")
+        with metrics.NAVIGATION_SECONDS.labels("page").time():
+            browser.get(url)
         wait = WebDriverWait(browser, 5)
-        time.sleep(12)
+        with metrics.READY_WAIT_SECONDS.time():
+            time.sleep(LINKS_READY_WAIT)
         links = browser.find_elements(By.CSS_SELECTOR, 'a')
         res.extend([link.get_attribute('href') for link in links])
     finally:
@@ -180,7 +375,7 @@ def webpage_to_json_markdown(website_url, browser):
     format_request = 'Return the response as json - ONLY return JSON!: {"content": str}.'
     
     prompt_details =  prompt + webcontent + format_request
-    gpt_response = gpt_request(gpt_instruction, prompt_details)
+    gpt_response = gpt_request(gpt_instruction, prompt_details, call_site="webpage_to_json")
     page_content_json = re.sub(r"json|```", "", gpt_response).strip()
     
     return page_content_json
@@ -212,11 +407,10 @@ def extract_relevant_info(page_content: str, search_items: list, gpt_client=None
     format_request = 'Return the information as a JSON object with keys for each search item. If no data is found for an item, return None for that item.'
 
     # Making the GPT request to extract relevant information
-    response = gpt_request(instruction, prompt + format_request, gpt_client)
+    response = gpt_request(instruction, prompt + format_request, gpt_client, call_site="extract", json_mode=True)
     
-    try:
-        extracted_data = extract_json_code_block(response)
-    except json.JSONDecodeError:
+    extracted_data = extract_json_code_block(response, "extract")
+    if not extracted_data:
         extracted_data = {item: None for item in search_items}  # Default to None if parsing fails
 
     return extracted_data
@@ -229,6 +423,7 @@ def traverse_pages_intelligently(url: str, browser, max_page_visits=5, venue: st
     """
     Traverses website pages intelligently to find information about the search_items.
     Returns a GPT conversation list that can be used to ask a question to GPT about the pages.
+    Stops once the traversal's LLM calls have used max_tokens, as reported by the API.
     """
     if search_items is None:
         search_items = ['number of floors', 'VIP packages', 'food offered', 'number of bars']  # Default items to search for
@@ -239,92 +434,73 @@ def traverse_pages_intelligently(url: str, browser, max_page_visits=5, venue: st
     
     found_items = set()
     conversation = []
-    total_tokens_used = 0  # Initialize token usage tracker
-    
-    # Start the conversation for intelligent web traversal
-    traverse_prompt = f"You are tasked with navigating through multiple webpages to find accurate data about: {', '.join(search_items)}."
-    response, conversation = aggregate_gpt_request(traverse_prompt, conversation=conversation)
-    
-    # Log the initial token usage
-    tokens_used = count_tokens(traverse_prompt)
-    total_tokens_used += tokens_used
-    logger.info(f"Initial prompt used {tokens_used} tokens. Total tokens: {total_tokens_used}")
-    
-    while url_queue and visited_urls_count < max_page_visits:
-        if total_tokens_used >= max_tokens:
-            logger.warning(f"Token limit reached. Stopping traversal at {total_tokens_used} tokens.")
-            break
-        
-        available_links = [{"link": url} for url in url_queue if valid_url(url) and url not in visited_urls]
-        if not available_links:
-            break
-        
-        link_selection_prompt = (
-            f"You are gathering information about the venue {venue}. Help retrieve information about the venue's: {', '.join(search_items)}.\n"
-            f"Here are some links to choose from- starting with the venue homepage is a good start. Select the most relevant one in the format: {{'link': 'selected_link'}}:\n"
-            f"{json.dumps(available_links, indent=2)}\n"
-            "Please respond with *only* the JSON content and nothing else. The format should strictly be: {'link': 'selected_link'}."
-        )
-        
-        # Add the token usage for the current prompt
-        tokens_used = count_tokens(link_selection_prompt)
-        total_tokens_used += tokens_used
-        logger.info(f"Link selection prompt used {tokens_used} tokens. Total tokens: {total_tokens_used}")
-        
-        if total_tokens_used >= max_tokens:
-            logger.warning(f"Token limit reached. Stopping traversal at {total_tokens_used} tokens.")
-            break
-        
-        response, conversation = aggregate_gpt_request(link_selection_prompt, conversation)
-        
-        try:
-            selected_link_data = extract_json_code_block(response)
-            selected_link = selected_link_data.get("link", None)
-        except:
-            selected_link = available_links[0]["link"]
-        
-        if selected_link in visited_urls or not selected_link:
-            continue
-        
-        # Visit the selected URL and scrape the content
-        browser.get(selected_link)
-        data_content = scrape_page_text_headless(selected_link, browser)
-        
-        # Split the content into smaller chunks
-        content_chunks = chunk_text(data_content)
-        
-        for chunk in content_chunks:
-            if total_tokens_used >= max_tokens:
-                logger.warning(f"Token limit reached. Stopping traversal at {total_tokens_used} tokens.")
+
+    with llm_usage.track() as tokens:
+        # Start the conversation for intelligent web traversal
+        traverse_prompt = f"You are tasked with navigating through multiple webpages to find accurate data about: {', '.join(search_items)}."
+        response, conversation = aggregate_gpt_request(traverse_prompt, conversation=conversation, call_site="traversal_setup")
+        logger.info(f"Initial prompt used {tokens.total_tokens} tokens.")
+
+        while url_queue and visited_urls_count < max_page_visits:
+            if tokens.total_tokens >= max_tokens:
+                logger.warning(f"Token limit reached. Stopping traversal at {tokens.total_tokens} tokens.")
                 break
-            
-            summarized_chunk = summarize_text(chunk, gpt_client)
-            conversation.append({"role": "user", "content": summarized_chunk})
-            
-            # Track tokens used by this chunk
-            tokens_used = count_tokens(summarized_chunk)
-            total_tokens_used += tokens_used
-            logger.info(f"Summarized chunk used {tokens_used} tokens. Total tokens: {total_tokens_used}")
-            
-            # Extract relevant information using GPT
-            extracted_info = extract_relevant_info(summarized_chunk, search_items, gpt_client)
-            for item, value in extracted_info.items():
-                if value is not None:
-                    found_items.add(item)
-        
-        visited_urls.add(selected_link)
-        visited_urls_count += 1
-        
-        # Stop if all search items are found
-        if found_items == set(search_items):
-            break
-        
-        # Get new links from the selected page
-        new_links = get_all_links_on_page(selected_link, browser)
-        url_queue.extend([link for link in new_links if link not in visited_urls])
-        url_queue = [url for url in url_queue if url != selected_link]
-    
-    logger.info(f'Final token usage: {total_tokens_used}. Found Items: {found_items}')
+
+            available_links = [{"link": url} for url in url_queue if valid_url(url) and url not in visited_urls]
+            if not available_links:
+                break
+
+            link_selection_prompt = (
+                f"You are gathering information about the venue {venue}. Help retrieve information about the venue's: {', '.join(search_items)}.\n"
+                f"Here are some links to choose from- starting with the venue homepage is a good start. Select the most relevant one in the format: {{'link': 'selected_link'}}:\n"
+                f"{json.dumps(available_links, indent=2)}\n"
+                "Please respond with *only* the JSON content and nothing else. The format should strictly be: {'link': 'selected_link'}."
+            )
+
+            response, conversation = aggregate_gpt_request(link_selection_prompt, conversation, call_site="link_selection", json_mode=True)
+            logger.info(f"Link selection done. Total tokens: {tokens.total_tokens}")
+
+            # a reply without a link still moves the traversal on
+            selected_link = extract_json_code_block(response, "link_selection").get("link") or available_links[0]["link"]
+
+            if selected_link in visited_urls or not selected_link:
+                continue
+
+            # Visit the selected URL and scrape the content
+            browser.get(selected_link)
+            data_content = scrape_page_text_headless(selected_link, browser)
+
+            # Split the content into smaller chunks
+            content_chunks = chunk_text(data_content)
+
+            for chunk in content_chunks:
+                if tokens.total_tokens >= max_tokens:
+                    logger.warning(f"Token limit reached. Stopping traversal at {tokens.total_tokens} tokens.")
+                    break
+
+                summarized_chunk = summarize_text(chunk, gpt_client)
+                conversation.append({"role": "user", "content": summarized_chunk})
+
+                # Extract relevant information using GPT
+                extracted_info = extract_relevant_info(summarized_chunk, search_items, gpt_client)
+                for item, value in extracted_info.items():
+                    if value is not None:
+                        found_items.add(item)
+                logger.info(f"Summarized and extracted a chunk. Total tokens: {tokens.total_tokens}")
+
+            visited_urls.add(selected_link)
+            visited_urls_count += 1
+
+            # Stop if all search items are found
+            if found_items == set(search_items):
+                break
+
+            # Get new links from the selected page
+            new_links = get_all_links_on_page(selected_link, browser)
+            url_queue.extend([link for link in new_links if link not in visited_urls])
+            url_queue = [url for url in url_queue if url != selected_link]
+
+    logger.info(f'Final token usage: {tokens.total_tokens} (${tokens.cost:.4f}). Found Items: {found_items}')
     return conversation
 def traverse_pages_intelligently_OG(url: str, browser, max_page_visits = 5, venue: str = None, search_items: List[str] = None, gpt_client=None):
     """
@@ -344,7 +520,7 @@ def traverse_pages_intelligently_OG(url: str, browser, max_page_visits = 5, venu
     
     # kickstart conversation for intelligent web traversal 
     traverse_prompt = f"You are tasked with navigating through multiple webpages to find accurate data about: {', '.join(search_items)}."
-    response, conversation = aggregate_gpt_request(traverse_prompt, conversation=conversation)
+    response, conversation = aggregate_gpt_request(traverse_prompt, conversation=conversation, call_site="traversal_setup")
     
     while url_queue and visited_urls_count < max_page_visits:
         available_links = [{"link": url} for url in url_queue if valid_url(url) and url not in visited_urls]
@@ -359,13 +535,10 @@ def traverse_pages_intelligently_OG(url: str, browser, max_page_visits = 5, venu
         )
         # we should add page data to help aid link selection
 
-        response, conversation = aggregate_gpt_request(link_selection_prompt, conversation)
+        response, conversation = aggregate_gpt_request(link_selection_prompt, conversation, call_site="link_selection", json_mode=True)
 
-        try:
-            selected_link_data = extract_json_code_block(response)
-            selected_link = selected_link_data.get("link", None)
-        except:
-            selected_link = available_links[0]["link"]
+        # a reply without a link still moves the traversal on
+        selected_link = extract_json_code_block(response, "link_selection").get("link") or available_links[0]["link"]
 
         if selected_link in visited_urls or not selected_link:
             continue
@@ -418,7 +591,7 @@ def traverse_all_pages(website_url: str, browser, max_page_visits=5, search_item
     found_items = set()
 
     traverse_prompt = f"You are tasked with navigating through multiple webpages to find accurate data about: {', '.join(search_items)}."
-    response, conversation = aggregate_gpt_request(traverse_prompt, conversation=conversation)
+    response, conversation = aggregate_gpt_request(traverse_prompt, conversation=conversation, call_site="traversal_setup")
 
     while url_queue and visited_count < max_page_visits:
         available_links = [{"link": url} for url in url_queue if valid_url(url) and check_domain(url, website_domain) and url not in visited_urls]
@@ -435,13 +608,10 @@ def traverse_all_pages(website_url: str, browser, max_page_visits=5, search_item
         if len(conversation) > MAX_CONVERSATION_LENGTH:
             conversation = conversation[-MAX_CONVERSATION_LENGTH:]
 
-        response, conversation = aggregate_gpt_request(link_selection_prompt, conversation)
+        response, conversation = aggregate_gpt_request(link_selection_prompt, conversation, call_site="link_selection", json_mode=True)
 
-        try:
-            selected_link_data = extract_json_code_block(response)
-            selected_link = selected_link_data.get("link", None)
-        except:
-            selected_link = available_links[0]["link"]
+        # a reply without a link still moves the traversal on
+        selected_link = extract_json_code_block(response, "link_selection").get("link") or available_links[0]["link"]
 
         if selected_link in visited_urls or not selected_link:
             continue
@@ -572,7 +742,7 @@ def main():
     format_request = 'Return the response as json: {"number_of_bars": int}. If you are unable to find anything, set the json value to None'
     conversation = traverse_pages_intelligently("https://bourbonroomhollywood.com/", browser, max_page_visits=4, venue='bourbon room',search_items=["number of bars"])
     
-    response, conversation = aggregate_gpt_request(prompt + format_request, conversation)
+    response, conversation = aggregate_gpt_request(prompt + format_request, conversation, call_site="final_answer")
     print(f'Raw GPT final Response: {response}')
     print(f'Payload: {extract_json_code_block(response)}')
 
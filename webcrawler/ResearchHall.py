@@ -1,271 +1,208 @@
-import json
+import atexit
+import logging
 import os
 import threading
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from dotenv import load_dotenv
-from openai import AzureOpenAI
 
-from webcrawler.CrawlerTools import (make_google_search,
-                                     scrape_page_text)
+from webcrawler.CrawlerTools import make_google_search, load_page_source, extract_page_text, extract_page_job
+
+from webcrawler.BrowserConfig import get_chrome_options, create_browser, is_browser_error
+from webcrawler.freshness import FreshnessPolicy, research_metadata
+from webcrawler.alerts import normalize_hall_name
+from webcrawler import gpt, llm_usage, metrics, page_store, tracing
+from webcrawler.jobs import FATAL_ERRORS
+from webcrawler.page_store import PageSnapshot
+from webcrawler.pipeline import Pipeline, Stage
+from webcrawler.process_pool import ProcessPool
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
-from webcrawler.BrowserConfig import get_chrome_options, create_browser
 load_dotenv(".env.local")
 load_dotenv()
 
-client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),  
-            api_version="2024-02-01",
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-        )
+# None without credentials, e.g. when replaying a recorded crawl
+client = gpt.create_client()
+
+# processes parsing fetched pages, so bs4 doesn't hold the GIL the browsers and LLM calls need;
+# pages reach them through the shared page store. 0 parses in the extract stage's threads
+HALL_EXTRACT_PROCESSES = int(os.getenv("HALL_EXTRACT_PROCESSES", "0"))
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+def extract_pool():
+    """returns the process pool pages are parsed in, or None to parse them in-thread"""
+    global _extract_pool
+    if HALL_EXTRACT_PROCESSES <= 0 or not page_store.available():
+        return None
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            # a parse is small and short, so children are kept for many of them
+            _extract_pool = ProcessPool(HALL_EXTRACT_PROCESSES, max_jobs_per_child=1000, timeout=120)
+            atexit.register(_extract_pool.close)
+        return _extract_pool
 
 class ResearchHall:
+    # stored fields written by each research task, so re-runs can skip tasks whose fields are fresh
+    TASK_FIELDS = {
+        "get_location": ["city", "state"],
+        "get_square_footage": ["square_footage"],
+        "get_number_of_food_stalls": ["food", "bars", "retail"],
+        "get_types_of_food_stalls": ["types_of_food_stalls"],
+        "get_demographic": ["population_density", "median_income", "age_distribution"],
+        "get_local_area_composition": ["composition"],
+        "get_public_transport": ["public_transport"],
+        "get_parking_availability": ["parking_spots", "parking_fees", "peak_time_availability"],
+        "get_foot_traffic_estimates": ["foot_traffic"],
+        "get_annual_visitor_count": ["annual_visitor_count"],
+        "get_lease_rates": ["lease_rates"],
+        "get_occupancy_rate": ["occupancy_rate"],
+        "get_year_established": ["year_established"],
+        "get_renovation_history": ["renovation_history"],
+        "get_owner": ["owner", "contact"],
+        "get_management_company": ["management_company"],
+    }
+
+    # how long a found value stays fresh; None means it never needs re-research (default 90 days)
+    FIELD_MAX_AGE = {
+        "city": None,
+        "state": None,
+        "year_established": None,
+        "square_footage": timedelta(days=365),
+        "renovation_history": timedelta(days=365),
+        "population_density": timedelta(days=365),
+        "median_income": timedelta(days=365),
+        "age_distribution": timedelta(days=365),
+        "composition": timedelta(days=365),
+        "public_transport": timedelta(days=365),
+        "owner": timedelta(days=180),
+        "contact": timedelta(days=180),
+        "management_company": timedelta(days=180),
+        "annual_visitor_count": timedelta(days=180),
+        "food": timedelta(days=60),
+        "bars": timedelta(days=60),
+        "retail": timedelta(days=60),
+        "types_of_food_stalls": timedelta(days=60),
+        "lease_rates": timedelta(days=60),
+        "foot_traffic": timedelta(days=60),
+        "occupancy_rate": timedelta(days=30),
+    }
+
+    # search query suffix, system instruction and prompt of each research task;
+    # {food_hall} in the prompt is replaced with the hall's name
+    TASK_SPECS = {
+        "get_location": (
+            'location',
+            'You are a market researcher and you are helping me find information about certain food halls.',
+            'Given this text content, determine the location of the food hall "{food_hall}". return the response as raw json: {"city": "CityName", "state": "StateCode"}',
+        ),
+        "get_square_footage": (
+            'square footage',
+            'You are a market researcher and you are helping me find information about certain food halls.',
+            'Given this text content, determine the square footage of "{food_hall}". return the response as raw json: {"square_footage": 10000} or {"square_footage": null} if data is unavailable.',
+        ),
+        "get_number_of_food_stalls": (
+            'number of food stalls',
+            'You are a market researcher and you are helping me find information about certain food halls.',
+            'Given this text content, determine the number of food stalls, bar stalls, and retail stalls in "{food_hall}". return the response as raw and VALID json, it is crucial i get this data in the right format: {"food": 3, "bars": 4, "retail": 3} or {"food": null, "bars": null, "retail": null} if information is not available, of course if you can find number of stalls for some, you dont put them all as null.',
+        ),
+        "get_types_of_food_stalls": (
+            'types of food stalls',
+            'You are a market researcher and you are helping me find information about the types of food stalls in certain food halls.',
+            'Given this text content, list the types of food stalls available in "{food_hall}". return the response as raw json: {"types_of_food_stalls": ["Mexican", "Italian", "Japanese"]} or {"types_of_food_stalls": null} if no data is found.',
+        ),
+        "get_demographic": (
+            'area demographics',
+            'You are a market researcher and you are tasked with gathering demographic information about the area surrounding a specific food hall.',
+            'Analyze this text content to provide demographic information of the area surrounding "{food_hall}". return the response as raw json: {"population_density": "100/sq.miles", "median_income": "10000", "age_distribution": {"0-10": "10%", "11-24": "30%"}} or {"data": null} if specifics are unavailable.',
+        ),
+        "get_local_area_composition": (
+            'surrounding area composition',
+            'You are a market researcher and your objective is to understand the composition of the area surrounding a food hall.',
+            'Evaluate the text content to describe the area composition around "{food_hall}". return the response as raw json: {"composition": ["office", "retail", "residential"]} or {"composition": null} if data is not available.',
+        ),
+        "get_public_transport": (
+            'public transport options',
+            'You are a market researcher, aiming to find out about public transport options available near a food hall.',
+            'Summarize information about nearby public transport for "{food_hall}". return the response as raw json: {"public_transport": ["bus", "train", "bike"]} or {"public_transport": null} if information is scarce.',
+        ),
+        "get_parking_availability": (
+            'parking availability',
+            'You are a market researcher focusing on parking availability for a particular food hall.',
+            'Provide details on parking at "{food_hall}". return the response as raw json: {"parking_spots": 1000, "parking_fees": "$5/hr", "peak_time_availability": "10:00am"} or {"data": null} if unavailable.',
+        ),
+        "get_foot_traffic_estimates": (
+            'foot traffic estimates',
+            'As a market researcher, your task is to estimate the foot traffic around a specific food hall.',
+            'Determine the average foot traffic near "{food_hall}". return the response as raw json: {"foot_traffic": "100/hr"} or {"foot_traffic": "1000/day"} or {"data": null} if estimates are not directly available.',
+        ),
+        "get_annual_visitor_count": (
+            'annual visitor count',
+            'You are tasked with finding the annual visitor count for a food hall as part of a market research project.',
+            'Extract information on annual visitor count for "{food_hall}". return the response as raw json: {"annual_visitor_count": 1000000} or {"data": null} if no specific numbers are found.',
+        ),
+        "get_lease_rates": (
+            'lease rates',
+            'Your objective as a market researcher is to determine the lease rates for spaces within a specific food hall.',
+            'Provide the average lease rate for spaces within "{food_hall}". return the response as raw json: {"lease_rates": "$800/sq.ft"} or {"data": null} if precise rates are not available.',
+        ),
+        "get_occupancy_rate": (
+            'occupancy rate',
+            "As a market researcher, it's your job to find out the occupancy rate of a given food hall.",
+            'Analyze to provide the occupancy rate for "{food_hall}". return the response as raw json: {"occupancy_rate": "82%"} or {"data": null} if direct data is unavailable.',
+        ),
+        "get_year_established": (
+            'year established',
+            'Your role as a market researcher involves finding out when a food hall was first established.',
+            'Find out the year of establishment for "{food_hall}". return the response as raw json: {"year_established": 1980} or {"data": null} if the exact year is not available.',
+        ),
+        "get_renovation_history": (
+            'renovation history',
+            'In your capacity as a market researcher, you are to uncover the renovation history of a food hall.',
+            'Detail the renovation history of "{food_hall}". return the response as raw json: {"renovation_history": "Details"} or {"data": null} if comprehensive details are not available.',
+        ),
+        "get_owner": (
+            'owner',
+            'Your task as a market researcher is to identify the owner or owning entity of a food hall.',
+            'Identify the owner of "{food_hall}". return the response as raw json: {"owner": "Name", "contact": "ContactInfo"} or {"data": null} if the owner’s details are not directly available.',
+        ),
+        "get_management_company": (
+            'management company',
+            'The aim of your market research is to find out which company manages a specific food hall.',
+            'Find out the management company for "{food_hall}". return the response as raw json: {"management_company": "CompanyName"} or {"data": null} if the details are not evident.',
+        ),
+    }
+
+    # workers per research pipeline stage; search and fetch workers each hold a browser.
+    # override with HALL_PIPELINE_WORKERS, e.g. "fetch=4,llm=8"
+    PIPELINE_WORKERS = {"search": 1, "fetch": 3, "extract": 1, "llm": 4, "persist": 1}
+
     def __init__(self, mongo_collection, food_hall: str, source = None):
-        food_hall = food_hall.strip().lower()
-        if 'food hall' not in food_hall:
-            food_hall = f'{food_hall} food hall'
+        food_hall = normalize_hall_name(food_hall)
 
         self.mongo_collection = mongo_collection
         self.food_hall = food_hall
         self.article_source = source
         self.sources = []
         self.mongo_foodhall = None
+        # research tasks that raised in the last run_in_parallel
+        self.failed_tasks = []
 
-    def gpt_request(self, gpt_instruction: str, user_prompt: str):
-        """return a list of names of relevant halls"""
-        GPT_INSTRUCTIONS = gpt_instruction
-        user_prompt = user_prompt
-
-        response = client.chat.completions.create(
-            model="gpt-35-turbo",
-            seed=42,
-            temperature=0.3,
-            messages=[
-                {"role": "system", "content": GPT_INSTRUCTIONS},
-                {"role": "user", "content": user_prompt}
-            ]
-        )
-        payload = response.choices[0].message.content
-        return payload
-
-    def get_location(self, browser):  # google maps API
-        """returns location of food hall"""
-        res = None
-        location_instruction = "You are a market researcher and you are helping me find information about certain food halls."
-        prompt = f'Given this text content, determine the location of the food hall "{self.food_hall}"' + \
-            '. return the response as raw json: {"city": "CityName", "state": "StateCode"}'
-        google_link = make_google_search(
-            f'{self.food_hall} location', browser, 1)[0]
-        try:
-            webcontent = scrape_page_text(google_link, browser)
-            res = self.gpt_request(location_instruction, prompt + webcontent)
-        except:
-            print('get_locations went wrong')
-
-        return res, google_link
-
-    def get_square_footage(self, browser):
-        """returns get_square_footage of food hall"""
-        res = None
-        location_instruction = "You are a market researcher and you are helping me find information about certain food halls."
-        prompt = f'Given this text content, determine the square footage of "{self.food_hall}"' + \
-            '. return the response as raw json: {"square_footage": 10000} or {"square_footage": null} if data is unavailable.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} square footage', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(location_instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_number_of_food_stalls(self, browser):
-        """returns number of food, bar, and retail stalls of food hall"""
-        location_instruction = "You are a market researcher and you are helping me find information about certain food halls."
-        prompt = f'Given this text content, determine the number of food stalls, bar stalls, and retail stalls in "{self.food_hall}"' + \
-            '. return the response as raw and VALID json, it is crucial i get this data in the right format: {"food": 3, "bars": 4, "retail": 3} or {"food": null, "bars": null, "retail": null} if information is not available, of course if you can find number of stalls for some, you dont put them all as null.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} number of food stalls', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(location_instruction, prompt + webcontent)
-        return res, google_link
-
-    # GPT Generated all below... this is what we want to do with the universal scraper...
-
-    def get_types_of_food_stalls(self, browser):
-        """Returns types of food stalls in food hall"""
-        instruction = "You are a market researcher and you are helping me find information about the types of food stalls in certain food halls."
-        prompt = f'Given this text content, list the types of food stalls available in "{self.food_hall}"' + \
-            '. return the response as raw json: {"types_of_food_stalls": ["Mexican", "Italian", "Japanese"]} or {"types_of_food_stalls": null} if no data is found.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} types of food stalls', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_demographic(self, browser):
-        """Returns demographic information of the area surrounding the food hall."""
-        instruction = "You are a market researcher and you are tasked with gathering demographic information about the area surrounding a specific food hall."
-        prompt = f'Analyze this text content to provide demographic information of the area surrounding "{self.food_hall}"' + \
-            '. return the response as raw json: {"population_density": "100/sq.miles", "median_income": "10000", "age_distribution": {"0-10": "10%", "11-24": "30%"}} or {"data": null} if specifics are unavailable.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} area demographics', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_local_area_composition(self, browser):
-        """Returns information on the local area composition around the food hall."""
-        instruction = "You are a market researcher and your objective is to understand the composition of the area surrounding a food hall."
-        prompt = f'Evaluate the text content to describe the area composition around "{self.food_hall}"' + \
-            '. return the response as raw json: {"composition": ["office", "retail", "residential"]} or {"composition": null} if data is not available.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} surrounding area composition', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_public_transport(self, browser):
-        """Returns public transport options available near the food hall."""
-        instruction = "You are a market researcher, aiming to find out about public transport options available near a food hall."
-        prompt = f'Summarize information about nearby public transport for "{self.food_hall}"' + \
-            '. return the response as raw json: {"public_transport": ["bus", "train", "bike"]} or {"public_transport": null} if information is scarce.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} public transport options', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_parking_availability(self, browser):
-        """Returns parking availability information for the food hall."""
-        instruction = "You are a market researcher focusing on parking availability for a particular food hall."
-        prompt = f'Provide details on parking at "{self.food_hall}".' + \
-            ' return the response as raw json: {"parking_spots": 1000, "parking_fees": "$5/hr", "peak_time_availability": "10:00am"} or {"data": null} if unavailable.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} parking availability', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_foot_traffic_estimates(self, browser):
-        """Returns foot traffic estimates near the food hall."""
-        instruction = "As a market researcher, your task is to estimate the foot traffic around a specific food hall."
-        prompt = f'Determine the average foot traffic near "{self.food_hall}".' + \
-            ' return the response as raw json: {"foot_traffic": "100/hr"} or {"foot_traffic": "1000/day"} or {"data": null} if estimates are not directly available.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} foot traffic estimates', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_annual_visitor_count(self, browser):
-        """Returns the annual visitor count of the food hall."""
-        instruction = "You are tasked with finding the annual visitor count for a food hall as part of a market research project."
-        prompt = f'Extract information on annual visitor count for "{self.food_hall}"' + \
-            '. return the response as raw json: {"annual_visitor_count": 1000000} or {"data": null} if no specific numbers are found.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} annual visitor count', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_lease_rates(self, browser):
-        """Returns lease rates for the food hall."""
-        instruction = "Your objective as a market researcher is to determine the lease rates for spaces within a specific food hall."
-        prompt = f'Provide the average lease rate for spaces within "{self.food_hall}".' + \
-            ' return the response as raw json: {"lease_rates": "$800/sq.ft"} or {"data": null} if precise rates are not available.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} lease rates', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_occupancy_rate(self, browser):
-        """Returns the occupancy rate of the food hall."""
-        instruction = "As a market researcher, it's your job to find out the occupancy rate of a given food hall."
-        prompt = f'Analyze to provide the occupancy rate for "{self.food_hall}".' + \
-            ' return the response as raw json: {"occupancy_rate": "82%"} or {"data": null} if direct data is unavailable.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} occupancy rate', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_year_established(self, browser):
-        """Returns the year the food hall was established."""
-        instruction = "Your role as a market researcher involves finding out when a food hall was first established."
-        prompt = f'Find out the year of establishment for "{self.food_hall}".' + \
-            ' return the response as raw json: {"year_established": 1980} or {"data": null} if the exact year is not available.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} year established', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_renovation_history(self, browser):
-        """Returns the renovation history of the food hall."""
-        instruction = "In your capacity as a market researcher, you are to uncover the renovation history of a food hall."
-        prompt = f'Detail the renovation history of "{self.food_hall}".' + \
-            ' return the response as raw json: {"renovation_history": "Details"} or {"data": null} if comprehensive details are not available.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} renovation history', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_owner(self, browser):
-        """Returns the owner of the food hall."""
-        instruction = "Your task as a market researcher is to identify the owner or owning entity of a food hall."
-        prompt = f'Identify the owner of "{self.food_hall}". ' + \
-            'return the response as raw json: {"owner": "Name", "contact": "ContactInfo"} or {"data": null} if the owner’s details are not directly available.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} owner', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_management_company(self, browser):
-        """Returns the management company of the food hall."""
-        instruction = "The aim of your market research is to find out which company manages a specific food hall."
-        prompt = f'Find out the management company for "{self.food_hall}".' + \
-            ' return the response as raw json: {"management_company": "CompanyName"} or {"data": null} if the details are not evident.'
-
-        google_link = make_google_search(
-            f'{self.food_hall} management company', browser, 1)[0]
-        webcontent = scrape_page_text(google_link, browser)
-
-        res = self.gpt_request(instruction, prompt + webcontent)
-        return res, google_link
-
-    def get_photos(self, browser):
-        """Returns the urls to food hall photos."""
-        res = get_images(self.food_hall, browser)
-        return res, None
+    def gpt_request(self, gpt_instruction: str, user_prompt: str, call_site: str):
+        """returns GPT's answer to the prompt as a JSON object; usage is recorded against the current task"""
+        return gpt.gpt_request(gpt_instruction, user_prompt, client, model="gpt-35-turbo",
+                               call_site=call_site, json_mode=True)
+
+    def task_query(self, task_name: str) -> str:
+        """returns the google search query of a research task"""
+        return f"{self.food_hall} {self.TASK_SPECS[task_name][0]}"
+
+    def task_prompt(self, task_name: str) -> tuple[str, str]:
+        """returns the GPT instruction and prompt (without page content) of a research task"""
+        _, instruction, prompt = self.TASK_SPECS[task_name]
+        return instruction, prompt.replace("{food_hall}", self.food_hall)
 
     def updateDB(self, data: dict, source: dict):
         """Updates the database with the data"""
@@ -283,111 +220,131 @@ class ResearchHall:
                 self.mongo_foodhall = new_foodhall
                 pass 
         # make updates to the mongodb food hall 
-        update_result = self.mongo_collection.update_one(
-            {"name": self.food_hall},  # Use the document's _id for the filter
-            {"$set": data,
-             '$currentDate': {'updatedAt': True}  # Automatically set the update timestamp
-            },  # Use the '$set' operator to update fields
-            
-        )
+        with metrics.MONGO_WRITE_SECONDS.labels(self.mongo_collection.name).time(), \
+                tracing.span("mongo.update", collection=self.mongo_collection.name, fields=list(data)):
+            update_result = self.mongo_collection.update_one(
+                {"name": self.food_hall},  # Use the document's _id for the filter
+                {"$set": data,
+                 '$currentDate': {'updatedAt': True}  # Automatically set the update timestamp
+                },  # Use the '$set' operator to update fields
+
+            )
         print(f"Updated {update_result.modified_count} document(s).")
         pass
 
-    def browser_research(self, browser, tasks):
-        """Executes a list of research tasks using the given browser instance."""
-        for task in tasks:
-            # Assuming each task function takes a 'food_hall' string and a 'browser' object
-            # You might need to adjust this call depending on how your task functions are structured
-            try:
-                task_response, google_link = task(browser)
-                string = task_response.replace("```json", "").replace("```", "")
-                
-                # Debug print to check the content of the string
-                print(f"Raw JSON string: {string}")
-
-                if '{"data": null}' not in string:
-                    try:
-                        data = json.loads(string)
-                    except json.JSONDecodeError as e:
-                        print(f"JSON decode error: {e.msg} at line {e.lineno} column {e.colno}")
-                        continue
-
-                    if "data" in data and data["data"] is None:
-                        continue
-
-                    source = None
-                    if google_link:
-                        label_formatted = task.__name__.replace("get_", "").replace("_", " ").title()
-                        self.sources.append({"source": google_link, "label": label_formatted})
-                        source = {"source": google_link, "label": label_formatted}
-
-                    print(f"Parsed data: {data}, Source: {source}")
-                    self.updateDB(data, source)
-                else:
-                    print(f"Data not found for {task.__name__}")
-
-                self.updateDB({"sources": self.sources}, {})
-            
-            except Exception as e:
-                print(f"Unexpected error in task {task.__name__}: {str(e)}")
-
-    def run_in_parallel(self):
-        options = get_chrome_options()
-
-        # Initialize browser instances
-        browser1 = create_browser()
-        browser2 = create_browser()
-        browser3 = create_browser()
-        browser4 = create_browser()
-
-        # Define the tasks for each browser (quartering the total tasks)
-        all_tasks = [
-            # self.get_photos,
-            self.get_location,
-            self.get_square_footage,
-            self.get_number_of_food_stalls,
-            self.get_types_of_food_stalls,
-            self.get_demographic,
-            self.get_local_area_composition,
-            self.get_public_transport,
-            self.get_parking_availability,
-            self.get_foot_traffic_estimates,
-            self.get_annual_visitor_count,
-            self.get_lease_rates,
-            self.get_occupancy_rate,
-            self.get_year_established,
-            self.get_renovation_history,
-            self.get_owner,
-            self.get_management_company,
-        ]
-
-        tasks1 = all_tasks[:4]
-        tasks2 = all_tasks[4:8]
-        tasks3 = all_tasks[8:12]
-        tasks4 = all_tasks[12:]
-
-        # Create and start threads for each set of tasks
-        thread1 = threading.Thread(target=self.browser_research, args=(browser1, tasks1))
-        thread2 = threading.Thread(target=self.browser_research, args=(browser2, tasks2))
-        thread3 = threading.Thread(target=self.browser_research, args=(browser3, tasks3))
-        thread4 = threading.Thread(target=self.browser_research, args=(browser4, tasks4))
-
-        thread1.start()
-        thread2.start()
-        thread3.start()
-        thread4.start()
-
-        # Wait for all threads to complete
-        thread1.join()
-        thread2.join()
-        thread3.join()
-        thread4.join()
-
-        # Close browsers after completing tasks
-        browser1.quit()
-        browser2.quit()
-        browser3.quit()
-        browser4.quit()
+    def store_task_response(self, task_name: str, task_response: str, google_link: str):
+        """Parses a research task's GPT response and stores its fields, research metadata and source.
+        Raises if the reply has no JSON object, so the task counts as failed and is retried."""
+        fields = self.TASK_FIELDS.get(task_name, [])
+        string = task_response or ""
+        logger.info(f"Raw JSON string: {string}")
+
+        if '{"data": null}' not in string:
+            data = gpt.parse_json(string, task_name)
+            if not isinstance(data, dict):
+                raise ValueError(f"No JSON object in the reply to {task_name}: {string[:200]!r}")
+
+            if "data" in data and data["data"] is None:
+                self.updateDB(research_metadata(fields, {}), None)
+                return
+
+            source = None
+            if google_link:
+                label_formatted = task_name.replace("get_", "").replace("_", " ").title()
+                self.sources.append({"source": google_link, "label": label_formatted})
+                source = {"source": google_link, "label": label_formatted}
+
+            logger.info(f"Parsed data: {data}, Source: {source}")
+            self.updateDB({**data, **research_metadata(fields, data, source)}, source)
+        else:
+            logger.info(f"Data not found for {task_name}")
+            self.updateDB(research_metadata(fields, {}), None)
+
+        self.updateDB({"sources": self.sources}, {})
+
+    def _search_stage(self, task_name: str, browser):
+        links = make_google_search(self.task_query(task_name), browser, 1)
+        if not links:
+            logger.info(f"No search results for {task_name}")
+            return None
+        return {"task": task_name, "link": links[0]}
+
+    def _fetch_stage(self, item: dict, browser):
+        html = load_page_source(item["link"], browser)
+        if extract_pool() is not None:
+            # copied into shared memory once; the extraction process attaches to it by handle
+            item["page"] = page_store.default_store().put(PageSnapshot(item["link"], html, []))
+        else:
+            item["html"] = html
+        return item
+
+    def _extract_stage(self, item: dict, _):
+        if "page" not in item:
+            item["text"] = extract_page_text(item.pop("html"))
+            return item
+        handle = item.pop("page")
+        try:
+            item["text"] = extract_pool().run(extract_page_job, {"page": handle}).text
+        finally:
+            page_store.default_store().release(handle)
+        return item
+
+    def _llm_stage(self, item: dict, _):
+        instruction, prompt = self.task_prompt(item["task"])
+        with llm_usage.attribute(field=item["task"]):
+            item["response"] = self.gpt_request(instruction, prompt + item.pop("text"), call_site=item["task"])
+        return item
+
+    def _persist_stage(self, item: dict, _):
+        self.store_task_response(item["task"], item["response"], item["link"])
+        return item["task"]
+
+    def research_pipeline(self, task_count: int) -> Pipeline:
+        """Returns the search -> fetch -> extract -> llm -> persist pipeline, with no more browsers than tasks"""
+        workers = dict(self.PIPELINE_WORKERS)
+        for setting in filter(None, os.getenv("HALL_PIPELINE_WORKERS", "").split(",")):
+            stage, count = setting.split("=")
+            workers[stage.strip()] = int(count)
+
+        def quit_browser(browser):
+            browser.quit()
+
+        return Pipeline("hall", [
+            Stage("search", self._search_stage, min(workers["search"], task_count), setup=create_browser, teardown=quit_browser,
+                  broken=is_browser_error),
+            Stage("fetch", self._fetch_stage, min(workers["fetch"], task_count), setup=create_browser, teardown=quit_browser,
+                  broken=is_browser_error),
+            # one thread per extraction process when pages are parsed out of process
+            Stage("extract", self._extract_stage, max(workers["extract"], HALL_EXTRACT_PROCESSES if extract_pool() else 0)),
+            Stage("llm", self._llm_stage, min(workers["llm"], task_count)),
+            # a single writer, so the first task to finish creates the document without racing the others
+            Stage("persist", self._persist_stage, 1),
+        ], fatal=FATAL_ERRORS)
+
+    def run_in_parallel(self, force: bool = False):
+        """Researches the food hall through the staged research pipeline. For a hall already
+        in the database only tasks with stale or missing fields run, unless force is set."""
+        # research task names, run by the search -> ... -> persist pipeline
+        all_tasks = list(self.TASK_SPECS)
+
+        existing = self.mongo_collection.find_one({"name": self.food_hall})
+        tasks = all_tasks if force else FreshnessPolicy(self.TASK_FIELDS, self.FIELD_MAX_AGE).stale_tasks(existing, all_tasks)
+        if existing is not None:
+            self.mongo_foodhall = existing
+            # keep sources of the fields we aren't researching again
+            rerun_labels = {task.replace("get_", "").replace("_", " ").title() for task in tasks}
+            self.sources = [source for source in existing.get("sources", []) if source.get("label") not in rerun_labels]
+
+        if not tasks:
+            logger.info(f"All fields of {self.food_hall} are fresh, nothing to research")
+            return
+        logger.info(f"Researching {len(tasks)} of {len(all_tasks)} tasks for {self.food_hall}")
+
+        with llm_usage.attribute(entity=self.food_hall):
+            pipeline = self.research_pipeline(len(tasks))
+            pipeline.run(tasks)
+        # the search stage gets task names, the later stages items carrying one
+        self.failed_tasks = sorted({item if isinstance(item, str) else item["task"] for _, item, _ in pipeline.failures})
 
     def __str__(self):
         """
@@ -1,13 +1,15 @@
 import os
 import threading
-from datetime import datetime
-import json
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from webcrawler.CrawlerTools import (traverse_pages_intelligently, scrape_concerts_per_year, make_google_search, scrape_page_text, traverse_all_pages)
-from webcrawler.gpt import create_client, gpt_request, aggregate_gpt_request, extract_json_code_block
-from webcrawler.BrowserConfig import create_browser, kill_chrome
+from webcrawler.gpt import create_client, gpt_request, aggregate_gpt_request, parse_json, conform
+from webcrawler.BrowserConfig import create_browser, is_browser_error
+from webcrawler.freshness import FreshnessPolicy, research_metadata
+from webcrawler.jobs import FATAL_ERRORS
+from webcrawler import llm_usage, metrics, tracing
 import logging
 import time
 
@@ -19,7 +21,38 @@ load_dotenv(".env.local")
 load_dotenv()
 
 class ResearchVenue:  
-    def __init__(self, venue_name: str, mongo_collection, source=None):
+    # stored fields written by each research task, so re-runs can skip tasks whose fields are fresh
+    TASK_FIELDS = {
+        "get_vip_packages_access": ["vip_packages_access"],
+        "get_city": ["city"],
+        "get_capacity": ["capacity"],
+        "get_owned": ["owned"],
+        "get_number_of_bars": ["number_of_bars"],
+        "get_square_footage": ["square_footage"],
+        "get_number_of_stories": ["number_of_stories"],
+        "get_management": ["management"],
+        "get_food_offered": ["food_offered"],
+        "get_yearly_number_of_shows": ["yearly_number_of_shows"],
+    }
+
+    # how long a found value stays fresh; None means it never needs re-research (default 90 days)
+    FIELD_MAX_AGE = {
+        "city": None,
+        "number_of_stories": timedelta(days=730),
+        "capacity": timedelta(days=365),
+        "square_footage": timedelta(days=365),
+        "owned": timedelta(days=180),
+        "management": timedelta(days=180),
+        "number_of_bars": timedelta(days=180),
+        "food_offered": timedelta(days=180),
+        "vip_packages_access": timedelta(days=60),
+        "yearly_number_of_shows": timedelta(days=30),
+    }
+
+    # pages traverse_pages_intelligently visits per field from the venue's homepage
+    TRAVERSAL_PAGES = int(os.getenv("VENUE_TRAVERSAL_PAGES", "3"))
+
+    def __init__(self, venue_name: str, mongo_collection, source=None, browser_pool=None, skip_tasks=None, on_task_done=None):
         # MongoDB Schema
         self.venue: str = venue_name
         self.city: str = None
@@ -45,16 +78,24 @@ class ResearchVenue:
         # GPT client
         self.gpt_client = create_client()
 
+        # Shared browsers (BrowserPool) instead of 4 fresh ones, tasks already done by a
+        # resumed batch, and a callback(task_name) after each completed task
+        self.browser_pool = browser_pool
+        self.skip_tasks = set(skip_tasks or [])
+        self.on_task_done = on_task_done
+        # research tasks that raised, their fields are left as they were
+        self.failed_tasks = []
+        # a FATAL_ERRORS error one thread hit; the others stop and run_in_parallel raises it
+        self.fatal_error = None
+
         # MongoDB connections
         self.mongo_collection = mongo_collection
         self.mongo_venue = self.get_existing_venue()  # Initialize with existing venue object, if available
 
-        # If the venue already exists in the database, skip redundant research
+        # If the venue already exists in the database, only its stale or missing fields are researched
         if self.mongo_venue:
             logger.info(f"Venue {self.venue} already exists in the database.")
-            self.run_in_parallel()
-        else:
-            self.run_in_parallel()
+        self.run_in_parallel()
 
     def get_existing_venue(self):
         """Check if the venue already exists in the MongoDB collection."""
@@ -89,7 +130,7 @@ class ResearchVenue:
         prompt = f'Find the city that the music or theatre venue `{self.venue}` is located in.'
         format_request = 'Return the response as json: {"city": str}. If unable to find accurate data, set the json value to None'
 
-        res = gpt_request(instruction, prompt + webcontent + format_request, self.gpt_client)
+        res = gpt_request(instruction, prompt + webcontent + format_request, self.gpt_client, call_site="get_city", json_mode=True)
         return res, google_link
 
     def get_capacity(self, browser) -> dict:
@@ -104,7 +145,7 @@ class ResearchVenue:
         prompt = f'Find the capacity of the music or theatre venue `{self.venue}`.'
         format_request = 'Return the response as json: {"capacity": int}. If unable to find accurate data, set the json value to None'
 
-        res = gpt_request(instruction, prompt + webcontent + format_request, self.gpt_client)
+        res = gpt_request(instruction, prompt + webcontent + format_request, self.gpt_client, call_site="get_capacity", json_mode=True)
         return res, google_link
 
     def get_owned(self, browser) -> dict:
@@ -119,7 +160,7 @@ class ResearchVenue:
         prompt = f'Find the ownership details of the music or theatre venue `{self.venue}`.'
         format_request = 'Return the response as json: {"owned": str}. If unable to find accurate data, set the json value to None'
 
-        res = gpt_request(instruction, prompt + webcontent + format_request, self.gpt_client)
+        res = gpt_request(instruction, prompt + webcontent + format_request, self.gpt_client, call_site="get_owned", json_mode=True)
         return res, google_link
 
     def get_management(self, browser) -> dict:
@@ -134,7 +175,7 @@ class ResearchVenue:
         prompt = f'Find the management details of the music or theatre venue `{self.venue}`.'
         format_request = 'Return the response as json: {"management": str}. If unable to find accurate data, set the json value to None'
 
-        res = gpt_request(instruction, prompt + webcontent + format_request, self.gpt_client)
+        res = gpt_request(instruction, prompt + webcontent + format_request, self.gpt_client, call_site="get_management", json_mode=True)
         return res, google_link
 
     def get_square_footage(self, browser) -> dict:
@@ -149,7 +190,7 @@ class ResearchVenue:
         prompt = f'Find the square footage of the music or theatre venue `{self.venue}`.'
         format_request = 'Return the response as json: {"square_footage": int}. If unable to find accurate data, set the json value to None'
 
-        res = gpt_request(instruction, prompt + webcontent + format_request, self.gpt_client)
+        res = gpt_request(instruction, prompt + webcontent + format_request, self.gpt_client, call_site="get_square_footage", json_mode=True)
         return res, google_link
 
     # Updated code snippet within the ResearchVenue class
@@ -166,24 +207,16 @@ class ResearchVenue:
         self.homelink = google_link
 
         # First, try to get the data by traversing pages
-        conversation = traverse_pages_intelligently(google_link, browser, max_page_visits=3, search_items=[search_item], gpt_client=self.gpt_client)
+        conversation = traverse_pages_intelligently(google_link, browser, max_page_visits=self.TRAVERSAL_PAGES, search_items=[search_item], gpt_client=self.gpt_client)
         
         if conversation:
             # Process and retrieve data from the traversed pages
             prompt = f'Find the {search_item} of the music or theatre venue `{self.venue}`. If there is no mention of a second floor, story, or a mezzanine (2 floors), then set number of stories to 1.'
             format_request = 'Return the response as json: {"number_of_stories": int}. If unable to find accurate data, set the json value to None'
-            response, conversation = aggregate_gpt_request(prompt + format_request, conversation)
-            
-            # Check if the response is a valid JSON string and load it
-            if isinstance(response, str):
-                try:
-                    response = extract_json_code_block(response)
-                except json.JSONDecodeError:
-                    logger.error(f"Error decoding JSON from GPT response: {response}")
-                    return {"number_of_stories": None}, self.homelink
-
-            # Ensure the response is a dictionary and contains the desired key
-            if isinstance(response, dict) and "number_of_stories" in response:
+            response, conversation = aggregate_gpt_request(prompt + format_request, conversation, call_site="final_answer",
+                                                           json_mode=True)
+            response = conform(parse_json(response, "final_answer"), {"number_of_stories": int})
+            if response is not None:
                 return response, self.homelink
 
         # If traversed pages did not provide data, use regular Google search
@@ -202,23 +235,16 @@ class ResearchVenue:
         self.homelink = google_link
 
         # First, try to get the data by traversing pages
-        conversation = traverse_pages_intelligently(google_link, browser, max_page_visits=3, search_items=[search_item], gpt_client=self.gpt_client)
+        conversation = traverse_pages_intelligently(google_link, browser, max_page_visits=self.TRAVERSAL_PAGES, search_items=[search_item], gpt_client=self.gpt_client)
 
         if conversation:
             # Process and retrieve data from the traversed pages
             prompt = f'Find the {search_item} of the music or theatre venue `{self.venue}`. If there is a mention of a venue having drinks provided, then say there is 1 bar. Otherwise, if there is no mention of drinks served or bars, then there is 0 bars.'
             format_request = 'Return the response as json: {"number_of_bars": int}. If unable to find accurate data, set the json value to None'
-            response, conversation = aggregate_gpt_request(prompt + format_request, conversation)
-            
-            # Check if response is a JSON string and load it
-            if isinstance(response, str):
-                try:
-                    response = extract_json_code_block(response)
-                except json.JSONDecodeError:
-                    logger.error(f"Error decoding JSON from GPT response: {response}")
-                    return {"number_of_bars": None}, self.homelink
-
-            if isinstance(response, dict) and "number_of_bars" in response:
+            response, conversation = aggregate_gpt_request(prompt + format_request, conversation, call_site="final_answer",
+                                                           json_mode=True)
+            response = conform(parse_json(response, "final_answer"), {"number_of_bars": int})
+            if response is not None:
                 return response, self.homelink
 
         # If traversed pages did not provide data, use regular Google search
@@ -236,24 +262,16 @@ class ResearchVenue:
         self.homelink = google_link
 
         # First, try to get the data by traversing pages
-        conversation = traverse_pages_intelligently(google_link, browser, max_page_visits=3, search_items=[search_item], gpt_client=self.gpt_client)
+        conversation = traverse_pages_intelligently(google_link, browser, max_page_visits=self.TRAVERSAL_PAGES, search_items=[search_item], gpt_client=self.gpt_client)
 
         if conversation:
             # Process and retrieve data from the traversed pages
             prompt = f'Find out if food is offered at the music or theatre venue `{self.venue}`. If there is a mention of food served, available, or a menu is available, then this value should be true that there is food provided. Otherwise, if there is no mention of food, then this is false'
             format_request = 'Return the response as json: {"food_offered": bool}. If unable to find accurate data, set the json value to None'
-            response, conversation = aggregate_gpt_request(prompt + format_request, conversation)
-            
-            # Check if the response is a string and load it as JSON
-            if isinstance(response, str):
-                try:
-                    response = extract_json_code_block(response)
-                except json.JSONDecodeError:
-                    logger.error(f"Error decoding JSON from GPT response: {response}")
-                    return {"food_offered": None}, self.homelink
-
-            # Ensure the response is a dictionary and contains the desired key
-            if isinstance(response, dict) and "food_offered" in response:
+            response, conversation = aggregate_gpt_request(prompt + format_request, conversation, call_site="final_answer",
+                                                           json_mode=True)
+            response = conform(parse_json(response, "final_answer"), {"food_offered": bool})
+            if response is not None:
                 return response, self.homelink
 
         # If traversed pages did not provide data, use regular Google search
@@ -271,24 +289,16 @@ class ResearchVenue:
         self.homelink = google_link
 
         # First, try to get the data by traversing pages
-        conversation = traverse_pages_intelligently(google_link, browser, max_page_visits=3, search_items=[search_item], gpt_client=self.gpt_client)
+        conversation = traverse_pages_intelligently(google_link, browser, max_page_visits=self.TRAVERSAL_PAGES, search_items=[search_item], gpt_client=self.gpt_client)
 
         if conversation:
             # Process and retrieve data from the traversed pages
             prompt = f'Find the details of the VIP packages offered at the music or theatre venue `{self.venue}`.'
             format_request = 'Return the response as json: {"vip_packages_access": str}. If unable to find accurate data, set the json value to None'
-            response, conversation = aggregate_gpt_request(prompt + format_request, conversation)
-            
-            # Check if the response is a string and load it as JSON
-            if isinstance(response, str):
-                try:
-                    response = extract_json_code_block(response)
-                except json.JSONDecodeError:
-                    logger.error(f"Error decoding JSON from GPT response: {response}")
-                    return {"vip_packages_access": None}, self.homelink
-
-            # Ensure the response is a dictionary and contains the desired key
-            if isinstance(response, dict) and "vip_packages_access" in response:
+            response, conversation = aggregate_gpt_request(prompt + format_request, conversation, call_site="final_answer",
+                                                           json_mode=True)
+            response = conform(parse_json(response, "final_answer"), {"vip_packages_access": str})
+            if response is not None:
                 return response, self.homelink
 
         # If traversed pages did not provide data, use regular Google search
@@ -304,22 +314,31 @@ class ResearchVenue:
             self.mongo_venue = new_venue
 
         # Make updates to the MongoDB venue
-        update_result = self.mongo_collection.update_one(
-            {"name": self.venue},
-            {"$set": data,
-             '$currentDate': {'updatedAt': True}},  # Automatically set the update timestamp
-        )
+        with metrics.MONGO_WRITE_SECONDS.labels(self.mongo_collection.name).time(), \
+                tracing.span("mongo.update", collection=self.mongo_collection.name, fields=list(data)):
+            update_result = self.mongo_collection.update_one(
+                {"name": self.venue},
+                {"$set": data,
+                 '$currentDate': {'updatedAt': True}},  # Automatically set the update timestamp
+            )
         logger.info(f"Updated {update_result.modified_count} document(s).")
 
     def browser_research(self, browser, tasks):
         """
         Executes a list of research tasks using the given browser instance.
         This function handles various response formats such as JSON strings, lists, or dictionaries.
+        Raises if the browser itself died, after marking the tasks it didn't get to as failed.
         """
-        for task in tasks:
+        for index, task in enumerate(tasks):
+            if self.fatal_error is not None:
+                self.failed_tasks.append(task.__name__)
+                continue
+            fields = self.TASK_FIELDS.get(task.__name__, [])
+            failed = False
             try:
                 # Execute the task (assuming it returns a tuple of (response, google_link))
-                task_response, google_link = task(browser)
+                with llm_usage.attribute(field=task.__name__), tracing.span(f"venue.{task.__name__}", field=task.__name__):
+                    task_response, google_link = task(browser)
 
                 # Initialize variables
                 string = None
@@ -327,7 +346,7 @@ class ResearchVenue:
 
                 # Handle if the task response is a string (possibly a JSON string)
                 if isinstance(task_response, str):
-                    string = task_response.replace("```json", "").replace("```", "").strip()
+                    string = task_response.strip()
                     logger.info(f"Raw JSON string: {string}")
 
                 # If the task_response is a dictionary or list, process it directly
@@ -345,24 +364,25 @@ class ResearchVenue:
                     if isinstance(task_response, list) and all(isinstance(item, dict) for item in task_response):
                         for item in task_response:
                             self.process_dict_item(item, google_link, task)
+                        self.updateDB(research_metadata(fields, {field: task_response or None for field in fields}, source), source)
 
                     # If it's a dictionary, process it directly
                     elif isinstance(task_response, dict):
-                        self.updateDB(task_response, source)
+                        self.updateDB({**task_response, **research_metadata(fields, task_response, source)}, source)
                     continue
 
                 # If it's a string, try to parse the JSON
                 if string:
                     if '{"data": null}' not in string:  # Skip if data is explicitly null
-                        try:
-                            data = json.loads(string)  # Try to load JSON
-                        except json.JSONDecodeError as e:
-                            logger.error(f"JSON decode error: {e.msg} at line {e.lineno} column {e.colno}")
+                        data = parse_json(string, task.__name__)
+                        if not isinstance(data, dict):
+                            logger.error(f"No JSON object in the reply to {task.__name__}: {string[:200]}")
                             continue
 
                         # Skip if "data" key exists and is None
                         if "data" in data and data["data"] is None:
                             logger.info(f"No useful data found in task {task.__name__}")
+                            self.updateDB(research_metadata(fields, {}), None)
                             continue
 
                         # Create source metadata if not already created
@@ -373,7 +393,9 @@ class ResearchVenue:
                             source = {"source": google_link, "label": label_formatted}
 
                         logger.info(f"Parsed data: {data}, Source: {source}")
-                        self.updateDB(data, source)
+                        self.updateDB({**data, **research_metadata(fields, data, source)}, source)
+                    else:
+                        self.updateDB(research_metadata(fields, {}), None)
 
                 # Log if no valid data was found
                 else:
@@ -382,8 +404,39 @@ class ResearchVenue:
                 # Ensure sources are always updated and stored
                 self.updateDB({"sources": self.sources}, {})
 
+            except FATAL_ERRORS as e:
+                failed = True
+                self.failed_tasks.append(task.__name__)
+                self.fatal_error = e
+                logger.error(f"Stopping research of {self.venue} in task {task.__name__}: {e}")
+
             except Exception as e:
+                failed = True
+                self.failed_tasks.append(task.__name__)
                 logger.error(f"Unexpected error in task {task.__name__}: {str(e)}")
+                if is_browser_error(e):
+                    # the rest of the group would fail on the same dead browser
+                    self.failed_tasks.extend(remaining.__name__ for remaining in tasks[index + 1:])
+                    raise
+
+            finally:
+                if self.on_task_done is not None and not failed:
+                    self.on_task_done(task.__name__)
+
+    def pooled_browser_research(self, tasks):
+        """Runs browser_research on a browser borrowed from the shared pool, which replaces the browser if it died."""
+        try:
+            with self.browser_pool.browser() as browser:
+                self.browser_research(browser, tasks)
+        except Exception as e:
+            logger.error(f"Browser died while researching {self.venue}: {e}")
+
+    def own_browser_research(self, browser, tasks):
+        """Runs browser_research on a browser of this run."""
+        try:
+            self.browser_research(browser, tasks)
+        except Exception as e:
+            logger.error(f"Browser died while researching {self.venue}: {e}")
 
 
     def process_dict_item(self, item, google_link, task):
@@ -411,22 +464,48 @@ class ResearchVenue:
         concerts_per_year, venue_link = scrape_concerts_per_year(self.venue) 
         return concerts_per_year, venue_link
     
-    def run_in_parallel(self):
-        """Manages the parallel execution of research tasks."""
-        browsers = [create_browser() for _ in range(4)]
-
-        tasks1 = [self.get_vip_packages_access, self.get_city, self.get_capacity, self.get_owned]
-        tasks2 = [self.get_number_of_bars, self.get_square_footage]
-        tasks3 = [self.get_number_of_stories, self.get_management]
-        tasks4 = [self.get_food_offered, self.get_yearly_number_of_shows]
-
-        threads = [
-            threading.Thread(target=self.browser_research, args=(browsers[0], tasks1)),
-            threading.Thread(target=self.browser_research, args=(browsers[1], tasks2)),
-            threading.Thread(target=self.browser_research, args=(browsers[2], tasks3)),
-            threading.Thread(target=self.browser_research, args=(browsers[3], tasks4))
+    def run_in_parallel(self, force: bool = False):
+        """Manages the parallel execution of research tasks. For a venue already in the
+        database only tasks with stale or missing fields run, unless force is set."""
+        task_groups = [
+            [self.get_vip_packages_access, self.get_city, self.get_capacity, self.get_owned],
+            [self.get_number_of_bars, self.get_square_footage],
+            [self.get_number_of_stories, self.get_management],
+            [self.get_food_offered, self.get_yearly_number_of_shows],
         ]
 
+        if self.mongo_venue and not force:
+            policy = FreshnessPolicy(self.TASK_FIELDS, self.FIELD_MAX_AGE)
+            task_groups = [policy.stale_tasks(self.mongo_venue, group) for group in task_groups]
+        task_groups = [[task for task in group if task.__name__ not in self.skip_tasks] for group in task_groups]
+        tasks = [task for group in task_groups for task in group]
+        # one browser per group with work left, the slow traversal tasks stay on separate browsers
+        task_groups = [group for group in task_groups if group]
+
+        if self.mongo_venue:
+            # keep sources of the fields we aren't researching again
+            rerun_labels = {task.__name__.replace("get_", "").replace("_", " ").title() for task in tasks}
+            rerun_shows = self.get_yearly_number_of_shows in tasks
+            self.sources = [source for source in self.mongo_venue.get("sources", [])
+                            if source.get("label") not in rerun_labels
+                            and not (rerun_shows and str(source.get("label", "")).endswith(" data"))]
+
+        if not tasks:
+            logger.info(f"All fields of {self.venue} are fresh, nothing to research")
+            return
+        logger.info(f"Researching {len(tasks)} tasks for {self.venue}")
+
+        # the threads carry this venue (and the job it is for) into the LLM usage they record
+        with llm_usage.attribute(entity=self.venue):
+            if self.browser_pool is not None:
+                browsers = []
+                threads = [threading.Thread(target=llm_usage.in_context(self.pooled_browser_research), args=(group,))
+                           for group in task_groups]
+            else:
+                browsers = [create_browser() for _ in task_groups]
+                threads = [threading.Thread(target=llm_usage.in_context(self.own_browser_research), args=(browser, group))
+                           for browser, group in zip(browsers, task_groups)]
+
         # Start threads
         for thread in threads:
             thread.start()
@@ -435,12 +514,16 @@ class ResearchVenue:
         for thread in threads:
             thread.join()
 
-        # Close all browser instances after work is done
+        # Only quit the browsers this run started; kill_chrome() would also take down
+        # the browsers of other jobs running alongside this one.
         for browser in browsers:
-            browser.quit()
+            try:
+                browser.quit()
+            except Exception as e:
+                logger.error(f"Error quitting browser: {e}")
 
-        # Ensure all Chrome instances are terminated.
-        kill_chrome()
+        if self.fatal_error is not None:
+            raise self.fatal_error
 
     def __str__(self):
         """
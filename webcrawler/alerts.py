@@ -0,0 +1,77 @@
+import os
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+# an article that failed to fetch or classify this many times is given up on, like a classified one
+ALERT_ARTICLE_MAX_ATTEMPTS = int(os.getenv("ALERT_ARTICLE_MAX_ATTEMPTS", "3"))
+
+def normalize_hall_name(name: str) -> str:
+    """returns the name a food hall is stored under, also used to tell whether two names are the same hall"""
+    name = " ".join(name.strip().lower().split())
+    if 'food hall' not in name:
+        name = f'{name} food hall'
+    return name
+
+def normalize_venue_name(name: str) -> str:
+    """returns the key used to tell whether two venue names are the same venue"""
+    return " ".join(name.strip().lower().split())
+
+class AlertSeenStore:
+    """Remembers which Google Alert articles and hall names were already
+    processed, so a daily run only classifies genuinely new articles.
+    Articles that failed are retried up to ALERT_ARTICLE_MAX_ATTEMPTS times."""
+    def __init__(self, db, foodhall_collection=None):
+        self.articles = db["alert_articles"]
+        self.halls = db["alert_halls"]
+        self.foodhall_collection = foodhall_collection
+
+    def filter_new_urls(self, urls: list[str]) -> list[str]:
+        """returns the urls that haven't been classified or given up on before, in order and without duplicates"""
+        unique = list(dict.fromkeys(urls))
+        seen = {doc["_id"] for doc in self.articles.find(
+            {"_id": {"$in": unique},
+             "$or": [{"seenAt": {"$exists": True}}, {"failures": {"$gte": ALERT_ARTICLE_MAX_ATTEMPTS}}]},
+            {"_id": 1})}
+        return [url for url in unique if url not in seen]
+
+    def mark_urls(self, urls: list[str]):
+        """records urls as classified"""
+        if not urls:
+            return
+        now = datetime.utcnow()
+        self.articles.bulk_write([
+            # $min keeps the first time, and sets it on articles that only failed so far
+            UpdateOne({"_id": url}, {"$min": {"seenAt": now}}, upsert=True) for url in urls
+        ], ordered=False)
+
+    def record_failures(self, urls: list[str]):
+        """counts a failed fetch or classification of urls towards ALERT_ARTICLE_MAX_ATTEMPTS"""
+        if not urls:
+            return
+        now = datetime.utcnow()
+        self.articles.bulk_write([
+            UpdateOne({"_id": url}, {"$inc": {"failures": 1}, "$set": {"lastFailedAt": now}}, upsert=True)
+            for url in urls
+        ], ordered=False)
+
+    def is_known_hall(self, name: str) -> bool:
+        """returns whether the hall was found before or is already in the foodhall collection"""
+        key = normalize_hall_name(name)
+        if self.halls.find_one({"_id": key}, {"_id": 1}) is not None:
+            return True
+        if self.foodhall_collection is not None:
+            return self.foodhall_collection.find_one({"name": key}, {"_id": 1}) is not None
+        return False
+
+    def mark_halls(self, halls: list[dict]):
+        """records discovered halls ({"food_hall_name", "source"}) as known"""
+        if not halls:
+            return
+        now = datetime.utcnow()
+        self.halls.bulk_write([
+            UpdateOne({"_id": normalize_hall_name(hall["food_hall_name"])},
+                      {"$setOnInsert": {"name": hall["food_hall_name"], "source": hall.get("source"), "seenAt": now}},
+                      upsert=True)
+            for hall in halls
+        ], ordered=False)
@@ -0,0 +1,276 @@
+"""Resumable batch venue research.
+
+usage:
+    python -m webcrawler.batch_runner --list venues_list_part1 --concurrency 3
+    python -m webcrawler.batch_runner --file venues.csv --checkpoint venues_csv.checkpoint.jsonl
+
+Progress is appended to a JSONL checkpoint (one line per finished task and
+per finished venue), so re-running the same command skips finished venues
+and finished tasks of the venue that was interrupted.
+
+To shard a list across several machines, enqueue it once into the shared
+`crawl_jobs` collection and start a worker on every node; each worker takes
+--concurrency venues at a time and a venue whose worker died is picked up by
+another one once its lease lapses, resuming after its finished tasks:
+
+    python -m webcrawler.batch_runner --list venues_list_part1 --enqueue
+    python -m webcrawler.batch_runner --work --concurrency 3 --exit-when-idle
+
+Locally, point MONGO_CONNECTION at a single mongod (mongodb://localhost:27017)
+and start --work in several terminals.
+
+--profile writes a sampling profile of every venue to profiles/<id> (see
+webcrawler/profiling.py): batch-<venue> for a local batch, the job id for
+enqueued jobs.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from dotenv import load_dotenv
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from webcrawler import llm_scheduler, llm_usage, metrics, profiling, tracing, venues as venue_lists
+from webcrawler.BrowserConfig import BrowserPool
+from webcrawler.job_handlers import check_complete
+from webcrawler.jobs import JOB_QUEUED, JOB_RUNNING, JobQueue
+from webcrawler.ResearchVenue import ResearchVenue
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv(".env.local")
+load_dotenv()
+
+BATCH_TASK = "batch_venue"
+
+def load_venue_names(list_name: str = None, path: str = None) -> list[str]:
+    """returns venue names from a list in webcrawler/venues.py, a CSV (name column or first column) or a JSONL file"""
+    if list_name:
+        names = getattr(venue_lists, list_name, None)
+        if not isinstance(names, list):
+            raise ValueError(f"webcrawler/venues.py has no list named {list_name}")
+    elif path.endswith(".jsonl"):
+        names = []
+        with open(path) as fp:
+            for line in fp:
+                if line.strip():
+                    entry = json.loads(line)
+                    names.append(entry["name"] if isinstance(entry, dict) else entry)
+    else:
+        with open(path, newline="") as fp:
+            rows = list(csv.reader(fp))
+        if rows and "name" in rows[0]:
+            column = rows[0].index("name")
+            rows = rows[1:]
+        else:
+            column = 0
+        names = [row[column] for row in rows if row]
+
+    # keep order, drop blanks and repeats
+    return list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+
+class Checkpoint:
+    """Append-only JSONL record of finished venues and tasks."""
+    def __init__(self, path: str):
+        self.path = path
+        self.done_venues = set()
+        self.done_tasks = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as fp:
+                for line in fp:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if entry.get("task"):
+                        self.done_tasks.setdefault(entry["venue"], set()).add(entry["task"])
+                    else:
+                        self.done_venues.add(entry["venue"])
+
+    def _append(self, entry: dict):
+        entry["at"] = datetime.utcnow().isoformat()
+        with self._lock, open(self.path, "a") as fp:
+            fp.write(json.dumps(entry) + "\n")
+            fp.flush()
+
+    def task_done(self, venue: str, task: str):
+        self._append({"venue": venue, "task": task})
+
+    def venue_done(self, venue: str, seconds: float):
+        with self._lock:
+            self.done_venues.add(venue)
+        self._append({"venue": venue, "seconds": round(seconds, 1)})
+
+class Progress:
+    """Prints completed venues, venues/hour, LLM calls, pages loaded and ETA at an interval."""
+    def __init__(self, total: int, interval: float = 60):
+        self.total = total
+        self.interval = interval
+        self.completed = 0
+        self.started = time.time()
+        self.start_counters = metrics.snapshot()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def venue_done(self):
+        with self._lock:
+            self.completed += 1
+
+    def line(self) -> str:
+        elapsed = max(time.time() - self.started, 1e-6)
+        counters = metrics.snapshot()
+        llm_calls = counters.get("llm_calls", 0) - self.start_counters.get("llm_calls", 0)
+        pages = counters.get("pages_loaded", 0) - self.start_counters.get("pages_loaded", 0)
+        per_hour = self.completed / elapsed * 3600
+        remaining = self.total - self.completed
+        eta = f"{remaining / per_hour:.1f}h" if per_hour else "unknown"
+        return (f"{self.completed}/{self.total} venues | {per_hour:.1f} venues/h | "
+                f"{llm_calls} LLM calls | {pages} pages | elapsed {elapsed / 3600:.2f}h | ETA {eta}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            print(self.line(), flush=True)
+
+    def start(self):
+        threading.Thread(target=self._run, name="batch-progress", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        print(self.line(), flush=True)
+
+def run_batch(names: list[str], collection, checkpoint: Checkpoint, concurrency: int = 2, browsers: int = None,
+              progress_interval: float = 60, profile: bool = False):
+    """researches every venue not yet in the checkpoint, concurrency venues at a time over a shared browser pool"""
+    pending = [name for name in names if name not in checkpoint.done_venues]
+    logger.info(f"{len(names) - len(pending)} of {len(names)} venues already done, {len(pending)} to go")
+
+    pool = BrowserPool(browsers or concurrency * 2)
+    progress = Progress(len(pending), progress_interval).start()
+
+    def research(name: str):
+        started = time.time()
+        try:
+            batch_id = f"batch-{re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')}"
+            with llm_scheduler.priority(llm_scheduler.BATCH), profiling.profile(batch_id, enabled=profile), \
+                    tracing.trace("batch_venue", entity=name):
+                venue = ResearchVenue(
+                    name, collection,
+                    browser_pool=pool,
+                    skip_tasks=checkpoint.done_tasks.get(name),
+                    on_task_done=lambda task: checkpoint.task_done(name, task),
+                )
+        except Exception as e:
+            # left out of the checkpoint so the next run retries it
+            logger.error(f"Error researching venue {name}: {e}")
+            return
+        if venue.failed_tasks:
+            # tasks that finished are checkpointed, the next run retries only the failed ones
+            logger.error(f"Venue {name} left pending, failed tasks: {', '.join(venue.failed_tasks)}")
+            return
+        checkpoint.venue_done(name, time.time() - started)
+        progress.venue_done()
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(research, pending))
+    finally:
+        progress.stop()
+        pool.close()
+
+def enqueue_batch(names: list[str], queue: JobQueue, collection_name: str, profile: bool = False) -> int:
+    """submits one job per venue to the shared queue and returns how many were new"""
+    submitted = 0
+    for name in names:
+        payload = {"name": name, "collection": collection_name}
+        if profile:
+            payload["profile"] = True
+        # the handler is registered by the workers, not here
+        _, coalesced = queue.submit(BATCH_TASK, payload, validate=False,
+                                    dedupe_key=f"{collection_name}:{name.lower()}")
+        submitted += not coalesced
+    logger.info(f"Enqueued {submitted} of {len(names)} venues ({len(names) - submitted} already queued or running)")
+    return submitted
+
+def run_worker(queue: JobQueue, database, browsers: int = None, exit_when_idle: bool = False, progress_interval: float = 60,
+               profile: bool = False):
+    """drains batch venue jobs from the shared queue with queue.workers venues at a time on this node"""
+    pool = BrowserPool(browsers or queue.workers * 2)
+    llm_usage.set_ledger(database["llm_usage"])
+    progress = Progress(queue.collection.count_documents({"task": BATCH_TASK, "status": JOB_QUEUED}), progress_interval)
+
+    def research(job: dict):
+        name = job["payload"]["name"]
+        with llm_usage.job_scope(job, entity=name), llm_scheduler.priority(llm_scheduler.BATCH), \
+                profiling.profile(str(job["_id"]), enabled=profile or bool(job["payload"].get("profile"))), \
+                tracing.job_trace(job, entity=name):
+            venue = ResearchVenue(
+                name, database[job["payload"]["collection"]],
+                browser_pool=pool,
+                # tasks a previous, dead worker already finished for this venue
+                skip_tasks=set(job.get("doneTasks", [])),
+                on_task_done=lambda task: queue.collection.update_one({"_id": job["_id"]}, {"$addToSet": {"doneTasks": task}}),
+            )
+        # fails the job; the tasks that finished stay in doneTasks and are fresh for the next attempt
+        check_complete(venue, name)
+        progress.venue_done()
+        return {"name": name}
+
+    queue.register(BATCH_TASK, research)
+    queue.start()
+    progress.start()
+    try:
+        while True:
+            time.sleep(queue.poll_interval)
+            if not exit_when_idle or queue.active_count():
+                continue
+            remaining = queue.collection.count_documents(
+                {"task": BATCH_TASK, "status": {"$in": [JOB_QUEUED, JOB_RUNNING]}})
+            if remaining == 0:
+                logger.info("No batch venue jobs left, exiting")
+                break
+    finally:
+        progress.stop()
+        pool.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Research a list of venues with checkpointing.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--list", help="name of a list in webcrawler/venues.py, e.g. validation_venues")
+    source.add_argument("--file", help="CSV (name column) or JSONL file of venue names")
+    source.add_argument("--work", action="store_true", help="research venues enqueued in the shared job queue")
+    parser.add_argument("--enqueue", action="store_true", help="submit the venues to the shared job queue instead of researching them here")
+    parser.add_argument("--exit-when-idle", action="store_true", help="with --work, exit once no batch venue jobs are left")
+    parser.add_argument("--collection", default="venues")
+    parser.add_argument("--concurrency", type=int, default=2, help="venues researched at once")
+    parser.add_argument("--browsers", type=int, default=None, help="shared browser pool size (default 2 per venue)")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file (default <list or file>.checkpoint.jsonl)")
+    parser.add_argument("--progress-interval", type=float, default=60)
+    parser.add_argument("--profile", action="store_true", help="write a sampling profile of every venue to profiles/")
+    args = parser.parse_args()
+
+    mongo_client = MongoClient(os.getenv("MONGO_CONNECTION"), server_api=ServerApi('1'))
+    database = mongo_client[os.getenv("MONGO_DATABASE", "brokerai")]
+
+    if args.work:
+        queue = JobQueue(database["crawl_jobs"], workers=args.concurrency)
+        run_worker(queue, database, browsers=args.browsers, exit_when_idle=args.exit_when_idle,
+                   progress_interval=args.progress_interval, profile=args.profile)
+    elif args.enqueue:
+        queue = JobQueue(database["crawl_jobs"])
+        enqueue_batch(load_venue_names(args.list, args.file), queue, args.collection, profile=args.profile)
+    else:
+        names = load_venue_names(args.list, args.file)
+        checkpoint_path = args.checkpoint or f"{args.list or os.path.splitext(os.path.basename(args.file))[0]}.checkpoint.jsonl"
+        run_batch(names, database[args.collection], Checkpoint(checkpoint_path),
+                  concurrency=args.concurrency, browsers=args.browsers, progress_interval=args.progress_interval,
+                  profile=args.profile)
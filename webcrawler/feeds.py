@@ -0,0 +1,144 @@
+import logging
+import os
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from email.utils import formatdate
+from urllib.parse import parse_qs, urlparse
+
+from webcrawler.CrawlerTools import valid_url
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+
+# comma separated Google Alerts RSS/Atom feed urls (or local file paths)
+GOOGLE_ALERT_FEEDS = [feed.strip() for feed in os.getenv("GOOGLE_ALERT_FEEDS", "").split(",") if feed.strip()]
+
+def unwrap_google_redirect(url: str) -> str:
+    """returns the article url behind a https://www.google.com/url?...&url=<article> redirect"""
+    parsed = urlparse(url)
+    if parsed.netloc.endswith("google.com") and parsed.path == "/url":
+        query = parse_qs(parsed.query)
+        for key in ("url", "q"):
+            if query.get(key):
+                return query[key][0]
+    return url
+
+def parse_feed_entries(stream):
+    """
+    Yields {"title", "url", "published"} for each entry of an Atom or RSS feed.
+    Elements are parsed and discarded one entry at a time, so feed size doesn't matter.
+    """
+    for _, element in ET.iterparse(stream, events=("end",)):
+        if element.tag == f"{ATOM_NS}entry":
+            link = element.find(f"{ATOM_NS}link")
+            yield {
+                "title": "".join(element.find(f"{ATOM_NS}title").itertext()) if element.find(f"{ATOM_NS}title") is not None else None,
+                "url": link.get("href") if link is not None else None,
+                "published": element.findtext(f"{ATOM_NS}published") or element.findtext(f"{ATOM_NS}updated"),
+            }
+            element.clear()
+        elif element.tag == "item":
+            yield {
+                "title": element.findtext("title"),
+                "url": (element.findtext("link") or "").strip() or None,
+                "published": element.findtext("pubDate"),
+            }
+            element.clear()
+
+class AlertFeedReader:
+    """Polls Google Alerts feeds with conditional requests, remembering each
+    feed's ETag / Last-Modified in state_collection (in memory if None).
+
+    read_links() only holds on to the new ETag / Last-Modified; commit()
+    saves them once the links were processed, so a feed whose links weren't
+    all classified is read in full again next time instead of answering 304."""
+    def __init__(self, state_collection=None, timeout: int = 15):
+        self.state_collection = state_collection
+        self.timeout = timeout
+        self._memory_state = {}
+        # feed -> (etag, last modified, links) read but not committed yet
+        self._pending = {}
+
+    def _get_state(self, feed: str) -> dict:
+        if self.state_collection is None:
+            return self._memory_state.get(feed, {})
+        return self.state_collection.find_one({"_id": feed}) or {}
+
+    def _set_state(self, feed: str, etag: str, last_modified: str):
+        state = {"etag": etag, "lastModified": last_modified, "checkedAt": datetime.utcnow()}
+        if self.state_collection is None:
+            self._memory_state[feed] = state
+        else:
+            self.state_collection.update_one({"_id": feed}, {"$set": state}, upsert=True)
+
+    def _is_local(self, feed: str) -> bool:
+        return feed.startswith("file://") or not urlparse(feed).scheme
+
+    def read_entries(self, feed: str, save_state: bool = True):
+        """returns the feed's entries, or [] if it hasn't changed since the last poll.
+        With save_state off returns (entries, etag, last modified) and leaves saving them to the caller."""
+        state = self._get_state(feed)
+
+        if self._is_local(feed):
+            path = urlparse(feed).path if feed.startswith("file://") else feed
+            last_modified = formatdate(os.path.getmtime(path), usegmt=True)
+            if last_modified == state.get("lastModified"):
+                return [] if save_state else ([], None, None)
+            with open(path, "rb") as fp:
+                entries = list(parse_feed_entries(fp))
+            if not save_state:
+                return entries, None, last_modified
+            self._set_state(feed, None, last_modified)
+            return entries
+
+        headers = {"User-Agent": "Mozilla/5.0 (compatible; BrokerAI feed reader)"}
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("lastModified"):
+            headers["If-Modified-Since"] = state["lastModified"]
+
+        try:
+            with urllib.request.urlopen(urllib.request.Request(feed, headers=headers), timeout=self.timeout) as response:
+                entries = list(parse_feed_entries(response))
+                etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return [] if save_state else ([], None, None)
+            raise
+        if not save_state:
+            return entries, etag, last_modified
+        self._set_state(feed, etag, last_modified)
+        return entries
+
+    def read_links(self, feeds: list[str] = None) -> list[str]:
+        """returns new, valid article links across all feeds, without duplicates; commit() once they are processed"""
+        links = []
+        for feed in feeds if feeds is not None else GOOGLE_ALERT_FEEDS:
+            try:
+                entries, etag, last_modified = self.read_entries(feed, save_state=False)
+            except Exception as e:
+                logger.error(f"Error reading alert feed {feed}: {e}")
+                continue
+            feed_links = []
+            for entry in entries:
+                url = unwrap_google_redirect(entry["url"]) if entry["url"] else None
+                if valid_url(url):
+                    feed_links.append(url)
+            if entries:
+                self._pending[feed] = (etag, last_modified, feed_links)
+            links.extend(feed_links)
+        return list(dict.fromkeys(links))
+
+    def commit(self, unprocessed=()):
+        """saves the ETag / Last-Modified of the feeds read_links read, except those with links in unprocessed"""
+        unprocessed = set(unprocessed)
+        pending, self._pending = self._pending, {}
+        for feed, (etag, last_modified, links) in pending.items():
+            if unprocessed.intersection(links):
+                logger.info(f"Alert feed {feed} has unclassified articles, it will be read in full next time")
+                continue
+            self._set_state(feed, etag, last_modified)
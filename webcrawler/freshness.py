@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+# per-field research metadata lives under this key: {"<field>": {"researchedAt", "confidence", "source"}}
+RESEARCH_META_FIELD = "_research"
+
+DEFAULT_MAX_AGE = timedelta(days=90)
+# fields whose last research found nothing are retried sooner, but not on every run
+NEGATIVE_MAX_AGE = timedelta(days=14)
+
+def estimate_confidence(value, source) -> float:
+    """returns a rough confidence for a researched value: 0 when nothing was found, higher when it has a source"""
+    if value is None:
+        return 0.0
+    return 0.8 if source else 0.5
+
+def research_metadata(fields: list[str], data: dict, source: dict = None, now: datetime = None) -> dict:
+    """returns $set entries recording that fields were just researched, for updateDB"""
+    now = now or datetime.utcnow()
+    link = source.get("source") if source else None
+    return {
+        f"{RESEARCH_META_FIELD}.{field}": {
+            "researchedAt": now,
+            "confidence": estimate_confidence(data.get(field), link),
+            "source": link,
+        }
+        for field in fields
+    }
+
+class FreshnessPolicy:
+    """Decides which research tasks need to run again for an existing document.
+
+    Every field has its own max age (None means it never goes stale once
+    found). A field is stale when it has no research metadata and no value,
+    or when it is older than its max age. A field whose last research found
+    nothing uses negative_max_age instead, so fields a venue simply doesn't
+    have aren't looked up again on every run. Documents researched before metadata existed fall back to
+    updatedAt for fields that have a value.
+    """
+    def __init__(self, task_fields: dict, max_ages: dict = None, default_max_age: timedelta = DEFAULT_MAX_AGE,
+                 negative_max_age: timedelta = NEGATIVE_MAX_AGE):
+        self.task_fields = task_fields
+        self.max_ages = max_ages or {}
+        self.default_max_age = default_max_age
+        self.negative_max_age = negative_max_age
+
+    def is_stale(self, doc: dict, field: str, now: datetime = None) -> bool:
+        """returns whether field should be researched again"""
+        now = now or datetime.utcnow()
+        meta = (doc.get(RESEARCH_META_FIELD) or {}).get(field)
+        if meta is None:
+            if doc.get(field) is None or doc.get("updatedAt") is None:
+                return True
+            meta = {"researchedAt": doc["updatedAt"], "confidence": estimate_confidence(doc[field], None)}
+
+        if not meta.get("confidence"):
+            max_age = self.negative_max_age
+        else:
+            max_age = self.max_ages.get(field, self.default_max_age)
+        return max_age is not None and now - meta["researchedAt"] > max_age
+
+    def stale_tasks(self, doc: dict, tasks: list, now: datetime = None) -> list:
+        """returns the tasks (bound get_* methods or task names) with at least one stale field; all of them if doc is None"""
+        if doc is None:
+            return list(tasks)
+        def fields(task):
+            return self.task_fields.get(task if isinstance(task, str) else task.__name__)
+        return [task for task in tasks
+                if any(self.is_stale(doc, field, now) for field in fields(task) or [])
+                or not fields(task)]
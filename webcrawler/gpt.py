@@ -1,10 +1,14 @@
 import os
 import re
+import ast
 import json
+import time
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AzureOpenAI, BadRequestError
 import logging
 
+from webcrawler import llm_scheduler, llm_usage, metrics, replay, tracing
+
 # Load environment variables
 load_dotenv(".env.local")
 load_dotenv()
@@ -15,111 +19,243 @@ logger = logging.getLogger(__name__)
 
 def create_client():
     """Creates an Azure OpenAI client using API key and endpoint from environment variables."""
+    if replay.replaying():
+        return None  # completions come from the archive
     try:
         client = AzureOpenAI(
             api_key=os.getenv("AZURE_OPENAI_API_KEY"),
             api_version="2024-02-01",
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            max_retries=0  # llm_scheduler retries, within the deployment's rate limits
         )
         return client
     except Exception as e:
         logger.error(f"Error creating Azure OpenAI client: {e}")
         return None
 
-def gpt_request(gpt_instruction: str, user_prompt: str, client=None):
-    """Executes GPT request with a given instruction and user prompt."""
+# deployment used unless a call names one, GPT_MODEL=gpt-35-turbo to try a cheaper model
+DEFAULT_MODEL = os.getenv("GPT_MODEL", "gpt-4o")
+
+# requests with json_mode set ask for response_format json_object, so the reply is always one JSON object;
+# GPT_JSON_MODE=false turns that off, and a deployment that rejects it is asked without it from then on
+JSON_MODE = os.getenv("GPT_JSON_MODE", "true").lower() == "true"
+_models_without_json_mode = set()
+
+def _create_completion(client, messages: list, model: str, call_site: str, json_mode: bool = False):
+    """Every chat completion goes through here, so each is timed, budgeted, rate limited and retried
+    (see llm_scheduler) and its token usage recorded."""
+    llm_usage.check_budget()
+    metrics.inc("llm_calls")
+    started = time.monotonic()
+    with tracing.span("llm", call_site=call_site, model=model) as span:
+        if replay.replaying():
+            response = replay.replay_completion(model, messages)
+        else:
+            options = {}
+            if json_mode and JSON_MODE and model not in _models_without_json_mode:
+                options["response_format"] = {"type": "json_object"}
+            try:
+                response = llm_scheduler.complete(client, model, messages, call_site, seed=42, temperature=0.3, **options)
+            except BadRequestError as e:
+                if not options:
+                    raise
+                logger.warning(f"{model} rejected JSON mode, asking without it from now on: {e}")
+                _models_without_json_mode.add(model)
+                response = llm_scheduler.complete(client, model, messages, call_site, seed=42, temperature=0.3)
+            replay.record_completion(model, messages, response, time.monotonic() - started)
+        metrics.observe_llm(call_site, time.monotonic() - started, response)
+        usage = llm_usage.record(model, call_site, response)
+        span.set(field=usage.get("field"), prompt_tokens=usage["prompt_tokens"],
+                 completion_tokens=usage["completion_tokens"], cost=usage["cost"])
+    return response
+
+class LLMRequestFailed(Exception):
+    """A chat completion still failed after the scheduler's retries."""
+
+def gpt_request(gpt_instruction: str, user_prompt: str, client=None, model: str = DEFAULT_MODEL, call_site: str = "unknown",
+                json_mode: bool = False):
+    """Executes GPT request with a given instruction and user prompt.
+    call_site labels its usage, metrics and traces (e.g. summarize, extract).
+    json_mode asks for a JSON object reply (the prompt has to mention JSON).
+    Raises LLMRequestFailed once the call failed for good, so it isn't mistaken for an empty answer."""
     if client is None:
         client = create_client()
-        if client is None:
+        if client is None and not replay.replaying():
             return ""
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            seed=42,
-            temperature=0.3,
-            messages=[
-                {"role": "system", "content": gpt_instruction},
-                {"role": "user", "content": user_prompt}
-            ]
-        )
+        response = _create_completion(client, [
+            {"role": "system", "content": gpt_instruction},
+            {"role": "user", "content": user_prompt}
+        ], model, call_site, json_mode)
         payload = response.choices[0].message.content
         return payload
+    except (llm_usage.BudgetExceeded, replay.ReplayMiss):
+        raise
     except Exception as e:
         logger.error(f"Error during GPT request: {e}")
-        return ""
+        raise LLMRequestFailed(f"{call_site} call to {model} failed: {e}") from e
 
-def aggregate_gpt_request(user_prompt: str, conversation=None, client=None):
-    """Adds multiple conversation messages to a single conversation to avoid max token error."""
+def aggregate_gpt_request(user_prompt: str, conversation=None, client=None, model: str = DEFAULT_MODEL, call_site: str = "unknown",
+                          json_mode: bool = False):
+    """Adds multiple conversation messages to a single conversation to avoid max token error.
+    call_site labels its usage as in gpt_request; json_mode asks for a JSON object reply to this message.
+    Raises LLMRequestFailed as gpt_request does."""
     if conversation is None:
         conversation = []
 
     if client is None:
         client = create_client()
-        if client is None:
+        if client is None and not replay.replaying():
             return "", conversation
 
     conversation.append({"role": "user", "content": user_prompt})
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            seed=42,
-            temperature=0.3,
-            messages=conversation
-        )
+        response = _create_completion(client, conversation, model, call_site, json_mode)
 
         payload = response.choices[0].message.content
         conversation.append({"role": "assistant", "content": payload})
 
         return payload, conversation
+    except (llm_usage.BudgetExceeded, replay.ReplayMiss):
+        raise
     except Exception as e:
         logger.error(f"Error during GPT request with conversation: {e}")
-        return "", conversation
+        # the unanswered message would be sent again with the next one
+        conversation.pop()
+        raise LLMRequestFailed(f"{call_site} call to {model} failed: {e}") from e
 
 def remove_json_markdown(the_string): # either gpt is not doing a good job or this is not doing a good job 
     """Removes code block markers (like ```json) from the string."""
     return re.sub(r"json|```", "", the_string).strip()
 
-def extract_json_code_block(input_string: str) -> dict:
+_decoder = json.JSONDecoder()
+_PYTHON_LITERALS = {"None": "null", "True": "true", "False": "false"}
+_LITERAL = re.compile(r"None|True|False")
+
+def _balanced_end(text: str, start: int):
+    """returns the index after the bracket closing the one at start, skipping quoted strings, or None"""
+    depth, quote, escaped = 0, None, False
+    for index in range(start, len(text)):
+        char = text[index]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    return None
+
+def _pythonish_to_json(text: str) -> str:
+    """rewrites single quoted strings and None / True / False outside strings as JSON"""
+    out, index = [], 0
+    while index < len(text):
+        char = text[index]
+        if char in "\"'":
+            end = index + 1
+            while end < len(text) and text[end] != char:
+                end += 2 if text[end] == "\\" else 1
+            if char == '"':
+                out.append(text[index:end + 1])
+            else:
+                out.append('"' + text[index + 1:end].replace("\\'", "'").replace('"', '\\"') + '"')
+            index = end + 1
+            continue
+        word = _LITERAL.match(text, index)
+        if word and not (index and (text[index - 1].isalnum() or text[index - 1] == "_")):
+            out.append(_PYTHON_LITERALS[word.group(0)])
+            index += len(word.group(0))
+            continue
+        out.append(char)
+        index += 1
+    return "".join(out)
+
+def _parse_object_at(text: str, start: int):
+    """returns (value, outcome) of the object starting at text[start], or (None, None)"""
+    try:
+        return _decoder.raw_decode(text, start)[0], "extracted"
+    except ValueError:
+        pass
+    end = _balanced_end(text, start)
+    if end is None:
+        return None, None
+    candidate = text[start:end]
+    try:
+        return ast.literal_eval(candidate), "repaired"
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        pass
+    try:
+        return json.loads(_pythonish_to_json(candidate)), "repaired"
+    except ValueError:
+        return None, None
+
+def parse_json(text, call_site: str = "unknown"):
+    """Returns the JSON value in an LLM reply, or None if there is none.
+
+    A reply that is JSON parses as is. Otherwise the first object in it is
+    decoded where it starts, so code fences, prose around it and nested
+    objects don't matter, and a reply in Python literal syntax (single quotes,
+    None, True) is read as such. Each outcome (json, extracted, repaired,
+    failed) is counted per call_site in the llm_json_* metrics."""
+    if isinstance(text, (dict, list)):
+        return text
+    value, outcome = None, "failed"
+    if text:
+        try:
+            value, outcome = json.loads(text), "json"
+        except ValueError:
+            for match in re.finditer(r"\{", text):
+                value, found = _parse_object_at(text, match.start())
+                if found is not None:
+                    outcome = found
+                    break
+    metrics.count_json_parse(call_site, outcome)
+    if outcome == "failed":
+        logger.warning(f"No JSON found in {call_site} reply: {str(text)[:200]!r}")
+    return value
+
+def conform(data, schema: dict):
+    """Returns data's schema fields ({"capacity": int, ...}) converted to their types, None where they can't be,
+    or None if data isn't a dict. Numbers are read out of text ("1,200 people" -> 1200)."""
+    if not isinstance(data, dict):
+        return None
+    conformed = {}
+    for field, kind in schema.items():
+        value = data.get(field)
+        if value is not None and not isinstance(value, kind):
+            if kind is bool:
+                text = str(value).strip().lower()
+                value = True if text in ("true", "yes", "1") else False if text in ("false", "no", "0") else None
+            elif kind in (int, float):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    value = kind(value)
+                else:
+                    number = re.search(r"-?\d[\d,]*(\.\d+)?", str(value))
+                    value = kind(float(number.group(0).replace(",", ""))) if number else None
+            elif kind is str:
+                value = value if isinstance(value, (list, dict)) else str(value)
+        conformed[field] = value
+    return conformed
+
+def extract_json_code_block(input_string: str, call_site: str = "unknown") -> dict:
     """
-    Extracts the JSON code inside a code block from the given string.
-    Handles single quotes and Python-specific 'None' by converting them to JSON-compatible format.
+    Extracts the JSON object from the given string (see parse_json).
     
     :param input_string: The string containing the JSON code block.
     :return: The extracted JSON data as a dictionary or an empty dictionary if parsing fails.
     """
-    try:
-        # Log the full input string for debugging
-        logger.debug(f"Raw input string: {input_string}")
-        
-        # First, try to find a well-formatted JSON block within triple backticks
-        match = re.search(r"```json\s*(\{.*?\})\s*```", input_string, re.DOTALL)
-        
-        if not match:
-            # If no code block is found, search for any JSON-like structure in the input
-            match = re.search(r"(\{.*?\})", input_string, re.DOTALL)
-        
-        if match:
-            json_content = match.group(1).strip()
-            
-            # Replace single quotes with double quotes to make it valid JSON
-            json_content = json_content.replace("'", '"')
-            
-            # Replace Python 'None' with JSON 'null'
-            json_content = json_content.replace("None", "null")
-            
-            # Try to load the JSON
-            return json.loads(json_content)  # Safely load the JSON content
-
-        logger.warning("No JSON code block or JSON-like content found in the input string.")
-        return {}
-    
-    except json.JSONDecodeError as e:
-        # Log the error and the problematic string
-        logger.error(f"Error decoding JSON: {e}")
-        logger.error(f"Problematic JSON content: {input_string}")
-        return {}
+    data = parse_json(input_string, call_site)
+    return data if isinstance(data, dict) else {}
 
 def process_response_as_json(response: str) -> dict:
     """
@@ -145,7 +281,7 @@ if __name__ == "__main__":
     user_prompt = 'Tell me a life-changing story about eating pudding.'
     
     # Send GPT request
-    response = gpt_request(gpt_instruction, user_prompt)
+    response = gpt_request(gpt_instruction, user_prompt, call_site="example")
 
     # Process the response as JSON if necessary
     json_data = process_response_as_json(response)
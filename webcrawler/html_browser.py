@@ -0,0 +1,101 @@
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from bs4 import BeautifulSoup
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+
+class HtmlElement:
+    """The parts of a selenium WebElement the crawler reads, backed by a parsed tag."""
+    def __init__(self, tag, base_url: str):
+        self._tag = tag
+        self._base_url = base_url
+
+    @property
+    def text(self) -> str:
+        return self._tag.get_text(" ", strip=True)
+
+    @property
+    def tag_name(self) -> str:
+        return self._tag.name
+
+    def get_attribute(self, name: str):
+        value = self._tag.get(name)
+        if isinstance(value, list):
+            value = " ".join(value)
+        if value is not None and name in ("href", "src"):
+            # like chrome, links come back absolute
+            value = urllib.parse.urljoin(self._base_url, value)
+        return value
+
+    def find_elements(self, by: str, value: str) -> list:
+        return [HtmlElement(tag, self._base_url) for tag in _select(self._tag, by, value)]
+
+    def find_element(self, by: str, value: str):
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"no element matches {by}={value}")
+        return elements[0]
+
+def _select(root, by: str, value: str):
+    if by == By.CSS_SELECTOR:
+        return root.select(value)
+    if by == By.TAG_NAME:
+        return root.find_all(value)
+    if by == By.CLASS_NAME:
+        return root.select(f".{value}")
+    if by == By.ID:
+        return root.select(f"#{value}")
+    raise NotImplementedError(f"HtmlBrowser can't find elements by {by}")
+
+class HtmlBrowser:
+    """A stand-in for a Chrome webdriver that fetches pages over plain HTTP and
+    parses them with BeautifulSoup. No javascript runs, so it is only right for
+    static pages such as the benchmark fixtures, but it starts instantly and
+    needs no Chrome. Implements the part of the WebDriver API CrawlerTools uses."""
+    def __init__(self, timeout: float = 30, user_agent: str = "Mozilla/5.0 (BrokerAI crawler)"):
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.current_url = None
+        self.page_source = ""
+        self._soup = None
+
+    def fetch(self, url: str) -> tuple[str, str]:
+        """returns (final url, html) of url"""
+        request = urllib.request.Request(url, headers={"User-Agent": self.user_agent})
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            response = e  # like chrome, an error status still shows its page
+        with response:
+            charset = response.headers.get_content_charset() or "utf-8"
+            return response.geturl(), response.read().decode(charset, errors="replace")
+
+    def get(self, url: str):
+        # chrome quotes what it is given, urllib doesn't
+        url = urllib.parse.quote(url, safe=":/?&=%#+,;@!$'()*[]~")
+        self.current_url, self.page_source = self.fetch(url)
+        self._soup = None
+
+    @property
+    def soup(self) -> BeautifulSoup:
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.page_source, "html.parser")
+        return self._soup
+
+    @property
+    def title(self) -> str:
+        return self.soup.title.get_text(strip=True) if self.soup.title else ""
+
+    def find_elements(self, by: str, value: str) -> list:
+        return [HtmlElement(tag, self.current_url) for tag in _select(self.soup, by, value)]
+
+    def find_element(self, by: str, value: str):
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"no element matches {by}={value}")
+        return elements[0]
+
+    def quit(self):
+        self._soup = None
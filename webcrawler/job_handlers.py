@@ -0,0 +1,55 @@
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from webcrawler import llm_scheduler, llm_usage, profiling, tracing
+from webcrawler.jobs import ResearchIncomplete
+from webcrawler.ResearchHall import ResearchHall
+from webcrawler.ResearchVenue import ResearchVenue
+
+# crawl job handlers. They live here rather than in app.py because they run in
+# ProcessPool children, which import them by name and open their own mongo client.
+
+load_dotenv(".env.local")
+load_dotenv()
+
+FOODHALL_COLLECTION = "foodhalls_csv"
+VENUE_COLLECTION = "venues_csv"
+LLM_USAGE_COLLECTION = "llm_usage"
+
+@lru_cache(maxsize=1)
+def get_database():
+    # same database as the API process that queued the job
+    database = MongoClient(os.getenv("MONGO_CONNECTION"), server_api=ServerApi('1'))[os.getenv("MONGO_DATABASE", "brokerai")]
+    llm_usage.set_ledger(database[LLM_USAGE_COLLECTION])
+    return database
+
+def check_complete(research, entity: str):
+    """raises ResearchIncomplete if any of research's tasks failed, so the job isn't reported as done"""
+    if research.failed_tasks:
+        raise ResearchIncomplete(f"{len(research.failed_tasks)} research task(s) of {entity} failed: "
+                                 f"{', '.join(research.failed_tasks)}")
+
+def research_venue_job(job: dict):
+    """crawl job handler: researches a venue and returns its stored document"""
+    payload = job["payload"]
+    collection = get_database()[VENUE_COLLECTION]
+    with llm_usage.job_scope(job, entity=payload["search_key"]), llm_scheduler.priority(llm_scheduler.job_priority(job)), \
+            profiling.job_profile(job), tracing.job_trace(job, entity=payload["search_key"]):
+        venue = ResearchVenue(venue_name=payload["search_key"], mongo_collection=collection, source=payload.get("source"))
+    check_complete(venue, venue.venue)
+    return collection.find_one({"name": venue.venue}, {"_id": 0})
+
+def research_hall_job(job: dict):
+    """crawl job handler: researches a food hall and returns its stored document"""
+    payload = job["payload"]
+    collection = get_database()[FOODHALL_COLLECTION]
+    hall = ResearchHall(collection, payload["search_key"].title(), source=payload.get("source"))
+    with llm_usage.job_scope(job, entity=hall.food_hall), llm_scheduler.priority(llm_scheduler.job_priority(job)), \
+            profiling.job_profile(job), tracing.job_trace(job, entity=hall.food_hall):
+        hall.run_in_parallel()
+    check_complete(hall, hall.food_hall)
+    return collection.find_one({"name": hall.food_hall}, {"_id": 0})
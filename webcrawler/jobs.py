@@ -0,0 +1,296 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from webcrawler import llm_usage, metrics, replay
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# rough resident size of one research job: 4 chrome processes, their drivers and the python side
+JOB_MEMORY_MB = int(os.getenv("CRAWL_JOB_MEMORY_MB", "1600"))
+
+# a running job's lease; the worker renews it every third of this, and once it
+# lapses (worker or node died) the job is redelivered to another worker
+JOB_LEASE = timedelta(seconds=int(os.getenv("CRAWL_JOB_LEASE_SECONDS", "120")))
+
+# a job redelivered this many times is marked failed instead of being retried again
+JOB_MAX_ATTEMPTS = int(os.getenv("CRAWL_JOB_MAX_ATTEMPTS", "3"))
+
+# single-flight leases expire on their own in case the owning job never finishes
+LEASE_TTL = timedelta(hours=2)
+
+class ResearchIncomplete(Exception):
+    """A research job finished but some of its tasks failed, so their fields are missing."""
+
+# errors that stop a whole research job instead of failing just the task that hit them;
+# a replayed job missing a recording would otherwise pass with fields left empty
+FATAL_ERRORS = (llm_usage.BudgetExceeded, replay.ReplayMiss)
+
+def host_memory_mb() -> int:
+    """returns total physical memory of the host in MB"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return JOB_MEMORY_MB * 2
+
+def default_worker_count() -> int:
+    """returns how many research jobs this host can run at once (CRAWL_WORKERS overrides)"""
+    if os.getenv("CRAWL_WORKERS"):
+        return max(1, int(os.getenv("CRAWL_WORKERS")))
+    # leave one job's worth of memory for the API process and the OS
+    by_memory = host_memory_mb() // JOB_MEMORY_MB - 1
+    return max(1, min(by_memory, os.cpu_count() or 1))
+
+class JobQueue:
+    """Persistent crawl job queue backed by a mongo collection, drained by a
+    fixed number of worker threads.
+
+    Jobs are claimed with an atomic find_one_and_update, so submissions beyond
+    the worker count wait in mongo instead of starting more browsers, and
+    queued jobs survive a restart. Any number of processes on any number of
+    nodes can drain the same collection: a claimed job carries a lease that
+    its worker heartbeats, and a job whose lease lapsed is handed to the next
+    worker that asks (up to JOB_MAX_ATTEMPTS). Jobs submitted with a dedupe_key hold a
+    lease in `crawl_leases` while queued or running, so a duplicate request
+    from any process attaches to the job in flight instead of starting another.
+    With a process_pool, handlers run in its child processes rather than in
+    the worker threads themselves.
+    """
+    def __init__(self, collection, workers: int = None, poll_interval: float = 5, process_pool=None):
+        self.collection = collection
+        self.process_pool = process_pool
+        self.leases = collection.database["crawl_leases"]
+        self.workers = workers or default_worker_count()
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.handlers = {}
+        self._active = 0
+        self._running = {}
+        self._active_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._threads = []
+
+    def register(self, task: str, handler):
+        """registers handler(job) -> result for jobs submitted with this task name"""
+        self.handlers[task] = handler
+
+    def submit(self, task: str, payload: dict, priority: int = 0, dedupe_key: str = None,
+               validate: bool = True) -> tuple[str, bool]:
+        """queues a job and returns (job_id, coalesced).
+
+        With a dedupe_key, if a job for the same task and key is already queued
+        or running anywhere, its id is returned with coalesced=True instead.
+        validate=False skips the handler check, for producers whose jobs run on
+        other nodes.
+        """
+        if validate and task not in self.handlers:
+            raise ValueError(f"no handler registered for task {task}")
+        job_id = uuid.uuid4().hex
+        lease_id = f"{task}:{dedupe_key}" if dedupe_key else None
+
+        if lease_id is not None:
+            running_job_id = self._acquire_lease(lease_id, job_id)
+            if running_job_id is not None:
+                self.collection.update_one({"_id": running_job_id}, {"$inc": {"coalesced": 1}})
+                logger.info(f"Coalesced {task} request for {dedupe_key} into job {running_job_id}")
+                return running_job_id, True
+
+        self.collection.insert_one({
+            "_id": job_id,
+            "task": task,
+            "payload": payload,
+            "priority": priority,
+            "status": JOB_QUEUED,
+            "attempts": 0,
+            "leaseId": lease_id,
+            "createdAt": datetime.utcnow(),
+        })
+        self._wake.set()
+        return job_id, False
+
+    def _acquire_lease(self, lease_id: str, job_id: str):
+        """takes the lease for job_id and returns None, or returns the id of the live job holding it"""
+        while True:
+            try:
+                now = datetime.utcnow()
+                self.leases.insert_one({"_id": lease_id, "jobId": job_id, "createdAt": now, "expiresAt": now + LEASE_TTL})
+                return None
+            except DuplicateKeyError:
+                pass
+
+            lease = self.leases.find_one({"_id": lease_id})
+            if lease is None:
+                continue  # released in between, try again
+            now = datetime.utcnow()
+            holder = self.collection.find_one({"_id": lease["jobId"]}, {"status": 1})
+            if holder is None and lease.get("createdAt", now) > now - timedelta(seconds=30):
+                # the holder's job document is about to be inserted; only return its id once it
+                # exists, so a holder that died in between isn't handed out as the job in flight
+                time.sleep(0.05)
+                continue
+            # a running job whose worker died is redelivered, so it still counts as in flight
+            if holder is not None and holder["status"] in (JOB_QUEUED, JOB_RUNNING) and lease["expiresAt"] > now:
+                return lease["jobId"]
+
+            # the holder finished or died without releasing; take over unless someone beat us to it
+            taken = self.leases.find_one_and_update(
+                {"_id": lease_id, "jobId": lease["jobId"]},
+                {"$set": {"jobId": job_id, "createdAt": now, "expiresAt": now + LEASE_TTL}})
+            if taken is not None:
+                return None
+
+    def _release_lease(self, job: dict):
+        if job.get("leaseId"):
+            self.leases.delete_one({"_id": job["leaseId"], "jobId": job["_id"]})
+
+    def wait(self, job_id: str, timeout: float, interval: float = 1):
+        """returns the job once it is done or failed, or as it stands after timeout seconds"""
+        deadline = time.monotonic() + timeout
+        job = self.get(job_id)
+        while job is not None and job["status"] not in (JOB_DONE, JOB_FAILED) and time.monotonic() < deadline:
+            time.sleep(min(interval, max(0, deadline - time.monotonic())))
+            job = self.get(job_id)
+        return job
+
+    def get(self, job_id: str, include_result: bool = True):
+        """returns the job document, or None if there is no such job"""
+        projection = None if include_result else {"result": 0}
+        return self.collection.find_one({"_id": job_id}, projection)
+
+    def active_count(self) -> int:
+        """returns the number of jobs running in this process"""
+        with self._active_lock:
+            return self._active
+
+    def free_slots(self) -> int:
+        """returns how many more jobs this process could start right now"""
+        return max(0, self.workers - self.active_count())
+
+    def stats(self) -> dict:
+        """returns queue depth per status and this process's worker usage"""
+        counts = {status: 0 for status in (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)}
+        for row in self.collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["count"]
+        return {"jobs": counts, "workers": self.workers, "active": self.active_count()}
+
+    def claim(self):
+        """atomically takes the next queued job for one of our handlers, or one whose worker's lease lapsed"""
+        now = datetime.utcnow()
+        job = self.collection.find_one_and_update(
+            {"task": {"$in": list(self.handlers)},
+             "$or": [{"status": JOB_QUEUED},
+                     {"status": JOB_RUNNING, "leaseExpiresAt": {"$lt": now}}]},
+            {"$set": {"status": JOB_RUNNING, "startedAt": now, "workerId": self.worker_id,
+                      "leaseExpiresAt": now + JOB_LEASE},
+             "$inc": {"attempts": 1}},
+            sort=[("priority", DESCENDING), ("createdAt", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is not None and job["attempts"] > JOB_MAX_ATTEMPTS:
+            logger.error(f"Giving up on {job['task']} job {job['_id']} after {job['attempts'] - 1} attempts")
+            self._finish(job, {"status": JOB_FAILED, "error": "lease lost too many times"})
+            return self.claim()
+        return job
+
+    def _finish(self, job: dict, update: dict) -> bool:
+        update["finishedAt"] = datetime.utcnow()
+        result = self.collection.update_one({"_id": job["_id"], "workerId": self.worker_id},
+                                            {"$set": update, "$unset": {"leaseExpiresAt": ""}})
+        if result.matched_count == 0:
+            # our lease lapsed and another worker owns the job now; its outcome wins
+            logger.warning(f"Lost the lease on {job['task']} job {job['_id']}, dropping our outcome")
+            return False
+        self._release_lease(job)
+        return True
+
+    def execute(self, job: dict):
+        """runs a claimed job and records its result or error"""
+        logger.info(f"Starting {job['task']} job {job['_id']} (attempt {job['attempts']}) on {self.worker_id}")
+        started = time.monotonic()
+        if job["attempts"] == 1:
+            metrics.JOB_WAIT_SECONDS.labels(job["task"]).observe((job["startedAt"] - job["createdAt"]).total_seconds())
+        try:
+            handler = self.handlers[job["task"]]
+            result = self.process_pool.run(handler, job) if self.process_pool else handler(job)
+            update = {"status": JOB_DONE, "result": result}
+        except Exception as e:
+            logger.error(f"Error in {job['task']} job {job['_id']}: {e}")
+            update = {"status": JOB_FAILED, "error": str(e)}
+        metrics.JOB_SECONDS.labels(job["task"], update["status"]).observe(time.monotonic() - started)
+        if self._finish(job, update):
+            logger.info(f"Finished {job['task']} job {job['_id']} with status {update['status']}")
+
+    def heartbeat(self):
+        """renews the leases of the jobs running in this process"""
+        with self._active_lock:
+            running = list(self._running.values())
+        if not running:
+            return
+        now = datetime.utcnow()
+        self.collection.update_many(
+            {"_id": {"$in": [job["_id"] for job in running]}, "workerId": self.worker_id, "status": JOB_RUNNING},
+            {"$set": {"leaseExpiresAt": now + JOB_LEASE}})
+        lease_ids = [job["leaseId"] for job in running if job.get("leaseId")]
+        if lease_ids:
+            self.leases.update_many({"_id": {"$in": lease_ids}}, {"$set": {"expiresAt": now + LEASE_TTL}})
+
+    def _heartbeat_loop(self):
+        interval = JOB_LEASE.total_seconds() / 3
+        while True:
+            time.sleep(interval)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Error renewing crawl job leases: {e}")
+
+    def _worker(self):
+        while True:
+            try:
+                job = self.claim()
+            except Exception as e:
+                logger.error(f"Error claiming crawl job: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            with self._active_lock:
+                self._active += 1
+                self._running[job["_id"]] = job
+            try:
+                self.execute(job)
+            finally:
+                with self._active_lock:
+                    self._active -= 1
+                    self._running.pop(job["_id"], None)
+
+    def start(self):
+        """creates indexes and starts the worker threads and the lease heartbeat"""
+        if self._threads:
+            return self
+        self.collection.create_index([("status", ASCENDING), ("priority", DESCENDING), ("createdAt", ASCENDING)])
+        self.collection.create_index([("status", ASCENDING), ("leaseExpiresAt", ASCENDING)])
+        self.leases.create_index("expiresAt", expireAfterSeconds=0)
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="crawl-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"crawl-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} crawl worker(s)")
+        return self
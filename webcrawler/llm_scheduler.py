@@ -0,0 +1,383 @@
+"""Shared scheduling of chat completions against Azure OpenAI quotas.
+
+Every completion gpt.py sends goes through complete(), which
+
+- waits until its deployment's requests-per-minute and tokens-per-minute
+  buckets have room for it; batch calls leave LLM_INTERACTIVE_RESERVE (a
+  fraction, 0.2 by default) of every bucket to interactive ones,
+- retries 429s, timeouts, connection errors and 5xx answers with jittered
+  exponential backoff, waiting at least as long as their Retry-After header
+  says; a 429 also holds back every other call to that deployment that long,
+- with LLM_HEDGE_PERCENTILE set (e.g. 95), sends a second copy of a call that
+  is still running past that percentile of the deployment's recent latencies,
+  if the buckets have room for it, and returns whichever answer comes first.
+
+    LLM_LIMITS='{"gpt-4o": [450, 80000]}'   requests and tokens per minute of a deployment
+    LLM_RPM=450 LLM_TPM=80000               the same for deployments not in LLM_LIMITS (0 for no limit)
+
+The buckets are kept in a file per deployment under LLM_QUOTA_DIR (a
+directory in the system temp dir by default) that every process on the host
+locks while it takes from them, so the API process, its ProcessPool children
+and standalone batch runners and workers share one quota however many of them
+run. Where the files can't be used (no fcntl, as on Windows, or the directory
+isn't writable) buckets are kept per process and each gets 1/LLM_QUOTA_PROCESSES
+of the limits, which app.py sets to its pool size plus one. Set the limits to
+the deployment's quota, or this host's share of it when several hosts use one
+deployment. A call's tokens are estimated from its prompt before it is sent and
+the bucket is corrected with the usage it reports.
+
+Calls are interactive unless made inside `with priority(BATCH):`, as batch
+runner venues and background run jobs are; threads started with
+llm_usage.in_context keep the priority of the thread that started them. Within
+a process waiting calls go in priority order; across processes the reserve is
+what keeps batch calls from using up the room interactive ones need.
+"""
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import re
+import struct
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+try:
+    import fcntl
+except ImportError:  # Windows: buckets are kept per process, see quota_processes
+    fcntl = None
+
+from openai import APIConnectionError, InternalServerError, RateLimitError
+
+from webcrawler import llm_usage, metrics, tracing
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# requests and tokens per minute per deployment, 0 for no limit
+DEFAULT_RPM = int(os.getenv("LLM_RPM", "0"))
+DEFAULT_TPM = int(os.getenv("LLM_TPM", "0"))
+LIMITS = {model: tuple(limits) for model, limits in json.loads(os.getenv("LLM_LIMITS", "{}")).items()}
+# Azure enforces its per minute quotas over shorter windows, so at most this many seconds' worth is sent at once
+BURST_SECONDS = 10
+# tokens a completion is assumed to produce until it reports its usage
+COMPLETION_TOKENS = int(os.getenv("LLM_COMPLETION_TOKEN_ESTIMATE", "400"))
+
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "8"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_SECONDS", "1"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "60"))
+RETRYABLE = (RateLimitError, APIConnectionError, InternalServerError)  # APITimeoutError is an APIConnectionError
+
+QUOTA_DIR = os.getenv("LLM_QUOTA_DIR") or os.path.join(tempfile.gettempdir(), "llm-quota")
+# fraction of every bucket batch calls leave for interactive ones
+INTERACTIVE_RESERVE = float(os.getenv("LLM_INTERACTIVE_RESERVE", "0.2"))
+# how often a call waiting on buckets other processes also take from looks at them again
+SHARED_POLL_SECONDS = 0.25
+
+# 0 (off) or the latency percentile after which a call is sent a second time
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0"))
+# latencies of recent calls hedging looks at, and how many it needs first
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+INTERACTIVE, BATCH = 0, 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+_priority = ContextVar("llm_priority", default=INTERACTIVE)
+_sequence = itertools.count()
+_deployments = {}
+_deployments_lock = threading.Lock()
+
+class TokenBucket:
+    """per_minute units refilled continuously, up to BURST_SECONDS worth saved up; no limit when per_minute is 0"""
+    def __init__(self, per_minute: float, burst_seconds: float = BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float, reserve: float = 0.0) -> float:
+        """returns the seconds until amount can be taken leaving reserve (a fraction of the capacity) behind"""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (min(amount + reserve * self.capacity, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float) -> float:
+        """takes amount (at most a full bucket, so no call waits forever) and returns what was taken"""
+        if not self.rate:
+            return 0.0
+        amount = min(amount, self.capacity)
+        self.level -= amount
+        return amount
+
+    def settle(self, taken: float, used: float):
+        """corrects an earlier take of taken units that turned out to use used; overuse is owed by later takes"""
+        if self.rate:
+            self.level = min(self.capacity, self.level + taken - used)
+
+class SharedBuckets:
+    """The levels of a deployment's buckets and its pause, kept in a file that every process on the host locks
+    around each change. Times are time.monotonic(), which on Linux and macOS is the same clock in every process."""
+    _layout = struct.Struct("5d")  # requests level and refill time, tokens level and refill time, paused until
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._open()
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        # a forked child must open the file itself, flock doesn't exclude processes sharing one open file
+        self._pid = os.getpid()
+
+    @contextmanager
+    def synced(self, deployment: "Deployment"):
+        """loads the shared levels into deployment's buckets and writes them back after the block"""
+        if self._pid != os.getpid():
+            self._open()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            data = os.pread(self._fd, self._layout.size, 0)
+            requests, tokens = deployment.requests, deployment.tokens
+            if len(data) == self._layout.size:  # otherwise the file is new and the buckets start full
+                (requests.level, requests._updated, tokens.level, tokens._updated,
+                 deployment._paused_until) = self._layout.unpack(data)
+            yield
+            os.pwrite(self._fd, self._layout.pack(requests.level, requests._updated, tokens.level, tokens._updated,
+                                                  deployment._paused_until), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+class Deployment:
+    """The rate limit buckets, waiting calls and recent latencies of one model deployment."""
+    def __init__(self, model: str, rpm: float, tpm: float, shared: SharedBuckets = None):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._waiting = []
+        self._paused_until = 0.0
+        self._shared = shared
+        self._condition = threading.Condition()
+
+    def _synced(self):
+        return self._shared.synced(self) if self._shared else nullcontext()
+
+    def _wait_time(self, tokens: int, now: float, reserve: float) -> float:
+        return max(self.requests.wait_time(1, now, reserve), self.tokens.wait_time(tokens, now, reserve),
+                   self._paused_until - now)
+
+    def _take(self, tokens: int, level: int):
+        """takes room for a call if there is some now, returns (tokens taken, 0) or (None, seconds to wait)"""
+        reserve = INTERACTIVE_RESERVE if level == BATCH else 0.0
+        with self._synced():
+            wait = self._wait_time(tokens, time.monotonic(), reserve)
+            if wait > 0:
+                return None, wait
+            self.requests.take(1)
+            return self.tokens.take(tokens), 0.0
+
+    def acquire(self, tokens: int, order: tuple) -> float:
+        """waits until the call is first in line by order (priority, arrival) and the buckets have room for it,
+        returns the tokens taken"""
+        with self._condition:
+            heapq.heappush(self._waiting, order)
+            try:
+                while True:
+                    wait = None  # until the calls ahead of us are through
+                    if self._waiting[0] == order:
+                        taken, wait = self._take(tokens, order[0])
+                        if taken is not None:
+                            return taken
+                        if self._shared:
+                            # other processes give back what their calls didn't use without waking us
+                            wait = min(wait, SHARED_POLL_SECONDS)
+                    self._condition.wait(wait)
+            finally:
+                self._waiting.remove(order)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+
+    def try_acquire(self, tokens: int, level: int = INTERACTIVE):
+        """takes room for a call only if nobody is waiting and there is room now, returns the tokens taken or None"""
+        with self._condition:
+            if self._waiting:
+                return None
+            return self._take(tokens, level)[0]
+
+    def settle(self, taken: float, used: float):
+        with self._condition:
+            with self._synced():
+                self.tokens.settle(taken, used)
+            self._condition.notify_all()
+
+    def pause(self, seconds: float):
+        """holds back every call for seconds, e.g. after a 429"""
+        with self._condition, self._synced():
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def finished(self, seconds: float, taken: float, response):
+        """records a completed call's latency and corrects its token estimate with its usage"""
+        usage = getattr(response, "usage", None)
+        with self._condition:
+            self.latencies.append(seconds)
+            with self._synced():
+                self.tokens.settle(taken, getattr(usage, "total_tokens", None) or taken)
+            self._condition.notify_all()
+
+    def hedge_after(self):
+        """returns the HEDGE_PERCENTILE latency of recent calls, None while hedging is off or there are too few"""
+        if not HEDGE_PERCENTILE or len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * HEDGE_PERCENTILE / 100))]
+
+def quota_processes() -> int:
+    """returns how many processes on this host split the limits when they can't share buckets (LLM_QUOTA_PROCESSES)"""
+    return max(1, int(os.getenv("LLM_QUOTA_PROCESSES", "1")))
+
+def shared_buckets(model: str):
+    """returns the SharedBuckets of model's deployment, None where processes can't share them"""
+    if fcntl is None:
+        return None
+    try:
+        return SharedBuckets(os.path.join(QUOTA_DIR, re.sub(r"[^\w.-]", "_", model) + ".bucket"))
+    except OSError as e:
+        logger.warning(f"Keeping {model} rate limits per process, can't share them in {QUOTA_DIR}: {e}")
+        return None
+
+def get_deployment(model: str) -> Deployment:
+    with _deployments_lock:
+        if model not in _deployments:
+            rpm, tpm = LIMITS.get(model, (DEFAULT_RPM, DEFAULT_TPM))
+            shared = shared_buckets(model)
+            processes = 1 if shared else quota_processes()
+            _deployments[model] = Deployment(model, rpm / processes, tpm / processes, shared)
+        return _deployments[model]
+
+@contextmanager
+def priority(level: int):
+    """with priority(BATCH): calls made inside wait behind interactive ones and leave them INTERACTIVE_RESERVE"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def job_priority(job: dict) -> int:
+    """returns BATCH for jobs a background run submitted, INTERACTIVE for the ones users asked for"""
+    return BATCH if (job.get("payload") or {}).get("run_id") else INTERACTIVE
+
+def estimate_tokens(messages: list) -> int:
+    """roughly the tokens Azure counts against the quota for a call: 4 characters per prompt token plus the answer"""
+    return sum(len(message.get("content") or "") for message in messages) // 4 + COMPLETION_TOKENS
+
+def retry_after(error: Exception):
+    """returns the seconds a rate limited or failed response asked us to wait, or None"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1)):
+        try:
+            return float(headers[header]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+def backoff(attempt: int, wait: float = None) -> float:
+    """returns the seconds to sleep before retry number attempt: Retry-After plus a little jitter when the
+    server said, otherwise full jitter exponential backoff"""
+    if wait is not None:
+        return wait + random.uniform(0, BACKOFF_BASE)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def _hedged(client, deployment: Deployment, call_site: str, request: dict, taken: float, hedge_after: float):
+    """sends request, and a copy of it if no answer came within hedge_after seconds; returns the first answer.
+    The slower copy is left to finish in the background and its usage recorded under call_site:hedge."""
+    answers = queue.Queue()
+    lock = threading.Lock()
+    answered = []
+
+    def send(taken: float, hedge: bool):
+        started = time.monotonic()
+        try:
+            response = client.chat.completions.create(**request)
+        except Exception as e:
+            answers.put((None, e))
+            return
+        deployment.finished(time.monotonic() - started, taken, response)
+        with lock:
+            late = bool(answered)
+            answered.append(hedge)
+        if late:
+            llm_usage.record(request["model"], f"{call_site}:hedge", response)
+        else:
+            answers.put((response, None))
+
+    threading.Thread(target=llm_usage.in_context(send), args=(taken, False), daemon=True).start()
+    sent = 1
+    try:
+        response, error = answers.get(timeout=hedge_after)
+    except queue.Empty:
+        hedge_taken = deployment.try_acquire(taken, _priority.get())
+        if hedge_taken is not None:
+            metrics.inc("llm_hedges")
+            threading.Thread(target=llm_usage.in_context(send), args=(hedge_taken, True), daemon=True).start()
+            sent = 2
+        response, error = answers.get()
+    while response is None and sent > 1:
+        sent -= 1
+        response, error = answers.get()
+    if response is None:
+        raise error
+    if answered[0]:
+        metrics.inc("llm_hedge_wins")
+    return response
+
+def complete(client, model: str, messages: list, call_site: str = "unknown", **options):
+    """client.chat.completions.create(model=model, messages=messages, **options) once the deployment's buckets
+    have room, retried until it succeeds or MAX_RETRIES retries failed"""
+    deployment = get_deployment(model)
+    request = {"model": model, "messages": messages, **options}
+    tokens = estimate_tokens(messages)
+    level = _priority.get()
+    # kept across retries, so a retried call doesn't lose its place in line
+    order = (level, next(_sequence))
+    attempt = 0
+    while True:
+        queued = time.monotonic()
+        with tracing.span("llm.wait", priority=PRIORITY_NAMES[level], attempt=attempt):
+            taken = deployment.acquire(tokens, order)
+        metrics.observe_llm_wait(model, PRIORITY_NAMES[level], time.monotonic() - queued)
+        started = time.monotonic()
+        try:
+            hedge_after = deployment.hedge_after()
+            if hedge_after is None:
+                response = client.chat.completions.create(**request)
+                deployment.finished(time.monotonic() - started, taken, response)
+            else:
+                response = _hedged(client, deployment, call_site, request, taken, hedge_after)
+            return response
+        except RETRYABLE as e:
+            delay = backoff(attempt, retry_after(e))
+            if isinstance(e, RateLimitError):
+                # a rejected call doesn't count against the quota, but the next ones should hold off
+                deployment.settle(taken, 0)
+                deployment.pause(delay)
+                metrics.inc("llm_rate_limited")
+            if attempt >= MAX_RETRIES:
+                logger.error(f"Giving up on {call_site} call to {model} after {attempt + 1} attempts: {e}")
+                raise
+            attempt += 1
+            metrics.inc("llm_retries")
+            logger.warning(f"{type(e).__name__} from {model} ({call_site}), retry {attempt} in {delay:.1f}s")
+            time.sleep(delay)
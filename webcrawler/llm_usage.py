@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from datetime import datetime, timedelta
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# USD per 1K tokens (prompt, completion); LLM_PRICES='{"gpt-4o": [0.005, 0.015]}' overrides
+MODEL_PRICES = {
+    "gpt-4o": (0.005, 0.015),
+    "gpt-35-turbo": (0.0005, 0.0015),
+}
+MODEL_PRICES.update({model: tuple(prices) for model, prices in json.loads(os.getenv("LLM_PRICES", "{}")).items()})
+
+# per-job limits, 0 for none; a job's payload may carry its own {"budget": {"tokens": ..., "cost": ...}}
+JOB_TOKEN_BUDGET = int(os.getenv("LLM_JOB_TOKEN_BUDGET", "400000"))
+JOB_COST_BUDGET = float(os.getenv("LLM_JOB_COST_BUDGET", "4.0"))
+
+# who an LLM call is for: job_id, entity (hall or venue name) and field (research task)
+_attribution = ContextVar("llm_attribution", default={})
+# Trackers that every call made in this context counts towards
+_trackers = ContextVar("llm_trackers", default=())
+
+_ledger = None
+
+class BudgetExceeded(Exception):
+    """An LLM call was refused because its job used up its token or cost budget."""
+
+class Tracker:
+    """Adds up the tokens and cost of the calls made inside its track() block.
+    With max_tokens / max_cost set, further calls raise BudgetExceeded once it is spent."""
+    def __init__(self, max_tokens: int = 0, max_cost: float = 0, name: str = None):
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.name = name
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def exceeded(self) -> bool:
+        return bool((self.max_tokens and self.total_tokens >= self.max_tokens)
+                    or (self.max_cost and self.cost >= self.max_cost))
+
+    def add(self, prompt_tokens: int, completion_tokens: int, cost: float):
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += cost
+            self.calls += 1
+
+    def as_dict(self) -> dict:
+        return {"calls": self.calls, "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+                "cost": round(self.cost, 4)}
+
+def set_ledger(collection):
+    """stores a record of every LLM call in collection (e.g. mongodb["llm_usage"]) from now on"""
+    global _ledger
+    _ledger = collection
+
+@contextmanager
+def attribute(**attrs):
+    """with attribute(entity=..., field=...): calls inside are recorded against these"""
+    token = _attribution.set({**_attribution.get(), **attrs})
+    try:
+        yield
+    finally:
+        _attribution.reset(token)
+
+@contextmanager
+def track(tracker: Tracker = None):
+    """with track() as tracker: counts the calls made inside the block (in this thread and ones started with in_context)"""
+    tracker = tracker or Tracker()
+    token = _trackers.set(_trackers.get() + (tracker,))
+    try:
+        yield tracker
+    finally:
+        _trackers.reset(token)
+
+@contextmanager
+def job_scope(job: dict, entity: str = None):
+    """attributes a crawl job's calls to it and enforces its budget; yields the job's Tracker"""
+    budget = (job.get("payload") or {}).get("budget") or {}
+    tracker = Tracker(budget.get("tokens", JOB_TOKEN_BUDGET), budget.get("cost", JOB_COST_BUDGET), name=job["_id"])
+    try:
+        with attribute(job_id=job["_id"], task=job.get("task"), entity=entity), track(tracker):
+            yield tracker
+    finally:
+        logger.info(f"{job.get('task')} job {job['_id']} used {tracker.as_dict()}")
+
+def in_context(func):
+    """returns func wrapped to run in a copy of the caller's context, so threads keep its attribution and trackers"""
+    context = copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return run
+
+def check_budget():
+    """raises BudgetExceeded if any budget this call would count towards is spent"""
+    for tracker in _trackers.get():
+        if tracker.exceeded():
+            raise BudgetExceeded(f"LLM budget of {tracker.name or 'this run'} spent: {tracker.as_dict()}")
+
+def cost_of(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0, 0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+def record(model: str, call_site: str, response) -> dict:
+    """counts a completion's usage towards the active trackers and stores it in the ledger"""
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    cost = cost_of(model, prompt_tokens, completion_tokens)
+    for tracker in _trackers.get():
+        tracker.add(prompt_tokens, completion_tokens, cost)
+
+    entry = {
+        **_attribution.get(),
+        "model": model,
+        "call_site": call_site,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost": cost,
+        "at": datetime.utcnow(),
+    }
+    if _ledger is not None:
+        try:
+            _ledger.insert_one(dict(entry))
+        except Exception as e:
+            logger.error(f"Error recording LLM usage: {e}")
+    return entry
+
+def usage_report(collection, group_by: str = "field", job_id: str = None, days: int = 30) -> list[dict]:
+    """returns token and cost totals per group_by value (field, call_site, model, entity, job_id, task), costliest first"""
+    match = {"at": {"$gte": datetime.utcnow() - timedelta(days=days)}}
+    if job_id:
+        match["job_id"] = job_id
+    rows = collection.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": f"${group_by}",
+            "calls": {"$sum": 1},
+            "prompt_tokens": {"$sum": "$prompt_tokens"},
+            "completion_tokens": {"$sum": "$completion_tokens"},
+            "cost": {"$sum": "$cost"},
+            "jobs": {"$addToSet": "$job_id"},
+        }},
+        {"$sort": {"cost": -1}},
+    ])
+    return [{
+        group_by: row["_id"],
+        "calls": row["calls"],
+        "prompt_tokens": row["prompt_tokens"],
+        "completion_tokens": row["completion_tokens"],
+        "cost": round(row["cost"], 4),
+        "cost_per_job": round(row["cost"] / max(1, len([job for job in row["jobs"] if job])), 4),
+    } for row in rows]
@@ -0,0 +1,88 @@
+import os
+import threading
+from collections import Counter
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter as PromCounter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+
+# process-wide work counters (llm_calls, pages_loaded, searches, ...) read by the batch runner's progress line
+_counters = Counter()
+# current values such as pipeline queue depths
+_gauges = {}
+_lock = threading.Lock()
+
+# Prometheus instruments, served by app.py on /metrics. With PROMETHEUS_MULTIPROC_DIR
+# set (see the Dockerfile) samples from ProcessPool children are merged in as well.
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1800)
+
+WORK_TOTAL = PromCounter("crawler_work", "pages loaded, searches, llm calls, ...", ["kind"])
+STATE = Gauge("crawler_state", "queue depths and pool sizes", ["name"], multiprocess_mode="livesum")
+BROWSER_CREATE_SECONDS = Histogram("crawler_browser_create_seconds", "chrome startup", buckets=SECONDS_BUCKETS)
+NAVIGATION_SECONDS = Histogram("crawler_navigation_seconds", "browser.get until the load event", ["kind"],
+                               buckets=SECONDS_BUCKETS)
+READY_WAIT_SECONDS = Histogram("crawler_ready_wait_seconds", "fixed waits for pages to render", buckets=SECONDS_BUCKETS)
+PARSE_SECONDS = Histogram("crawler_parse_seconds", "HTML to text", buckets=SECONDS_BUCKETS)
+LLM_SECONDS = Histogram("crawler_llm_seconds", "chat completion latency", ["call_site"], buckets=SECONDS_BUCKETS)
+LLM_TOKENS = PromCounter("crawler_llm_tokens", "tokens used by chat completions", ["call_site", "kind"])
+MONGO_WRITE_SECONDS = Histogram("crawler_mongo_write_seconds", "research document writes", ["collection"],
+                                buckets=SECONDS_BUCKETS)
+JOB_SECONDS = Histogram("crawler_job_seconds", "job makespan from claim to finish", ["task", "status"],
+                        buckets=SECONDS_BUCKETS)
+LLM_JSON_PARSE = PromCounter("crawler_llm_json_parse", "LLM replies read as JSON: json, extracted, repaired or failed",
+                             ["call_site", "outcome"])
+JOB_WAIT_SECONDS = Histogram("crawler_job_wait_seconds", "time jobs spent queued", ["task"], buckets=SECONDS_BUCKETS)
+LLM_WAIT_SECONDS = Histogram("crawler_llm_wait_seconds", "time chat completions waited for rate limit room",
+                             ["model", "priority"], buckets=SECONDS_BUCKETS)
+
+def inc(name: str, amount: int = 1):
+    """adds amount to the named counter"""
+    with _lock:
+        _counters[name] += amount
+    WORK_TOTAL.labels(name).inc(amount)
+
+def snapshot() -> dict:
+    """returns a copy of all counters"""
+    with _lock:
+        return dict(_counters)
+
+def set_gauge(name: str, value: float):
+    """sets the named gauge to value"""
+    with _lock:
+        _gauges[name] = value
+    STATE.labels(name).set(value)
+
+def gauges() -> dict:
+    """returns a copy of all gauges"""
+    with _lock:
+        return dict(_gauges)
+
+def count_json_parse(call_site: str, outcome: str):
+    """counts how an LLM reply was read as JSON (json, extracted, repaired or failed)"""
+    inc(f"llm_json_{outcome}")
+    LLM_JSON_PARSE.labels(call_site, outcome).inc()
+
+def observe_llm(call_site: str, seconds: float, response=None):
+    """records the latency and, if the response reports it, token usage of one chat completion"""
+    LLM_SECONDS.labels(call_site).observe(seconds)
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        LLM_TOKENS.labels(call_site, "prompt").inc(usage.prompt_tokens or 0)
+        LLM_TOKENS.labels(call_site, "completion").inc(usage.completion_tokens or 0)
+
+def observe_llm_wait(model: str, priority: str, seconds: float):
+    """records how long a chat completion waited for its deployment's rate limits"""
+    LLM_WAIT_SECONDS.labels(model, priority).observe(seconds)
+
+def process_exited(pid: int):
+    """drops the live gauges of a child process that exited"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
+
+def render() -> tuple[bytes, str]:
+    """returns the /metrics payload and its content type"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,248 @@
+"""Shared memory page store: passes pages between crawler processes by handle instead of pickling them.
+
+POSIX only (_posixshmem and fcntl are imported on first use, so importing
+this module works everywhere); callers check available() and pickle
+otherwise. ResearchHall uses it to hand fetched pages to its extraction
+processes (HALL_EXTRACT_PROCESSES).
+"""
+import atexit
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+# what a page load yields for analysis: its extracted text and the links on it
+PageSnapshot = namedtuple("PageSnapshot", ["url", "text", "links"])
+
+# what crosses process boundaries instead of the page itself
+PageHandle = namedtuple("PageHandle", ["segment", "size"])
+
+# refcount, then the byte lengths of url, text and the newline-joined links
+_HEADER = struct.Struct("<iIII")
+
+# the producer evicts its oldest unreferenced pages past this many bytes
+PAGE_STORE_CAPACITY_MB = int(os.getenv("PAGE_STORE_CAPACITY_MB", "256"))
+
+def _posix():
+    """returns the _posixshmem and fcntl modules, raising ImportError off POSIX"""
+    import _posixshmem
+    import fcntl
+    return _posixshmem, fcntl
+
+def available() -> bool:
+    """returns whether shared memory pages work on this platform"""
+    try:
+        _posix()
+    except ImportError:
+        return False
+    return True
+
+class _Segment:
+    """A POSIX shared memory segment mapped into this process. Same storage as
+    multiprocessing.shared_memory, minus its resource tracker round trips,
+    since segment lifetime here follows the reference count instead."""
+    def __init__(self, name: str, size: int = None):
+        self.name = name
+        _posixshmem, _ = _posix()
+        if size is None:
+            fd = _posixshmem.shm_open(f"/{name}", os.O_RDWR, mode=0o600)
+        else:
+            fd = _posixshmem.shm_open(f"/{name}", os.O_CREAT | os.O_EXCL | os.O_RDWR, mode=0o600)
+        try:
+            if size is None:
+                size = os.fstat(fd).st_size
+            else:
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.size = size
+        self.buf = memoryview(self._mmap)
+
+    def close(self):
+        self.buf.release()
+        self._mmap.close()
+
+class PageView:
+    """A page attached from shared memory. text_bytes and links_bytes are
+    memoryviews into the segment, so nothing is copied until text/links are
+    decoded. Valid until the store releases it."""
+    def __init__(self, shm: _Segment):
+        self._shm = shm
+        _, url_len, text_len, links_len = _HEADER.unpack_from(shm.buf, 0)
+        start = _HEADER.size
+        self.url_bytes = shm.buf[start:start + url_len]
+        self.text_bytes = shm.buf[start + url_len:start + url_len + text_len]
+        self.links_bytes = shm.buf[start + url_len + text_len:start + url_len + text_len + links_len]
+
+    @property
+    def url(self) -> str:
+        return str(self.url_bytes, "utf-8")
+
+    @property
+    def text(self) -> str:
+        return str(self.text_bytes, "utf-8")
+
+    @property
+    def links(self) -> list[str]:
+        return str(self.links_bytes, "utf-8").split("\n") if len(self.links_bytes) else []
+
+    def snapshot(self) -> PageSnapshot:
+        return PageSnapshot(self.url, self.text, self.links)
+
+    def _close(self):
+        self.url_bytes.release()
+        self.text_bytes.release()
+        self.links_bytes.release()
+        self._shm.close()
+
+class SharedPageStore:
+    """Passes page snapshots between crawler processes by handle.
+
+    put() copies a snapshot into its own shared memory segment once and
+    returns a small PageHandle that can be pickled to other processes, which
+    attach() it without copying. Every segment carries a reference count
+    (under a file lock, so unrelated processes can share it): put() and
+    attach() take a reference, release() drops one, and the process that
+    drops the last one unlinks the segment. The producing store also evicts
+    its oldest pages that nobody else holds once it owns more than
+    capacity_mb, so a consumer that never shows up doesn't leak /dev/shm.
+    """
+    def __init__(self, prefix: str = "brokerai-page", capacity_mb: int = PAGE_STORE_CAPACITY_MB):
+        _posix()
+        self.prefix = prefix
+        self.capacity = capacity_mb * 1024 * 1024
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), f"{prefix}.lock"), "a")
+        self._thread_lock = threading.Lock()
+        self._owned = OrderedDict()
+        self._owned_bytes = 0
+        self._attached = {}
+
+    @contextmanager
+    def _locked(self):
+        _, fcntl = _posix()
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _unlink(self, segment: str):
+        _posixshmem, _ = _posix()
+        try:
+            _posixshmem.shm_unlink(f"/{segment}")
+        except FileNotFoundError:
+            pass
+
+    def _add_ref(self, shm: _Segment, delta: int) -> int:
+        count = struct.unpack_from("<i", shm.buf, 0)[0] + delta
+        struct.pack_into("<i", shm.buf, 0, count)
+        return count
+
+    def put(self, snapshot: PageSnapshot) -> PageHandle:
+        """copies snapshot into shared memory and returns its handle, holding one reference"""
+        url = (snapshot.url or "").encode("utf-8")
+        text = (snapshot.text or "").encode("utf-8")
+        links = "\n".join(link for link in snapshot.links or [] if link).encode("utf-8")
+        size = _HEADER.size + len(url) + len(text) + len(links)
+
+        shm = _Segment(f"{self.prefix}-{uuid.uuid4().hex[:16]}", size)
+        _HEADER.pack_into(shm.buf, 0, 1, len(url), len(text), len(links))
+        offset = _HEADER.size
+        for part in (url, text, links):
+            shm.buf[offset:offset + len(part)] = part
+            offset += len(part)
+
+        handle = PageHandle(shm.name, size)
+        with self._thread_lock:
+            self._owned[handle.segment] = shm
+            self._owned_bytes += shm.size
+        self.evict()
+        return handle
+
+    def attach(self, handle: PageHandle) -> PageView:
+        """takes a reference to the page and returns a view of it; release(handle) when done"""
+        shm = _Segment(handle.segment)
+        with self._locked():
+            if self._add_ref(shm, 1) <= 1:
+                self._add_ref(shm, -1)
+                shm.close()
+                raise KeyError(f"page {handle.segment} was already released")
+        view = PageView(shm)
+        with self._thread_lock:
+            self._attached.setdefault(handle.segment, []).append(view)
+        return view
+
+    def get(self, handle: PageHandle) -> PageSnapshot:
+        """returns a copy of the page, keeping no reference"""
+        view = self.attach(handle)
+        try:
+            return view.snapshot()
+        finally:
+            self.release(handle)
+
+    def release(self, handle: PageHandle):
+        """drops one reference to the page, unlinking it if it was the last"""
+        with self._thread_lock:
+            views = self._attached.get(handle.segment)
+            view = views.pop() if views else None
+            if views == []:
+                del self._attached[handle.segment]
+            owned = self._owned.pop(handle.segment, None) if view is None else None
+            if owned is not None:
+                self._owned_bytes -= owned.size
+        if view is None and owned is None:
+            return
+        shm = view._shm if view is not None else owned
+        with self._locked():
+            count = self._add_ref(shm, -1)
+        if view is not None:
+            view._close()
+        else:
+            shm.close()
+        if count <= 0:
+            self._unlink(handle.segment)
+
+    def evict(self):
+        """unlinks this store's oldest pages that no other process holds until it is under capacity"""
+        with self._thread_lock:
+            if self._owned_bytes <= self.capacity:
+                return
+            candidates = list(self._owned.items())
+        for segment, shm in candidates:
+            if self._owned_bytes <= self.capacity:
+                break
+            with self._locked():
+                if struct.unpack_from("<i", shm.buf, 0)[0] > 1:
+                    continue  # a consumer still has it attached
+                struct.pack_into("<i", shm.buf, 0, 0)
+            with self._thread_lock:
+                self._owned.pop(segment, None)
+                self._owned_bytes -= shm.size
+            shm.close()
+            self._unlink(segment)
+
+    def close(self):
+        """releases every page this store still owns or has attached"""
+        with self._thread_lock:
+            owned = [PageHandle(segment, shm.size) for segment, shm in self._owned.items()]
+            attached = [PageHandle(segment, 0) for segment, views in self._attached.items() for _ in views]
+        for handle in attached + owned:
+            self.release(handle)
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def default_store() -> SharedPageStore:
+    """returns this process's store, closed (its pages released) at exit"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = SharedPageStore()
+            atexit.register(_default_store.close)
+        return _default_store
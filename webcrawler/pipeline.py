@@ -0,0 +1,199 @@
+import logging
+import queue
+import threading
+import time
+
+from webcrawler import llm_usage, metrics, tracing
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+# a worker whose setup() keeps failing after this many tries leaves its items to the other workers
+SETUP_ATTEMPTS = 3
+SETUP_RETRY_SECONDS = 2
+
+class Stage:
+    """One step of a Pipeline: workers threads apply func(item, resource) to
+    items from a queue of at most queue_size, passing results on to the next
+    stage. setup() is called once per worker for its resource (e.g. a browser)
+    and teardown(resource) when the worker exits. func returning None drops
+    the item. When func raises an error broken(error) is true for, the
+    resource is torn down and set up again before the next item."""
+    def __init__(self, name: str, func, workers: int = 1, queue_size: int = None, setup=None, teardown=None,
+                 broken=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=queue_size or self.workers * 2)
+        self.setup = setup
+        self.teardown = teardown
+        self.broken = broken
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_depth = 0
+        self._running = 0
+        self._lock = threading.Lock()
+
+class Pipeline:
+    """Stages connected by bounded queues, e.g. search -> fetch -> extract -> llm -> persist.
+
+    A full queue blocks the stage feeding it, so a slow LLM stage holds the
+    browsers back instead of piling up pages in memory, while each stage's
+    own workers stay busy. Queue depth is published per stage as the
+    `pipeline_<name>_<stage>_depth` gauge, and stats() reports throughput
+    and utilisation once run() returns. Items a stage raised on are kept in
+    failures as (stage name, item, error). An error of one of the fatal
+    types stops the pipeline: the remaining items are dropped and run()
+    raises it.
+    """
+    def __init__(self, name: str, stages: list[Stage], fatal: tuple = ()):
+        self.name = name
+        self.stages = stages
+        self.fatal = fatal
+        self.results = []
+        self.failures = []
+        self._error = None
+        self._results_lock = threading.Lock()
+
+    def _publish_depth(self, stage: Stage):
+        depth = stage.queue.qsize()
+        stage.max_depth = max(stage.max_depth, depth)
+        metrics.set_gauge(f"pipeline_{self.name}_{stage.name}_depth", depth)
+
+    def _put(self, index: int, item):
+        if index == len(self.stages):
+            with self._results_lock:
+                self.results.append(item)
+            return
+        stage = self.stages[index]
+        stage.queue.put(item)
+        self._publish_depth(stage)
+
+    def _setup(self, stage: Stage):
+        """returns (resource, None), or (None, error) once setup() failed SETUP_ATTEMPTS times"""
+        if not stage.setup:
+            return None, None
+        for attempt in range(1, SETUP_ATTEMPTS + 1):
+            try:
+                with tracing.span(f"{self.name}.{stage.name}.setup", attempt=attempt):
+                    return stage.setup(), None
+            except Exception as e:
+                logger.error(f"Error setting up {self.name} {stage.name} worker (attempt {attempt}/{SETUP_ATTEMPTS}): {e}")
+                if attempt == SETUP_ATTEMPTS:
+                    return None, e
+                time.sleep(SETUP_RETRY_SECONDS * attempt)
+
+    def _teardown(self, stage: Stage, resource):
+        if stage.teardown and resource is not None:
+            try:
+                stage.teardown(resource)
+            except Exception as e:
+                logger.error(f"Error tearing down {self.name} {stage.name} worker: {e}")
+
+    def _give_up(self, stage: Stage) -> bool:
+        """leaves the stage to its other workers if there are any; the last one stays to fail the remaining items"""
+        with stage._lock:
+            if stage._running > 1:
+                stage._running -= 1
+                return True
+        return False
+
+    def _worker(self, index: int):
+        stage = self.stages[index]
+        resource, setup_error = self._setup(stage)
+        gave_up = False
+        try:
+            if setup_error is not None and self._give_up(stage):
+                gave_up = True
+                return
+            while True:
+                item = stage.queue.get()
+                self._publish_depth(stage)
+                if item is _DONE:
+                    break
+                if setup_error is not None or self._error is not None:
+                    # no worker of this stage could set up, or the pipeline is stopping
+                    with self._results_lock:
+                        self.failures.append((stage.name, item, self._error or setup_error))
+                    with stage._lock:
+                        stage.failed += 1
+                    continue
+                started = time.monotonic()
+                try:
+                    with tracing.span(f"{self.name}.{stage.name}"):
+                        result = stage.func(item, resource)
+                    failed = False
+                except Exception as e:
+                    logger.error(f"Error in {self.name} {stage.name} stage: {e}")
+                    result, failed = None, True
+                    with self._results_lock:
+                        self.failures.append((stage.name, item, e))
+                        if isinstance(e, self.fatal) and self._error is None:
+                            self._error = e
+                    if stage.broken and stage.broken(e):
+                        logger.warning(f"Replacing the resource of a {self.name} {stage.name} worker")
+                        self._teardown(stage, resource)
+                        resource, setup_error = self._setup(stage)
+                with stage._lock:
+                    stage.busy_seconds += time.monotonic() - started
+                    stage.failed += failed
+                    stage.processed += not failed
+                if result is not None:
+                    self._put(index + 1, result)
+                if setup_error is not None and self._give_up(stage):
+                    gave_up = True
+                    return
+        finally:
+            self._teardown(stage, resource)
+            # a worker that gave up left finishing the stage to the others
+            if not gave_up:
+                with stage._lock:
+                    stage._running -= 1
+                    last = stage._running == 0
+                # the last worker out tells every worker of the next stage to finish
+                if last and index + 1 < len(self.stages):
+                    for _ in range(self.stages[index + 1].workers):
+                        self.stages[index + 1].queue.put(_DONE)
+
+    def run(self, items) -> list:
+        """pushes items through every stage and returns what comes out of the last one"""
+        self.results = []
+        self.failures = []
+        self._error = None
+        started = time.monotonic()
+        threads = []
+        for index, stage in enumerate(self.stages):
+            stage._running = stage.workers
+            for i in range(stage.workers):
+                thread = threading.Thread(target=llm_usage.in_context(self._worker), args=(index,),
+                                          name=f"{self.name}-{stage.name}-{i}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        for item in items:
+            if self._error is not None:
+                break
+            self._put(0, item)
+        for _ in range(self.stages[0].workers):
+            self.stages[0].queue.put(_DONE)
+
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.monotonic() - started
+        logger.info(f"{self.name} pipeline finished in {self.elapsed:.1f}s: {self.stats()}")
+        if self._error is not None:
+            raise self._error
+        return self.results
+
+    def stats(self) -> dict:
+        """returns per stage items processed/failed, the deepest its queue got and how busy its workers were"""
+        elapsed = max(getattr(self, "elapsed", 0), 1e-6)
+        return {stage.name: {
+            "workers": stage.workers,
+            "processed": stage.processed,
+            "failed": stage.failed,
+            "max_depth": stage.max_depth,
+            "utilisation": round(stage.busy_seconds / (elapsed * stage.workers), 2),
+        } for stage in self.stages}
@@ -0,0 +1,170 @@
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.connection import Connection
+
+from webcrawler import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# a child is replaced after this many jobs, so leaks in chromedriver/bs4 don't pile up
+MAX_JOBS_PER_CHILD = int(os.getenv("CRAWL_MAX_JOBS_PER_CHILD", "10"))
+
+# a job and the chrome processes it started are killed past either limit
+JOB_TIMEOUT = float(os.getenv("CRAWL_JOB_TIMEOUT_SECONDS", "1800"))
+JOB_MEMORY_LIMIT_MB = int(os.getenv("CRAWL_JOB_MEMORY_LIMIT_MB", "3000"))
+
+class WorkerCrashed(Exception):
+    """A job's child process died, timed out or went over its memory limit."""
+
+def group_rss_mb(pgid: int):
+    """returns the resident memory in MB of every process in the process group, or None off linux"""
+    if not os.path.isdir("/proc"):
+        return None
+    page_kb = os.sysconf("SC_PAGE_SIZE") // 1024
+    total_kb = 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as fp:
+                # the command may contain spaces, the fields after it don't
+                fields = fp.read().rsplit(")", 1)[1].split()
+            if int(fields[2]) != pgid:
+                continue
+            with open(f"/proc/{pid}/statm") as fp:
+                total_kb += int(fp.read().split()[1]) * page_kb
+        except (OSError, IndexError, ValueError):
+            continue  # exited while we were looking
+    return total_kb // 1024
+
+def _child_main(conn, max_jobs: int):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for _ in range(max_jobs):
+        try:
+            handler, job = conn.recv()
+        except EOFError:
+            break  # the parent went away
+        try:
+            conn.send((True, handler(job)))
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+class _Slot:
+    """One child interpreter and the pipe jobs and results travel over.
+
+    Children are plain `python -m webcrawler.process_pool` processes rather
+    than multiprocessing ones, since spawn would re-run app.py (and start a
+    second job queue) in every child. Each gets its own session, so killing
+    its process group also kills the chrome processes it started.
+    """
+    def __init__(self, max_jobs: int):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "webcrawler.process_pool", str(child_conn.fileno()), str(max_jobs)],
+            pass_fds=(child_conn.fileno(),), start_new_session=True)
+        child_conn.close()
+        self.jobs_left = max_jobs
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            self.process.kill()
+        self.process.wait(5)
+        self.conn.close()
+        metrics.process_exited(self.process.pid)
+
+class ProcessPool:
+    """Runs job handlers in supervised child processes instead of API threads.
+
+    Each of the size slots owns one child; a call to run() blocks the calling
+    thread (a JobQueue worker) until the child sends the result back over its
+    pipe. Children are recycled after max_jobs_per_child jobs, and a child
+    that times out, goes over memory_limit_mb (counting its chrome processes)
+    or dies is killed with its whole process group and replaced.
+    Handlers must be top-level functions so they can be pickled to the child.
+    """
+    def __init__(self, size: int, max_jobs_per_child: int = MAX_JOBS_PER_CHILD, timeout: float = JOB_TIMEOUT,
+                 memory_limit_mb: int = JOB_MEMORY_LIMIT_MB, check_interval: float = 2):
+        self.size = size
+        self.max_jobs_per_child = max_jobs_per_child
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.check_interval = check_interval
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(None)
+        self._lock = threading.Lock()
+        self._slots = set()
+
+    def _checkout(self) -> _Slot:
+        slot = self._idle.get()
+        if slot is None or not slot.is_alive() or slot.jobs_left <= 0:
+            if slot is not None:
+                # a recycled child exits by itself after its last job
+                slot.process.wait(5)
+                slot.conn.close()
+                metrics.process_exited(slot.process.pid)
+                with self._lock:
+                    self._slots.discard(slot)
+            slot = _Slot(self.max_jobs_per_child)
+            with self._lock:
+                self._slots.add(slot)
+                metrics.set_gauge("crawl_pool_children", len(self._slots))
+        return slot
+
+    def run(self, handler, job: dict, timeout: float = None):
+        """runs handler(job) in a child process and returns its result, raising on failure"""
+        slot = self._checkout()
+        deadline = time.monotonic() + (timeout or self.timeout)
+        try:
+            slot.conn.send((handler, job))
+            slot.jobs_left -= 1
+            while True:
+                try:
+                    if slot.conn.poll(self.check_interval):
+                        ok, value = slot.conn.recv()
+                        break
+                except EOFError:
+                    raise WorkerCrashed("child process closed its pipe")
+                if not slot.is_alive():
+                    raise WorkerCrashed(f"child process exited with code {slot.process.returncode}")
+                if time.monotonic() > deadline:
+                    raise WorkerCrashed(f"timed out after {timeout or self.timeout:.0f}s")
+                rss = group_rss_mb(slot.process.pid) if self.memory_limit_mb else None
+                if rss is not None and rss > self.memory_limit_mb:
+                    raise WorkerCrashed(f"used {rss}MB, over the {self.memory_limit_mb}MB limit")
+        except (WorkerCrashed, OSError) as e:
+            logger.error(f"Killing crawl child {slot.process.pid}: {e}")
+            slot.kill()
+            with self._lock:
+                self._slots.discard(slot)
+            self._idle.put(None)
+            raise
+        self._idle.put(slot)
+        if not ok:
+            raise Exception(value)
+        return value
+
+    def close(self):
+        """stops every child process and whatever it started"""
+        with self._lock:
+            slots, self._slots = list(self._slots), set()
+        for slot in slots:
+            slot.kill()
+
+if __name__ == '__main__':
+    _child_main(Connection(int(sys.argv[1])), int(sys.argv[2]))
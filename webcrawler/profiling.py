@@ -0,0 +1,197 @@
+"""Opt-in profiles of single research jobs.
+
+    GET /crawler/new/<hall>?profile=1        (or /crawler/venues/new/<venue>?profile=1)
+    python -m webcrawler.batch_runner --list validation_venues --profile
+
+With profiling on, a sampler thread reads the stack of every thread working for
+the job (sys._current_frames) every CRAWL_PROFILE_INTERVAL seconds, and span()
+records when each research task, pipeline stage, search, page load and LLM call
+started and ended. When the job finishes profiles/<job id>/ holds:
+
+    stacks.collapsed   folded stacks, one "thread;frame;frame count" per line: drop it
+                       on https://www.speedscope.app or run flamegraph.pl over it
+    trace.json         the spans as a Chrome trace, open it in https://ui.perfetto.dev
+    summary.json       duration, samples and the functions most samples were in
+
+Threads started with llm_usage.in_context carry the job's profiler, so the
+threads of run_in_parallel and the hall pipeline are sampled from the first
+span they enter. Without profiling span() returns a shared no-op context
+manager after one context variable lookup, and nothing is sampled.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("CRAWL_PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.getenv("CRAWL_PROFILE_INTERVAL", "0.01"))
+# longest stack kept per sample, innermost frames win
+MAX_DEPTH = 128
+
+_profiler = ContextVar("profiler", default=None)
+_NO_SPAN = nullcontext()
+
+class Profiler:
+    """Samples the stacks of the threads registered with it and collects spans."""
+    def __init__(self, job_id: str, interval: float = PROFILE_INTERVAL, directory: str = PROFILE_DIR):
+        self.job_id = str(job_id)
+        self.interval = interval
+        self.path = os.path.join(directory, self.job_id)
+        self.stacks = Counter()
+        self.samples = 0
+        self.spans = []
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started = None
+        self._elapsed = None
+
+    def add_thread(self):
+        """samples the calling thread from now on"""
+        ident = threading.get_ident()
+        if ident not in self._threads:
+            with self._lock:
+                self._threads[ident] = threading.current_thread().name
+
+    def _sample(self):
+        frames = sys._current_frames()
+        with self._lock:
+            threads = list(self._threads.items())
+        for ident, name in threads:
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(name)
+            self.stacks[";".join(reversed(stack)).replace("\n", " ")] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:
+                logger.error(f"Error sampling job {self.job_id}: {e}")
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{self.job_id[:8]}", daemon=True)
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self._elapsed = time.perf_counter() - self._started
+
+    @contextmanager
+    def span(self, name: str, **args):
+        self.add_thread()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            span = {"name": name, "ts": started - self._started, "dur": time.perf_counter() - started,
+                    "tid": threading.get_ident(), "thread": threading.current_thread().name}
+            if args:
+                span["args"] = args
+            with self._lock:
+                self.spans.append(span)
+
+    def top_functions(self, limit: int = 25) -> list[dict]:
+        """returns the functions most samples were in (self) or under (total)"""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [{"function": function, "self": count, "total": total[function]}
+                for function, count in own.most_common(limit)]
+
+    def chrome_trace(self) -> dict:
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in {span["tid"]: span["thread"] for span in self.spans}.items()]
+        events += [{"name": span["name"], "cat": span["name"].split(".")[0], "ph": "X", "pid": pid,
+                    "tid": span["tid"], "ts": round(span["ts"] * 1e6), "dur": round(span["dur"] * 1e6),
+                    "args": span.get("args", {})} for span in self.spans]
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"job_id": self.job_id}}
+
+    def write(self) -> str:
+        """writes the profile to PROFILE_DIR/<job id> and returns that directory"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "stacks.collapsed"), "w") as fp:
+            for stack, count in self.stacks.most_common():
+                fp.write(f"{stack} {count}\n")
+        with open(os.path.join(self.path, "trace.json"), "w") as fp:
+            json.dump(self.chrome_trace(), fp)
+        with open(os.path.join(self.path, "summary.json"), "w") as fp:
+            json.dump({
+                "job_id": self.job_id,
+                "seconds": round(self._elapsed, 3),
+                "interval": self.interval,
+                "samples": self.samples,
+                "threads": sorted(set(self._threads.values())),
+                "spans": len(self.spans),
+                "top_functions": self.top_functions(),
+            }, fp, indent=2)
+        return self.path
+
+@contextmanager
+def profile(job_id: str, enabled: bool = True):
+    """with profile(job_id): samples this thread and every thread it starts with in_context, then writes the profile"""
+    if not enabled:
+        yield None
+        return
+    profiler = Profiler(job_id).start()
+    profiler.add_thread()
+    token = _profiler.set(profiler)
+    try:
+        with profiler.span("job", job_id=str(job_id)):
+            yield profiler
+    finally:
+        _profiler.reset(token)
+        profiler.stop()
+        try:
+            logger.info(f"Wrote profile of job {job_id} to {profiler.write()}")
+        except OSError as e:
+            logger.error(f"Error writing profile of job {job_id}: {e}")
+
+def job_profile(job: dict):
+    """profile(...) for a crawl job, on when it was submitted with "profile" in its payload"""
+    return profile(str(job["_id"]), enabled=bool(job.get("payload", {}).get("profile")))
+
+def active() -> bool:
+    """returns whether the current job is being profiled"""
+    return _profiler.get() is not None
+
+def span(name: str, **args):
+    """with span("search"): times the block when the current job is being profiled"""
+    profiler = _profiler.get()
+    if profiler is None:
+        return _NO_SPAN
+    return profiler.span(name, **args)
+
+def profile_path(job_id: str, artifact: str = None):
+    """returns where job_id's profile (or one artifact of it) is stored, None if it has none"""
+    path = os.path.join(PROFILE_DIR, os.path.basename(str(job_id)))
+    if artifact is not None:
+        path = os.path.join(path, os.path.basename(artifact))
+    return path if os.path.exists(path) else None
@@ -0,0 +1,234 @@
+"""Record a crawl's page loads and LLM completions, then replay them offline.
+
+    CRAWL_REPLAY_MODE=record CRAWL_REPLAY_ARCHIVE=archives/riverside python -m webcrawler.batch_runner ...
+    CRAWL_REPLAY_MODE=replay CRAWL_REPLAY_ARCHIVE=archives/riverside python -m webcrawler.batch_runner ...
+
+In record mode create_browser() wraps each browser in a RecordingBrowser, which
+stores every navigation's final page source, and gpt._create_completion stores
+every request and response. In replay mode create_browser() returns a
+ReplayBrowser serving the recorded pages and completions come from the archive,
+so ResearchVenue / ResearchHall run their full logic without Chrome, Google or
+Azure OpenAI, the same way every time. The fixed page ready waits are 0 when
+replaying; CRAWL_REPLAY_LATENCY_SCALE=1 sleeps for the recorded navigation and
+completion times instead (0.5 for half of them, ...).
+
+Archives are directories of pages-<pid>.jsonl and completions-<pid>.jsonl, one
+file per recording process so ProcessPool children don't interleave writes.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+
+from webcrawler import metrics
+from webcrawler.html_browser import HtmlBrowser
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# off, record or replay
+MODE = os.getenv("CRAWL_REPLAY_MODE", "off").lower()
+ARCHIVE = os.getenv("CRAWL_REPLAY_ARCHIVE", "replay_archive")
+# 0 replays without waiting, 1 at the recorded speed
+LATENCY_SCALE = float(os.getenv("CRAWL_REPLAY_LATENCY_SCALE", "0"))
+
+class ReplayMiss(Exception):
+    """The replayed crawl asked for a page or completion the archive doesn't have."""
+
+def recording() -> bool:
+    return MODE == "record"
+
+def replaying() -> bool:
+    return MODE == "replay"
+
+def completion_key(model: str, messages: list) -> str:
+    """identifies a completion request by its model and messages"""
+    return hashlib.sha256(json.dumps([model, messages], sort_keys=True).encode("utf-8")).hexdigest()
+
+class Archive:
+    """The recorded navigations and completions under path.
+
+    A url or prompt seen several times is replayed in the order it was
+    recorded, repeating the last recording once they run out."""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._files = {}
+        self._navigation_ids = 0
+        self._pages = None
+        self._completions = None
+        self._served = defaultdict(int)
+
+    def write(self, kind: str, record: dict):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if kind not in self._files:
+                os.makedirs(self.path, exist_ok=True)
+                self._files[kind] = open(os.path.join(self.path, f"{kind}-{os.getpid()}.jsonl"), "a")
+            self._files[kind].write(line)
+            self._files[kind].flush()
+
+    def next_navigation_id(self) -> str:
+        with self._lock:
+            self._navigation_ids += 1
+            return f"{os.getpid()}-{self._navigation_ids}"
+
+    def _read(self, kind: str) -> list[dict]:
+        records = []
+        for path in sorted(glob.glob(os.path.join(self.path, f"{kind}-*.jsonl"))):
+            with open(path) as fp:
+                records.extend(json.loads(line) for line in fp if line.strip())
+        return records
+
+    def _load(self):
+        if self._pages is not None:
+            return
+        # a navigation is captured again whenever its page changed, the last capture is the rendered page
+        navigations = {record["id"]: record for record in self._read("pages")}
+        pages = defaultdict(list)
+        for navigation in sorted(navigations.values(), key=lambda record: record["at"]):
+            pages[navigation["url"]].append(navigation)
+        completions = defaultdict(list)
+        for record in sorted(self._read("completions"), key=lambda record: record["at"]):
+            completions[record["key"]].append(record)
+        self._pages, self._completions = pages, completions
+        logger.info(f"Replaying {len(navigations)} navigations and {sum(map(len, completions.values()))} "
+                    f"completions from {self.path}")
+
+    def _next(self, kind: str, key: str) -> dict:
+        with self._lock:
+            self._load()
+            records = (self._pages if kind == "page" else self._completions).get(key)
+            if not records:
+                metrics.inc(f"replay_{kind}_misses")
+                raise ReplayMiss(f"no recorded {kind} for {key}")
+            index = self._served[(kind, key)]
+            self._served[(kind, key)] += 1
+        return records[min(index, len(records) - 1)]
+
+    def navigation(self, url: str) -> dict:
+        return self._next("page", url)
+
+    def completion(self, key: str) -> dict:
+        return self._next("completion", key)
+
+    def stats(self) -> dict:
+        self._load()
+        return {
+            "navigations": sum(map(len, self._pages.values())),
+            "urls": len(self._pages),
+            "completions": sum(map(len, self._completions.values())),
+            "distinct_prompts": len(self._completions),
+            "recorded_page_seconds": round(sum(page["seconds"] for pages in self._pages.values() for page in pages), 1),
+            "recorded_llm_seconds": round(sum(record["seconds"] for records in self._completions.values()
+                                              for record in records), 1),
+        }
+
+    def close(self):
+        with self._lock:
+            for fp in self._files.values():
+                fp.close()
+            self._files = {}
+
+@lru_cache(maxsize=None)
+def get_archive(path: str = None) -> Archive:
+    return Archive(path or ARCHIVE)
+
+def _wait(seconds: float):
+    if LATENCY_SCALE and seconds:
+        time.sleep(seconds * LATENCY_SCALE)
+
+class RecordingBrowser:
+    """Wraps a webdriver and stores the page source of every navigation as the crawler reads it.
+
+    A page is captured when it is loaded and again whenever its source has
+    changed by the time the crawler reads page_source or looks up elements,
+    so what gets replayed is the rendered page the crawler actually saw."""
+    def __init__(self, browser, archive: Archive):
+        self._browser = browser
+        self._archive = archive
+        self._navigation = None
+
+    def __getattr__(self, name):
+        return getattr(self._browser, name)
+
+    def get(self, url: str):
+        at, started = time.time(), time.monotonic()
+        self._browser.get(url)
+        self._navigation = {"id": self._archive.next_navigation_id(), "url": url, "at": at,
+                            "seconds": round(time.monotonic() - started, 3), "page_source": None}
+        self._capture()
+
+    @property
+    def page_source(self) -> str:
+        source = self._browser.page_source
+        self._capture(source)
+        return source
+
+    def find_elements(self, by: str, value: str):
+        self._capture()
+        return self._browser.find_elements(by, value)
+
+    def find_element(self, by: str, value: str):
+        self._capture()
+        return self._browser.find_element(by, value)
+
+    def _capture(self, source: str = None):
+        if self._navigation is None:
+            return
+        if source is None:
+            source = self._browser.page_source
+        if source == self._navigation["page_source"]:
+            return
+        self._navigation.update(page_source=source, current_url=self._browser.current_url)
+        self._archive.write("pages", self._navigation)
+
+class ReplayBrowser(HtmlBrowser):
+    """Serves recorded navigations in place of Chrome."""
+    def __init__(self, archive: Archive = None):
+        super().__init__()
+        self._archive = archive or get_archive()
+
+    def get(self, url: str):
+        navigation = self._archive.navigation(url)
+        _wait(navigation["seconds"])
+        self.current_url = navigation.get("current_url") or url
+        self.page_source = navigation["page_source"] or ""
+        self._soup = None
+
+def recorded(browser):
+    """returns browser wrapped in a RecordingBrowser when recording, otherwise browser itself"""
+    return RecordingBrowser(browser, get_archive()) if recording() else browser
+
+def record_completion(model: str, messages: list, response, seconds: float):
+    """stores a completion when recording"""
+    if not recording():
+        return
+    get_archive().write("completions", {
+        "key": completion_key(model, messages),
+        "model": model,
+        "messages": messages,
+        "response": response.model_dump(),
+        "seconds": round(seconds, 3),
+        "at": time.time(),
+    })
+
+def replay_completion(model: str, messages: list):
+    """returns the recorded response to this request as a ChatCompletion"""
+    from openai.types.chat import ChatCompletion
+
+    record = get_archive().completion(completion_key(model, messages))
+    _wait(record["seconds"])
+    return ChatCompletion.model_validate(record["response"])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarise a recorded crawl archive.")
+    parser.add_argument("archive", nargs="?", default=ARCHIVE)
+    args = parser.parse_args()
+    print(json.dumps(Archive(args.archive).stats(), indent=2))
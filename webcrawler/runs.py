@@ -0,0 +1,213 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from webcrawler import llm_scheduler
+from webcrawler.jobs import JOB_DONE, JOB_FAILED, JOB_LEASE, JOB_QUEUED
+from webcrawler.alerts import normalize_hall_name
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RUN_DISCOVERING = "discovering"
+RUN_DISPATCHING = "dispatching"
+RUN_DONE = "done"
+RUN_FAILED = "failed"
+
+# how many halls from one run may be in the job queue at once
+NEW_HALLS_CONCURRENCY = int(os.getenv("NEW_HALLS_CONCURRENCY", "1"))
+# most hall crawls new_halls_today may start per UTC day, across all runs
+NEW_HALLS_DAILY_BUDGET = int(os.getenv("NEW_HALLS_DAILY_BUDGET", "20"))
+
+class PipelineRuns:
+    """Background runs that discover entities and feed them to the JobQueue.
+
+    A run returns its id immediately; a dispatcher thread then submits items
+    only while the run is under its concurrency, the job pool has free
+    workers and the daily budget isn't spent. Progress is kept on the run
+    document in mongo. Items skipped because the budget was spent are
+    carried over to the next run, and on_dispatch(item) is called for each
+    item once its job is submitted. Like a running job, a run carries a
+    lease its process heartbeats, so another process only takes over runs
+    whose owner died.
+    """
+    def __init__(self, collection, job_queue, discover, task: str = "hall", origin: str = "new_halls_today",
+                 concurrency: int = NEW_HALLS_CONCURRENCY, daily_budget: int = NEW_HALLS_DAILY_BUDGET,
+                 poll_interval: float = 15, on_dispatch=None):
+        self.collection = collection
+        self.job_queue = job_queue
+        self.discover = discover
+        self.on_dispatch = on_dispatch
+        self.task = task
+        self.origin = origin
+        self.concurrency = concurrency
+        self.daily_budget = daily_budget
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+
+    def get(self, run_id: str):
+        """returns the run document, or None if there is no such run"""
+        return self.collection.find_one({"_id": run_id})
+
+    def active_run(self):
+        """returns the run that is still discovering or dispatching, if any"""
+        return self.collection.find_one({"status": {"$in": [RUN_DISCOVERING, RUN_DISPATCHING]}})
+
+    def fail_interrupted(self) -> int:
+        """marks runs whose process died (their lease lapsed) as failed so new runs can start"""
+        now = datetime.utcnow()
+        result = self.collection.update_many(
+            {"status": {"$in": [RUN_DISCOVERING, RUN_DISPATCHING]},
+             "$or": [{"leaseExpiresAt": {"$lt": now}}, {"leaseExpiresAt": {"$exists": False}}]},
+            {"$set": {"status": RUN_FAILED, "error": "interrupted", "finishedAt": now}})
+        return result.modified_count
+
+    def _heartbeat(self, run_id: str, stop: threading.Event):
+        """renews the run's lease until stop is set"""
+        while not stop.wait(JOB_LEASE.total_seconds() / 3):
+            try:
+                self.collection.update_one({"_id": run_id}, {"$set": {"leaseExpiresAt": datetime.utcnow() + JOB_LEASE}})
+            except Exception as e:
+                logger.error(f"Error renewing the lease of {self.origin} run {run_id}: {e}")
+
+    def budget_remaining(self) -> int:
+        """returns how many more jobs this pipeline may start today"""
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        started_today = self.job_queue.collection.count_documents(
+            {"payload.origin": self.origin, "createdAt": {"$gte": today}})
+        return max(0, self.daily_budget - started_today)
+
+    def start_run(self, trigger: str = "manual") -> str:
+        """starts a run in the background and returns its id, or the id of the run already in progress"""
+        with self._lock:
+            self.fail_interrupted()
+            active = self.active_run()
+            if active is not None:
+                return active["_id"]
+            run_id = uuid.uuid4().hex
+            self.collection.insert_one({
+                "_id": run_id,
+                "origin": self.origin,
+                "trigger": trigger,
+                "status": RUN_DISCOVERING,
+                "createdAt": datetime.utcnow(),
+                "leaseExpiresAt": datetime.utcnow() + JOB_LEASE,
+                "total": 0, "dispatched": 0, "completed": 0, "failed": 0, "skipped": 0,
+                "items": [],
+            })
+        threading.Thread(target=self._execute, args=(run_id,), name=f"run-{run_id[:8]}", daemon=True).start()
+        return run_id
+
+    def _save(self, run_id: str, items: list, **fields):
+        counts = {"total": len(items), "dispatched": 0, "completed": 0, "failed": 0, "skipped": 0}
+        for item in items:
+            if item["job_id"]:
+                counts["dispatched"] += 1
+            if item["status"] == JOB_DONE:
+                counts["completed"] += 1
+            elif item["status"] == JOB_FAILED:
+                counts["failed"] += 1
+            elif item["status"] == "skipped":
+                counts["skipped"] += 1
+        self.collection.update_one({"_id": run_id}, {"$set": {"items": items, **counts, **fields}})
+
+    def _carry_over(self, run_id: str) -> list:
+        """moves the items earlier runs skipped for lack of budget into run_id and returns them.
+        They are saved on run_id before being marked carried over in their old runs, so they can't get lost in between."""
+        runs = list(self.collection.find({"origin": self.origin, "_id": {"$ne": run_id}, "items.status": "skipped"},
+                                         {"items": 1}))
+        items = [{"name": item["name"], "source": item.get("source"), "job_id": None, "status": "pending"}
+                 for run in runs for item in run["items"] if item["status"] == "skipped"]
+        if not items:
+            return items
+        self._save(run_id, items)
+        for run in runs:
+            for item in run["items"]:
+                if item["status"] == "skipped":
+                    item["status"] = "carried_over"
+            self.collection.update_one({"_id": run["_id"]}, {"$set": {"items": run["items"]}})
+        return items
+
+    def _execute(self, run_id: str):
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(run_id, stop), name=f"run-{run_id[:8]}-lease", daemon=True).start()
+        items = []
+        try:
+            carried = items = self._carry_over(run_id)
+            # background work, so its LLM calls wait behind the ones users are waiting on
+            with llm_scheduler.priority(llm_scheduler.BATCH):
+                discovered = self.discover()
+            merged = {normalize_hall_name(item["name"]): item for item in carried}
+            for entry in discovered:
+                merged.setdefault(normalize_hall_name(entry["food_hall_name"]),
+                                  {"name": entry["food_hall_name"], "source": entry.get("source"), "job_id": None,
+                                   "status": "pending"})
+            items = list(merged.values())
+            if carried:
+                logger.info(f"Carried {len(carried)} skipped item(s) over into run {run_id}")
+            self._save(run_id, items, status=RUN_DISPATCHING)
+            self._dispatch(run_id, items)
+            self._save(run_id, items, status=RUN_DONE, finishedAt=datetime.utcnow())
+        except Exception as e:
+            logger.error(f"Error in {self.origin} run {run_id}: {e}")
+            # items never submitted are carried over to the next run like budget-skipped ones
+            for item in items:
+                if item["status"] == "pending":
+                    item["status"] = "skipped"
+            self._save(run_id, items, status=RUN_FAILED, error=str(e), finishedAt=datetime.utcnow())
+        finally:
+            stop.set()
+
+    def _dispatch(self, run_id: str, items: list):
+        while True:
+            in_flight = [item for item in items if item["job_id"] and item["status"] not in (JOB_DONE, JOB_FAILED)]
+            for item in in_flight:
+                job = self.job_queue.get(item["job_id"], include_result=False)
+                item["status"] = job["status"] if job else JOB_FAILED
+            in_flight = [item for item in in_flight if item["status"] not in (JOB_DONE, JOB_FAILED)]
+            pending = [item for item in items if item["status"] == "pending"]
+
+            if pending:
+                budget = self.budget_remaining()
+                if budget == 0:
+                    for item in pending:
+                        item["status"] = "skipped"
+                    logger.info(f"Daily budget of {self.daily_budget} reached, skipped {len(pending)} item(s) in run {run_id}")
+                    pending = []
+                # admit new work only once our queued jobs have been picked up by a free worker
+                elif not any(item["status"] == JOB_QUEUED for item in in_flight):
+                    slots = min(self.concurrency - len(in_flight), self.job_queue.free_slots(), budget)
+                    for item in pending[:max(0, slots)]:
+                        item["job_id"], _ = self.job_queue.submit(
+                            self.task, {"search_key": item["name"], "source": item["source"], "origin": self.origin, "run_id": run_id},
+                            dedupe_key=normalize_hall_name(item["name"]))
+                        item["status"] = JOB_QUEUED
+                        in_flight.append(item)
+                        if self.on_dispatch is not None:
+                            self.on_dispatch(item)
+                    pending = [item for item in items if item["status"] == "pending"]
+
+            self._save(run_id, items)
+            if not pending and not in_flight:
+                return
+            time.sleep(self.poll_interval)
+
+    def schedule_daily(self, hour: int):
+        """starts a thread that kicks off a run every day at the given UTC hour"""
+        def loop():
+            while True:
+                now = datetime.utcnow()
+                next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+                if next_run <= now:
+                    next_run += timedelta(days=1)
+                time.sleep((next_run - now).total_seconds())
+                try:
+                    run_id = self.start_run(trigger="schedule")
+                    logger.info(f"Started scheduled {self.origin} run {run_id}")
+                except Exception as e:
+                    logger.error(f"Error starting scheduled {self.origin} run: {e}")
+
+        threading.Thread(target=loop, name=f"{self.origin}-schedule", daemon=True).start()
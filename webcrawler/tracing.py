@@ -0,0 +1,408 @@
+"""Traces of crawl jobs: which span (research task, search, page load, LLM call,
+mongo write) ran when, in which thread, and which of them the job waited on.
+
+    CRAWL_TRACE_EXPORT=file                    spans go to traces/<trace id>.jsonl (CRAWL_TRACE_DIR),
+                                               kept for CRAWL_TRACE_MAX_AGE_DAYS (7) days
+    CRAWL_TRACE_EXPORT=http://127.0.0.1:4318   spans are posted to a collector:
+        python -m webcrawler.tracing collect --port 4318
+    python -m webcrawler.tracing list
+    python -m webcrawler.tracing show <job id>
+    python -m webcrawler.tracing critical-path <job id>
+
+Every crawl job is one trace whose id is the job id. The current span lives in
+a context variable, so threads started with llm_usage.in_context (the venue
+research threads, the hall pipeline workers) add their spans under the span
+that started them. Log records carry the trace and span id ([trace/span] in
+the log format), so the interleaved logs of a venue's threads can be told
+apart. A span records its attributes (url, field, tokens, ...), thread,
+start, duration and outcome. Every span also opens a profiling.span, so a
+profiled job's trace.json shows the same spans.
+
+With CRAWL_TRACE_EXPORT unset no trace is started and span() costs a context
+variable lookup.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from webcrawler import profiling
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "" (off), "file" or the url of a collector
+TRACE_EXPORT = os.getenv("CRAWL_TRACE_EXPORT", "")
+TRACE_DIR = os.getenv("CRAWL_TRACE_DIR", "traces")
+# traces not written to for this long are deleted by the file exporter
+TRACE_MAX_AGE = float(os.getenv("CRAWL_TRACE_MAX_AGE_DAYS", "7")) * 86400
+# how often a file exporter looks for old traces to delete
+PRUNE_INTERVAL = 3600
+# spans an exporter holds before writing or posting them
+BATCH_SIZE = 200
+LOG_FORMAT = "%(levelname)s:%(name)s:[%(trace)s] %(message)s"
+
+_current = ContextVar("trace_span", default=None)
+
+def enabled() -> bool:
+    return bool(TRACE_EXPORT)
+
+def trace_path(trace_id: str, directory: str = TRACE_DIR) -> str:
+    """returns the file the spans of trace_id are stored in"""
+    return os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", str(trace_id)) + ".jsonl")
+
+def prune_traces(directory: str = TRACE_DIR, max_age: float = TRACE_MAX_AGE) -> int:
+    """deletes the traces under directory not written to for max_age seconds and returns how many"""
+    cutoff = time.time() - max_age
+    pruned = 0
+    for path in glob.glob(os.path.join(directory, "*.jsonl")):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                pruned += 1
+        except OSError:
+            # another process pruned it first
+            pass
+    return pruned
+
+class FileExporter:
+    """Appends spans to one <directory>/<trace id>.jsonl per trace, so reading
+    a trace doesn't mean reading all of them, and deletes old traces now and then."""
+    def __init__(self, directory: str = TRACE_DIR, max_age: float = TRACE_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+        self._lines = {}
+        self._count = 0
+        self._pruned_at = None
+        self._lock = threading.Lock()
+
+    def export(self, span: dict):
+        line = json.dumps(span, default=str) + "\n"
+        with self._lock:
+            self._lines.setdefault(span["trace_id"], []).append(line)
+            self._count += 1
+            full = self._count >= BATCH_SIZE
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            lines, self._lines, self._count = self._lines, {}, 0
+            prune = self._pruned_at is None or time.monotonic() - self._pruned_at > PRUNE_INTERVAL
+            if prune:
+                self._pruned_at = time.monotonic()
+        if lines:
+            os.makedirs(self.directory, exist_ok=True)
+        for trace_id, trace_lines in lines.items():
+            try:
+                with open(trace_path(trace_id, self.directory), "a") as fp:
+                    fp.write("".join(trace_lines))
+            except OSError as e:
+                logger.error(f"Error writing {len(trace_lines)} spans of trace {trace_id}: {e}")
+        if prune:
+            pruned = prune_traces(self.directory, self.max_age)
+            if pruned:
+                logger.info(f"Deleted {pruned} trace(s) older than {self.max_age / 86400:g} days from {self.directory}")
+
+class CollectorExporter:
+    """Posts spans as JSON lists to a collector (python -m webcrawler.tracing collect)."""
+    def __init__(self, url: str, timeout: float = 5):
+        self.url = url.rstrip("/") + "/spans"
+        self.timeout = timeout
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span: dict):
+        with self._lock:
+            self._spans.append(span)
+            full = len(self._spans) >= BATCH_SIZE
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            spans, self._spans = self._spans, []
+        if not spans:
+            return
+        request = urllib.request.Request(self.url, data=json.dumps(spans, default=str).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        try:
+            urllib.request.urlopen(request, timeout=self.timeout).close()
+        except OSError as e:
+            logger.error(f"Error exporting {len(spans)} spans to {self.url}: {e}")
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+def get_exporter():
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = FileExporter() if TRACE_EXPORT == "file" else CollectorExporter(TRACE_EXPORT)
+        return _exporter
+
+class Span:
+    """One timed operation of a trace; use as a context manager, set(...) adds attributes."""
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.start = None
+        self._started = None
+        self._token = None
+        self._profile = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._token = _current.set(self)
+        self._profile = profiling.span(self.name, **self.attributes)
+        self._profile.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._started
+        self._profile.__exit__(exc_type, exc, tb)
+        _current.reset(self._token)
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": round(duration, 6),
+            "thread": threading.current_thread().name,
+            "pid": os.getpid(),
+            "outcome": "ok" if exc_type is None else "error",
+            "attributes": self.attributes,
+        }
+        if exc_type is not None:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        exporter = get_exporter()
+        exporter.export(record)
+        if self.parent_id is None:
+            exporter.flush()
+        return False
+
+class _NoSpan:
+    """What span() returns outside a trace: set() does nothing, the profiler still sees the block."""
+    def __init__(self, profile=None):
+        self._profile = profile
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        if self._profile is not None:
+            self._profile.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._profile is not None:
+            self._profile.__exit__(exc_type, exc, tb)
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def trace(name: str, trace_id: str = None, **attributes):
+    """with trace("venue_job", trace_id=job id): the root span of a trace, a no-op span when tracing is off"""
+    if not enabled():
+        return _NO_SPAN
+    return Span(name, str(trace_id or uuid.uuid4().hex), attributes=attributes)
+
+def job_trace(job: dict, **attributes):
+    """trace(...) of a crawl job, named after its task and identified by its id"""
+    return trace(f"{job.get('task', 'crawl')}_job", trace_id=str(job["_id"]), **attributes)
+
+def span(name: str, **attributes):
+    """with span("search", query=...) as span: a child of the current span, span.set(...) adds attributes"""
+    parent = _current.get()
+    if parent is None:
+        return _NoSpan(profiling.span(name, **attributes)) if profiling.active() else _NO_SPAN
+    return Span(name, parent.trace_id, parent.span_id, attributes)
+
+_record_factory = logging.getLogRecordFactory()
+
+def _correlated_record(*args, **kwargs):
+    record = _record_factory(*args, **kwargs)
+    current = _current.get()
+    record.trace = f"{current.trace_id}/{current.span_id}" if current is not None else "-"
+    return record
+
+def install_log_correlation():
+    """adds [trace id/span id] to every log line of the root logger's handlers"""
+    logging.setLogRecordFactory(_correlated_record)
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+if enabled():
+    install_log_correlation()
+
+def load_spans(trace_id: str, directory: str = TRACE_DIR) -> list[dict]:
+    """returns the exported spans of trace_id"""
+    try:
+        with open(trace_path(trace_id, directory)) as fp:
+            return [json.loads(line) for line in fp if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def load_roots(directory: str = TRACE_DIR) -> list[dict]:
+    """returns the root span of every stored trace, read from the end of its file where the root is written last"""
+    roots = []
+    for path in glob.glob(os.path.join(directory, "*.jsonl")):
+        with open(path, "rb") as fp:
+            fp.seek(0, os.SEEK_END)
+            size = min(fp.tell(), 65536)
+            fp.seek(-size, os.SEEK_END)
+            lines = [line for line in fp.read(size).splitlines() if line.strip()]
+        try:
+            record = json.loads(lines[-1]) if lines else None
+        except ValueError:
+            continue
+        if record is not None and record.get("parent_id") is None:
+            roots.append(record)
+    return roots
+
+def _children(spans: list[dict]) -> dict:
+    children = {}
+    for record in spans:
+        children.setdefault(record["parent_id"], []).append(record)
+    for siblings in children.values():
+        siblings.sort(key=lambda record: record["start"])
+    return children
+
+def critical_path(spans: list[dict]) -> list[dict]:
+    """returns the spans a trace's latency comes from, each with the seconds of it spent in that span itself.
+
+    Walks back from the end of the root: of the children that finished before
+    the point reached so far, the one finishing last is what the parent was
+    waiting on, so it is followed, and time no child covers is the parent's own."""
+    children = _children(spans)
+    roots = children.get(None, [])
+    if not roots:
+        return []
+    path = []
+
+    def walk(record: dict):
+        cursor = record["start"] + record["duration"]
+        own = 0.0
+        pending = sorted(children.get(record["span_id"], []), key=lambda child: child["start"] + child["duration"])
+        entries = []
+        while pending:
+            child = pending.pop()
+            child_end = child["start"] + child["duration"]
+            if child_end > cursor:
+                continue
+            own += cursor - child_end
+            entries.append(child)
+            cursor = child["start"]
+            # children that started later than this one overlap it and are off the path
+            pending = [other for other in pending if other["start"] + other["duration"] <= cursor]
+        own += max(0.0, cursor - record["start"])
+        path.append({**record, "self": own})
+        for child in reversed(entries):
+            walk(child)
+
+    walk(max(roots, key=lambda record: record["duration"]))
+    path.sort(key=lambda record: record["start"])
+    return path
+
+def print_tree(spans: list[dict]):
+    children = _children(spans)
+    if not spans:
+        return
+    origin = min(record["start"] for record in spans)
+
+    def show(record: dict, depth: int):
+        attributes = " ".join(f"{key}={value}" for key, value in record["attributes"].items())
+        flag = f" {record.get('error')}" if record["outcome"] != "ok" else ""
+        print(f"{record['start'] - origin:>8.2f}s {record['duration']:>8.2f}s  {'  ' * depth}{record['name']} "
+              f"[{record['thread']}] {attributes}{flag}")
+        for child in children.get(record["span_id"], []):
+            show(child, depth + 1)
+
+    for root in children.get(None, []):
+        show(root, 0)
+
+def print_critical_path(spans: list[dict]):
+    path = critical_path(spans)
+    if not path:
+        print("no root span, is the trace complete?")
+        return
+    total = sum(record["self"] for record in path)
+    origin = path[0]["start"]
+    print(f"critical path: {total:.2f}s over {len(path)} spans")
+    for record in path:
+        attributes = " ".join(f"{key}={value}" for key, value in record["attributes"].items())
+        print(f"{record['start'] - origin:>8.2f}s {record['self']:>8.2f}s {record['self'] / total:>6.1%}  "
+              f"{record['name']} [{record['thread']}] {attributes}")
+    by_name = {}
+    for record in path:
+        by_name[record["name"]] = by_name.get(record["name"], 0.0) + record["self"]
+    print("\nby span:")
+    for name, seconds in sorted(by_name.items(), key=lambda item: -item[1]):
+        print(f"{name:<40} {seconds:>8.2f}s {seconds / total:>6.1%}")
+
+class _CollectorHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.rstrip("/") != "/spans":
+            self.send_error(404)
+            return
+        spans = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        for record in spans:
+            self.server.exporter.export(record)
+        self.server.exporter.flush()
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def collect(port: int, directory: str):
+    """receives spans posted by CollectorExporters and stores them as a FileExporter would"""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _CollectorHandler)
+    server.exporter = FileExporter(directory)
+    print(f"Collecting spans on port {port} into {directory} (CRAWL_TRACE_EXPORT=http://<host>:{port})")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Collect and inspect crawl traces.")
+    parser.add_argument("--dir", default=TRACE_DIR, help="where spans are stored")
+    commands = parser.add_subparsers(dest="command", required=True)
+    collector = commands.add_parser("collect", help="receive spans from crawl processes")
+    collector.add_argument("--port", type=int, default=4318)
+    commands.add_parser("list", help="list stored traces")
+    for command in ("show", "critical-path"):
+        commands.add_parser(command).add_argument("trace_id")
+    args = parser.parse_args()
+
+    if args.command == "collect":
+        collect(args.port, args.dir)
+        sys.exit(0)
+    if args.command == "list":
+        for record in sorted(load_roots(args.dir), key=lambda record: record["start"]):
+            print(f"{record['trace_id']}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['start']))}  "
+                  f"{record['duration']:>8.1f}s  {record['name']} {record['attributes']}")
+        sys.exit(0)
+    spans = load_spans(args.trace_id, args.dir)
+    if not spans:
+        print(f"no spans of trace {args.trace_id} in {args.dir}")
+        sys.exit(1)
+    if args.command == "show":
+        print_tree(spans)
+    else:
+        print_critical_path(spans)